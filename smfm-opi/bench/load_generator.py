@@ -0,0 +1,372 @@
+"""
+Synthetic ESP32 traffic for benchmarking the ingest pipeline.
+
+The traffic can be published to a real broker, or delivered in-process through
+FakeMqttClient, a stand-in for paho's Client that MqttWorker accepts as its
+client_factory, or written to a capture file (storage/capture.py) for replay.
+Run standalone to drive a running GUI through a broker, or to write a capture:
+
+    python -m bench.load_generator --broker localhost --scales 24 --rate 100
+    python -m bench.load_generator --capture traffic.smfmcap --duration 600
+"""
+import argparse
+import collections
+import json
+import math
+import random
+import threading
+import time
+
+from core.payload import encode_weight_batch
+from storage.capture import CaptureWriter
+from utils import clock
+from utils.constants import (
+    TOPIC_ROOT, WEIGHT_TOPIC_SUFFIX, STATUS_TOPIC_SUFFIX, ACK_TOPIC_SUFFIX, COMMAND_TOPIC_SUFFIX, TOPIC_LOG,
+    CAPTURE_BUFFER_BYTES
+)
+
+PAYLOAD_FORMATS = ("text", "binary")
+
+
+class SyntheticTraffic:
+    """
+    Generates the messages of n_scales scales: weight samples at weight_rate_hz
+    per scale following a fill/dispense cycle, a status code every
+    status_interval_s and a device log line every log_interval_s.
+    With payload_format "binary", weights are sent samples_per_message at a time
+    as binary batches (core.payload) instead of one text message per sample.
+    """
+    def __init__(self, n_scales, weight_rate_hz, status_interval_s=5.0, log_interval_s=2.0,
+                 cycle_period_s=60.0, capacity_kg=50.0, seed=0, payload_format="text", samples_per_message=1):
+        if payload_format not in PAYLOAD_FORMATS:
+            raise ValueError(f"unknown payload format '{payload_format}'")
+        self.scale_ids = [f"s{i:02d}" for i in range(1, n_scales + 1)]
+        self.weight_rate_hz = weight_rate_hz
+        self.payload_format = payload_format
+        self.samples_per_message = samples_per_message if payload_format == "binary" else 1
+        self._sequences = [0] * n_scales
+        self._status_interval = status_interval_s
+        self._log_interval = log_interval_s
+        self._cycle_period = cycle_period_s
+        self._capacity = capacity_kg
+        self._random = random.Random(seed)
+        self._weight_topics = [TOPIC_ROOT + s + "/" + WEIGHT_TOPIC_SUFFIX for s in self.scale_ids]
+        self._status_topics = [TOPIC_ROOT + s + "/" + STATUS_TOPIC_SUFFIX for s in self.scale_ids]
+        self._phases = [self._random.random() for _ in self.scale_ids]
+
+    @property
+    def topics(self):
+        """Every topic this traffic publishes on."""
+        return self._weight_topics + self._status_topics + [TOPIC_LOG]
+
+    @property
+    def messages_per_second(self):
+        n = len(self.scale_ids)
+        weight_messages = n * self.weight_rate_hz / self.samples_per_message
+        return weight_messages + n / self._status_interval + 1.0 / self._log_interval
+
+    def _weight(self, i, t):
+        # Sawtooth: filled to capacity, then dispensed linearly, plus measurement noise
+        cycle = (t / self._cycle_period + self._phases[i]) % 1.0
+        return self._capacity * (1.0 - cycle) + self._random.gauss(0.0, 0.01)
+
+    def messages(self, t_start, t_end, elapsed, topics=None):
+        """
+        Yields (topic, payload bytes) of every message due in the tick [t_start, t_end)
+        of the generator clock. elapsed is used for the weight waveform.
+        topics restricts the messages to a set of topics (None = all).
+        """
+        period = 1.0 / self.weight_rate_hz
+        first = math.ceil(t_start / period)
+        last = math.ceil(t_end / period)
+        weight_topics = [(i, topic) for i, topic in enumerate(self._weight_topics) if topics is None or topic in topics]
+        if self.payload_format == "text":
+            for k in range(first, last):
+                for i, topic in weight_topics:
+                    yield topic, f"{self._weight(i, k * period):.3f}".encode()
+        else:
+            # A message leaves once its last sample is due
+            n = self.samples_per_message
+            offsets = [j * period for j in range(n)]
+            for k in range(first, last):
+                if (k + 1) % n:
+                    continue
+                t_base = (k + 1 - n) * period
+                for i, topic in weight_topics:
+                    weights = [self._weight(i, t_base + offset) for offset in offsets]
+                    yield topic, encode_weight_batch(self.scale_ids[i], self._sequences[i], t_base, offsets, weights)
+                    self._sequences[i] += 1
+
+        if math.floor(t_end / self._status_interval) > math.floor(t_start / self._status_interval):
+            code = 3 if int(t_end / self._status_interval) % 2 else 2
+            for topic in self._status_topics:
+                if topics is None or topic in topics:
+                    yield topic, str(code).encode()
+
+        if (math.floor(t_end / self._log_interval) > math.floor(t_start / self._log_interval)
+                and (topics is None or TOPIC_LOG in topics)):
+            yield TOPIC_LOG, f"heartbeat t={elapsed:.1f}s".encode()
+
+
+class _FakeMessage:
+    """Minimal paho MQTTMessage replacement (topic and payload only)."""
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class _PacedLoop:
+    """
+    Runs traffic in ticks of tick_s on a background thread, catching up in bursts when late.
+    topics (a set, may grow while running) restricts the traffic as in SyntheticTraffic.messages().
+    """
+    def __init__(self, traffic, sink, tick_s=0.005, topics=None):
+        self._traffic = traffic
+        self._sink = sink
+        self._tick = tick_s
+        self._topics = topics
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="SyntheticTraffic", daemon=True)
+        self.sent_messages = 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        start = time.perf_counter()
+        generated_until = 0.0
+        while not self._stop_event.is_set():
+            now = time.perf_counter() - start
+            for topic, payload in self._traffic.messages(generated_until, now, now, self._topics):
+                self._sink(topic, payload)
+                self.sent_messages += 1
+            generated_until = now
+            self._stop_event.wait(self._tick)
+
+
+class _FakePublishInfo:
+    """Minimal paho MQTTMessageInfo replacement."""
+    __slots__ = ("rc",)
+
+    def __init__(self, rc):
+        self.rc = rc
+
+
+class FakeMqttClient:
+    """
+    In-process stand-in for paho.mqtt.client.Client. The first connect() starts feeding
+    the synthetic traffic of the subscribed topics straight into on_message, with no
+    broker and no sockets; loop() only waits. Commands published to a scale are acknowledged after ack_delay_s, like a device would.
+
+    simulate_outage(seconds) drops the connection and refuses connections for that long,
+    like a broker restart. With clean_session off, traffic generated meanwhile is held
+    and delivered on reconnection, like a broker keeping a persistent session.
+
+    Use traffic_client_factory() to build a factory bound to a SyntheticTraffic.
+    """
+    def __init__(self, traffic, callback_api_version=None, client_id="", clean_session=None, ack_delay_s=0.005,
+                 max_held_messages=100000):
+        self._traffic = traffic
+        self._ack_delay = ack_delay_s
+        self._persistent = clean_session is False
+        self._connected = False
+        self._down_until = 0.0
+        self._held = collections.deque(maxlen=max_held_messages)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._subscribed = set() # Topics of the traffic matched by a subscription
+        self._loop = None
+        self.published = []
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+
+    @property
+    def sent_messages(self):
+        return self._loop.sent_messages if self._loop else 0
+
+    def connect(self, host, port=1883, keepalive=60):
+        if time.monotonic() < self._down_until:
+            raise ConnectionRefusedError("broker down (simulated outage)")
+        with self._lock:
+            self._connected = True
+            self._wakeup.clear()
+        if self.on_connect:
+            self.on_connect(self, None, None, 0, None)
+        # New traffic keeps queueing behind the held messages until they are all delivered
+        while True:
+            with self._lock:
+                if not self._held:
+                    break
+                topic, payload = self._held.popleft()
+            self.on_message(self, None, _FakeMessage(topic, payload))
+        if self._loop is None:
+            self._loop = _PacedLoop(self._traffic, self._deliver, topics=self._subscribed)
+            self._loop.start()
+        return 0
+
+    def loop(self, timeout=1.0):
+        self._wakeup.wait(timeout)
+        if self._connected:
+            return 0
+        if self.on_disconnect:
+            self.on_disconnect(self, None, None, 7, None) # MQTT_ERR_CONN_LOST
+        return 7
+
+    def simulate_outage(self, seconds):
+        """Drops the connection and refuses new ones for seconds."""
+        self._down_until = time.monotonic() + seconds
+        with self._lock:
+            self._connected = False
+        self._wakeup.set()
+
+    def _deliver(self, topic, payload):
+        with self._lock:
+            if not self._connected or self._held:
+                if self._persistent:
+                    self._held.append((topic, payload))
+                return
+        self.on_message(self, None, _FakeMessage(topic, payload))
+
+    def disconnect(self):
+        with self._lock:
+            self._connected = False
+        self._wakeup.set()
+        if self._loop:
+            self._loop.stop()
+            self._loop = None
+
+    def is_connected(self):
+        return self._connected
+
+    def subscribe(self, topic, qos=0):
+        from paho.mqtt.client import topic_matches_sub
+        self._subscribed.update(t for t in self._traffic.topics if topic_matches_sub(topic, t))
+        return 0, 0
+
+    def unsubscribe(self, topic):
+        from paho.mqtt.client import topic_matches_sub
+        self._subscribed.difference_update(t for t in self._traffic.topics if topic_matches_sub(topic, t))
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self._connected:
+            return _FakePublishInfo(4) # MQTT_ERR_NO_CONN
+        self.published.append((topic, payload))
+        scale_id, _, suffix = topic[len(TOPIC_ROOT):].partition("/")
+        if topic.startswith(TOPIC_ROOT) and suffix.startswith(COMMAND_TOPIC_SUFFIX) and suffix != ACK_TOPIC_SUFFIX:
+            self._acknowledge(scale_id, suffix[len(COMMAND_TOPIC_SUFFIX):], payload)
+        return _FakePublishInfo(0)
+
+    def _acknowledge(self, scale_id, command, payload):
+        try:
+            ack = {"cid": json.loads(payload)["cid"], "ok": True}
+        except (ValueError, TypeError, KeyError):
+            ack = {"cmd": command, "ok": True} # Plain payload, as sent to older firmware
+        ack_topic = TOPIC_ROOT + scale_id + "/" + ACK_TOPIC_SUFFIX
+        timer = threading.Timer(self._ack_delay, self._deliver, (ack_topic, json.dumps(ack).encode()))
+        timer.daemon = True
+        timer.start()
+
+
+def traffic_client_factory(traffic, created_clients=None):
+    """Returns a client_factory for MqttWorker that builds FakeMqttClients fed by traffic."""
+    def factory(callback_api_version, client_id="", clean_session=None):
+        client = FakeMqttClient(traffic, callback_api_version, client_id, clean_session)
+        if created_clients is not None:
+            created_clients.append(client)
+        return client
+    return factory
+
+
+def synthetic_client(callback_api_version=None, client_id="", clean_session=None, **traffic_options):
+    """
+    client_factory building a FakeMqttClient with its own SyntheticTraffic(**traffic_options).
+    Unlike traffic_client_factory() it can be pickled (bound with functools.partial),
+    so shard processes (core.sharding) can use it.
+    """
+    return FakeMqttClient(SyntheticTraffic(**traffic_options), callback_api_version, client_id, clean_session)
+
+
+class BrokerPublisher:
+    """Publishes synthetic traffic to a real MQTT broker."""
+    def __init__(self, traffic, broker, port):
+        import paho.mqtt.client as mqtt
+        self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="smfm_load_generator")
+        self._client.connect(broker, port)
+        self._client.loop_start()
+        self._loop = _PacedLoop(traffic, self._client.publish)
+
+    @property
+    def sent_messages(self):
+        return self._loop.sent_messages
+
+    def start(self):
+        self._loop.start()
+
+    def stop(self):
+        self._loop.stop()
+        self._client.loop_stop()
+        self._client.disconnect()
+
+
+def write_capture(traffic, path, duration_s, tick_s=0.005):
+    """
+    Writes duration_s seconds of traffic to a new capture file, as fast as it is
+    generated, stamped as if received from now on. Returns the number of messages.
+    """
+    writer = CaptureWriter(path, CAPTURE_BUFFER_BYTES)
+    start = clock.now()
+    t = 0.0
+    while t < duration_s:
+        end = min(t + tick_s, duration_s)
+        for topic, payload in traffic.messages(t, end, end):
+            writer.write(start + end, topic, payload)
+        t = end
+    writer.close()
+    return writer.frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish synthetic scale traffic to an MQTT broker.")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--scales", type=int, default=24)
+    parser.add_argument("--rate", type=float, default=100.0, help="Weight samples per second per scale")
+    parser.add_argument("--duration", type=float, default=0.0, help="Seconds to run (0 = until interrupted)")
+    parser.add_argument("--payload-format", choices=PAYLOAD_FORMATS, default="text")
+    parser.add_argument("--samples-per-message", type=int, default=16, help="Samples per binary weight message")
+    parser.add_argument("--capture", metavar="PATH", help="Write --duration seconds of traffic to a capture file instead of publishing")
+    args = parser.parse_args()
+
+    traffic = SyntheticTraffic(
+        args.scales, args.rate, payload_format=args.payload_format, samples_per_message=args.samples_per_message
+    )
+    if args.capture:
+        if args.duration <= 0:
+            parser.error("--capture needs a --duration")
+        print(f"Wrote {write_capture(traffic, args.capture, args.duration)} messages to {args.capture}")
+        return
+    publisher = BrokerPublisher(traffic, args.broker, args.port)
+    print(f"Publishing {traffic.messages_per_second:.0f} msg/s to {args.broker}:{args.port}")
+    publisher.start()
+    try:
+        deadline = time.monotonic() + args.duration if args.duration > 0 else None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.stop()
+    print(f"Sent {publisher.sent_messages} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+End-to-end benchmark of the MqttWorker -> process_mqtt_batch -> plot rendering path.
+
+The GUI runs headless on the offscreen Qt platform, fed either in-process by
+FakeMqttClient (default), through the configured broker (--use-broker), or by
+replaying captured traffic (--replay, as fast as possible unless --replay-speed).
+Results are written as JSON to bench/results/ so runs can be compared:
+
+    python -m bench.run_benchmark --scales 24 --rate 100 --duration 30
+    python -m bench.run_benchmark --replay captures/<capture directory> --duration 60
+    python -m bench.run_benchmark --baseline bench/results/<previous run>.json
+"""
+import argparse
+import datetime
+import functools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Must be set before Qt is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from PyQt5 import QtCore, QtWidgets
+
+from bench.load_generator import (
+    PAYLOAD_FORMATS, SyntheticTraffic, BrokerPublisher, traffic_client_factory, synthetic_client
+)
+from mqtt.replay_client import ReplayClient
+from storage.capture import capture_paths
+from utils import clock
+from utils.process_stats import rss_mb
+from utils.constants import MQTT_BROKER, MQTT_PORT, MQTT_BATCH_INTERVAL_MS, PLOT_UPDATE_INTERVAL_MS, ALARM_RULES
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+LAG_PROBE_INTERVAL_MS = 10
+
+# Metric -> (direction, tolerance) used to flag regressions against a baseline.
+# "higher" means larger values are better.
+REGRESSION_RULES = {
+    "sustained_msgs_per_s": ("higher", 0.10),
+    "sustained_samples_per_s": ("higher", 0.10),
+    "latency_p99_ms": ("lower", 0.25),
+    "event_loop_lag_p99_ms": ("lower", 0.25),
+    "rss_growth_mb": ("lower", 0.50),
+    "reconnect_first_message_ms": ("lower", 0.50),
+}
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return {"p50": None, "p99": None, "max": None}
+    values = np.asarray(values) * 1000.0
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+class PipelineProbe(QtCore.QObject):
+    """
+    Observes a ScaleMonitorWindow from the GUI thread: counts delivered messages,
+    measures receive-to-plot latency of every weight sample at the next plot frame
+    tick and samples the event-loop lag with a high-frequency timer. Without
+    measure_latency (replays at other than real time, where the clock runs
+    on the replay timeline and latencies would be scaled by the speed) the
+    latency is not measured.
+    """
+    def __init__(self, window, measure_latency=True):
+        super().__init__(window)
+        self._measure_latency = measure_latency
+        # Connected after the window's own slots, so these run right after them
+        window.mqtt_worker.batch_received.connect(self._on_batch)
+        window.render_scheduler.frame_rendered.connect(self._on_plot_update)
+
+        self._lag_timer = QtCore.QTimer(self)
+        self._lag_timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self._lag_timer.setInterval(LAG_PROBE_INTERVAL_MS)
+        self._lag_timer.timeout.connect(self._on_lag_tick)
+        self._lag_timer.start()
+        self.reset()
+
+    @QtCore.pyqtSlot()
+    def reset(self):
+        self.processed_messages = 0
+        self.processed_samples = 0
+        self.frames = 0
+        self._unplotted = []
+        self._latencies = []
+        self._lags = []
+        self._last_lag_tick = time.perf_counter()
+        self.started_at = time.perf_counter()
+        self.rss_start_mb = rss_mb()
+
+    @QtCore.pyqtSlot(object)
+    def _on_batch(self, batch):
+        self.processed_messages += batch.message_count
+        # Receive times of the weight samples, plotted at the next frame
+        if self._measure_latency:
+            self._unplotted.extend(times for times, _, _ in batch.samples.values())
+        self.processed_samples += sum(len(times) for times, _, _ in batch.samples.values())
+
+    @QtCore.pyqtSlot(float)
+    def _on_plot_update(self, frame_time):
+        now = clock.now()
+        if self._unplotted:
+            self._latencies.extend(now - np.concatenate(self._unplotted))
+        self._unplotted = []
+        self.frames += 1
+
+    @QtCore.pyqtSlot()
+    def _on_lag_tick(self):
+        now = time.perf_counter()
+        self._lags.append(max(0.0, now - self._last_lag_tick - LAG_PROBE_INTERVAL_MS / 1000.0))
+        self._last_lag_tick = now
+
+    def metrics(self):
+        elapsed = time.perf_counter() - self.started_at
+        latency = _percentiles(self._latencies)
+        lag = _percentiles(self._lags)
+        rss_end = rss_mb()
+        return {
+            "elapsed_s": elapsed,
+            "processed_messages": self.processed_messages,
+            "sustained_msgs_per_s": self.processed_messages / elapsed,
+            "sustained_samples_per_s": self.processed_samples / elapsed,
+            "frames_per_s": self.frames / elapsed,
+            "latency_p50_ms": latency["p50"],
+            "latency_p99_ms": latency["p99"],
+            "latency_max_ms": latency["max"],
+            "event_loop_lag_p50_ms": lag["p50"],
+            "event_loop_lag_p99_ms": lag["p99"],
+            "event_loop_lag_max_ms": lag["max"],
+            "rss_start_mb": self.rss_start_mb,
+            "rss_end_mb": rss_end,
+            "rss_growth_mb": rss_end - self.rss_start_mb,
+        }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _alarm_rules(extra):
+    """ALARM_RULES plus extra threshold rules per scale that never fire (--alarm-rules)."""
+    return list(ALARM_RULES) + [
+        {"type": "threshold", "scale": "*", "name": f"bench{i + 1}", "high": 1e9, "hysteresis": 1.0} for i in range(extra)
+    ]
+
+
+def run_benchmark(args):
+    """Runs one benchmark and returns the result dictionary."""
+    from gui.main_window import ScaleMonitorWindow
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    traffic_options = dict(
+        n_scales=args.scales, weight_rate_hz=args.rate, seed=args.seed,
+        payload_format=args.payload_format, samples_per_message=args.samples_per_message
+    )
+    traffic = SyntheticTraffic(**traffic_options)
+    alarm_rules = _alarm_rules(args.alarm_rules) if args.alarm_rules >= 0 else []
+    replay_paths = capture_paths(os.path.abspath(args.replay)) if args.replay else None
+
+    # Recordings and other working files go to a scratch directory
+    original_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="smfm_bench_")
+    os.chdir(workdir)
+    try:
+        publisher = None
+        clients = []
+        if replay_paths:
+            # The replay starts after the warmup, when the measurement starts, and is measured whole
+            replay_start = clock.now() + args.warmup
+            def replay_factory(*client_args, **client_kwargs):
+                client = ReplayClient(
+                    *client_args, paths=replay_paths, speed=args.replay_speed, start_time=replay_start, **client_kwargs
+                )
+                clients.append(client)
+                return client
+            window = ScaleMonitorWindow(mqtt_client_factory=replay_factory, alarm_rules=alarm_rules)
+            sent_messages = lambda: clients[0].delivered_messages if clients else 0
+        elif args.use_broker:
+            window = ScaleMonitorWindow(ingest_shards=args.shards, alarm_rules=alarm_rules)
+            publisher = BrokerPublisher(traffic, MQTT_BROKER, MQTT_PORT)
+            publisher.start()
+            sent_messages = lambda: publisher.sent_messages
+        elif args.shards:
+            # Every process generates the traffic of the topics it subscribes to
+            factory = functools.partial(synthetic_client, **traffic_options)
+            # Shards only ingest known scales until their status arrives
+            window = ScaleMonitorWindow(
+                mqtt_client_factory=factory, ingest_shards=args.shards, known_scale_ids=traffic.scale_ids,
+                alarm_rules=alarm_rules
+            )
+            generation_start = time.perf_counter()
+            sent_messages = lambda: traffic.messages_per_second * (time.perf_counter() - generation_start)
+        else:
+            window = ScaleMonitorWindow(mqtt_client_factory=traffic_client_factory(traffic, clients), alarm_rules=alarm_rules)
+            sent_messages = lambda: clients[0].sent_messages if clients else 0
+        window.show()
+        probe = PipelineProbe(window, measure_latency=not replay_paths or args.replay_speed == 1.0)
+
+        sent_at_start = [0]
+        def start_measuring():
+            probe.reset()
+            sent_at_start[0] = sent_messages()
+
+        warmup = max(0.0, replay_start - clock.now()) if replay_paths else args.warmup
+        # Precise, and ahead of a replay: a coarse timer firing after the replay started would miss its first messages
+        start_delay = max(0.0, warmup - 0.02) if replay_paths else warmup
+        QtCore.QTimer.singleShot(int(start_delay * 1000), QtCore.Qt.PreciseTimer, start_measuring)
+        # Registered by MqttClient; observed once per (re)connection
+        first_message = window.metrics.histogram("smfm_mqtt_time_to_first_message_seconds", "")
+        before_outage = [0, 0.0]
+        def start_outage():
+            before_outage[:] = [first_message.count, first_message.sum]
+            clients[0].simulate_outage(args.broker_outage)
+
+        if args.broker_outage and clients and not args.shards:
+            QtCore.QTimer.singleShot(int((warmup + args.duration / 2) * 1000), start_outage)
+        QtCore.QTimer.singleShot(int((warmup + args.duration) * 1000), app.quit)
+        if replay_paths:
+            # A replay ends early once the whole capture went through the pipeline
+            def check_replay_finished():
+                if clients and clients[0].finished.is_set() and probe.processed_messages >= sent_messages() - sent_at_start[0]:
+                    app.quit()
+            replay_timer = QtCore.QTimer()
+            replay_timer.timeout.connect(check_replay_finished)
+            replay_timer.start(100)
+        app.exec_()
+
+        metrics = probe.metrics()
+        offered = sent_messages() - sent_at_start[0]
+        metrics["offered_msgs_per_s"] = offered / metrics["elapsed_s"]
+        metrics["backlog_messages"] = offered - metrics["processed_messages"]
+        if args.broker_outage and first_message.count > before_outage[0]:
+            # Includes the outage itself: subtract it to get the reconnection overhead
+            offline_s = (first_message.sum - before_outage[1]) / (first_message.count - before_outage[0])
+            metrics["reconnect_first_message_ms"] = (offline_s - args.broker_outage) * 1000.0
+
+        if publisher:
+            publisher.stop()
+        window.close()
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "label": args.label,
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "source": "replay" if args.replay else "broker" if args.use_broker else "in_process",
+            "replay": args.replay,
+            "replay_speed": args.replay_speed if args.replay else None,
+            "ingest_shards": args.shards,
+            "scales": args.scales,
+            "weight_rate_hz": args.rate,
+            "payload_format": args.payload_format,
+            "samples_per_message": traffic.samples_per_message,
+            "warmup_s": warmup,
+            "duration_s": args.duration,
+            "batch_interval_ms": MQTT_BATCH_INTERVAL_MS,
+            "plot_update_interval_ms": PLOT_UPDATE_INTERVAL_MS,
+            "broker_outage_s": args.broker_outage,
+            "alarm_rules": len(alarm_rules),
+        },
+        "metrics": metrics,
+    }
+
+
+def compare_with_baseline(result, baseline):
+    """Prints metric deltas against a baseline result and returns the list of regressed metrics."""
+    regressions = []
+    print(f"{'metric':<26}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, (direction, tolerance) in REGRESSION_RULES.items():
+        old, new = baseline["metrics"].get(name), result["metrics"].get(name)
+        if old is None or new is None:
+            continue
+        change = (new - old) / abs(old) if old else 0.0
+        regressed = change < -tolerance if direction == "higher" else change > tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<26}{old:>12.2f}{new:>12.2f}{change:>+9.0%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless end-to-end benchmark of the ingest and plotting pipeline.")
+    parser.add_argument("--scales", type=int, default=24)
+    parser.add_argument("--rate", type=float, default=100.0, help="Weight samples per second per scale")
+    parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds discarded before measuring")
+    parser.add_argument("--payload-format", choices=PAYLOAD_FORMATS, default="text",
+                        help="Weight payloads: one text float per message, or binary batches")
+    parser.add_argument("--samples-per-message", type=int, default=16, help="Samples per binary weight message")
+    parser.add_argument("--use-broker", action="store_true", help="Go through the configured broker instead of the in-process fake client")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="Ingest the weights in this many processes (0 = in the GUI process)")
+    parser.add_argument("--broker-outage", type=float, default=0.0,
+                        help="Simulate a broker restart of this many seconds halfway through (in-process only)")
+    parser.add_argument("--replay", metavar="CAPTURE", help="Replay a capture file or directory instead of synthetic traffic")
+    parser.add_argument("--replay-speed", type=float, default=0.0, help="Replay speed (0 = as fast as possible, 1 = real time)")
+    parser.add_argument("--alarm-rules", type=int, default=0,
+                        help="Threshold rules per scale added to ALARM_RULES (-1 = no alarm rules at all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="Free-form tag stored with the result")
+    parser.add_argument("--output-dir", default=RESULTS_DIR)
+    parser.add_argument("--baseline", help="Result file to compare against")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+    if args.replay and (args.shards or args.use_broker):
+        parser.error("--replay runs in-process, without --shards or --use-broker")
+
+    result = run_benchmark(args)
+    print(json.dumps(result["metrics"], indent=2))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    name = f"{stamp}_{args.label}.json" if args.label else f"{stamp}.json"
+    path = os.path.join(args.output_dir, name)
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(result, json.load(f))
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
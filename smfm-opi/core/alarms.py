@@ -0,0 +1,314 @@
+"""
+Streaming alarm rules, evaluated on every weight sample in the ingest path.
+
+Rules are configured as dicts (ALARM_RULES in utils/constants.py):
+
+    {"type": "threshold", "scale": "*", "low": -1.0, "high": 60.0, "hysteresis": 0.5, "delay_s": 1.0}
+    {"type": "rate", "scale": "s01", "max_rate": 10.0}               # |flow slope| in kg/s
+    {"type": "stuck", "scale": "*", "window_s": 60.0, "tolerance": 0.0005}
+    {"type": "timeout", "scale": "*", "timeout_s": 5.0}              # no sample for timeout_s
+    {"type": "divergence", "scales": ["s01", "s02"], "quantity": "flow", "max_diff": 0.5}
+
+"scale" is a scale id, a list of ids or "*" for every scale; "name" optionally names
+the rule (default: its type). delay_s debounces raising (the condition has to hold that
+long) and clear_delay_s clearing; hysteresis is the margin by which a value has to
+return inside a limit before the alarm clears. Each sample costs one call per rule of
+its scale, whatever the history length.
+"""
+import json
+import math
+from collections import namedtuple
+
+from utils.metrics import MetricsRegistry
+
+# An alarm raised (active=True) or cleared. alarm identifies it ("<scale ids>/<rule name>"),
+# t is the time of the sample (or check) that changed it and value the quantity it was tested on.
+AlarmEvent = namedtuple("AlarmEvent", ["alarm", "scale_ids", "active", "t", "value", "message"])
+
+
+def alarm_payload(event):
+    """JSON payload of an alarm event for the alarm topic. Non-finite values (e.g. NaN) are sent as null."""
+    value = event.value if math.isfinite(event.value) else None
+    return json.dumps({
+        "alarm": event.alarm, "scales": list(event.scale_ids), "state": "raised" if event.active else "cleared",
+        "t": event.t, "value": value, "message": event.message,
+    }, allow_nan=False)
+
+
+class _Rule:
+    """
+    Alarm state with debounce and hysteresis. Subclasses call _step() with whether
+    the alarm condition holds (on) and whether it is over (off, with the hysteresis
+    applied); neither holding keeps the current state.
+    """
+    __slots__ = ("alarm", "scale_ids", "active", "_delay", "_clear_delay", "_since")
+
+    def __init__(self, name, scale_ids, delay_s=0.0, clear_delay_s=None):
+        self.alarm = f"{'+'.join(scale_ids)}/{name}"
+        self.scale_ids = tuple(scale_ids)
+        self.active = False
+        self._delay = delay_s
+        self._clear_delay = delay_s if clear_delay_s is None else clear_delay_s
+        self._since = None # Time since which the condition to change state holds
+
+    def _step(self, t, on, off, value):
+        if self.active:
+            change, delay = off, self._clear_delay
+        else:
+            change, delay = on, self._delay
+        if not change:
+            self._since = None
+            return None
+        if self._since is None:
+            self._since = t
+        if t - self._since < delay:
+            return None
+        self.active = not self.active
+        self._since = None
+        return AlarmEvent(self.alarm, self.scale_ids, self.active, t, value, self._message(value))
+
+    def _message(self, value):
+        raise NotImplementedError
+
+
+class ThresholdRule(_Rule):
+    """Weight outside [low, high] (either may be None)."""
+    __slots__ = ("_low", "_high", "_hysteresis")
+
+    def __init__(self, name, scale_id, low=None, high=None, hysteresis=0.0, **timing):
+        super().__init__(name, (scale_id,), **timing)
+        self._low = low
+        self._high = high
+        self._hysteresis = hysteresis
+
+    def update(self, t, weight, flow):
+        low, high = self._low, self._high
+        on = (high is not None and weight > high) or (low is not None and weight < low)
+        off = ((high is None or weight < high - self._hysteresis)
+               and (low is None or weight > low + self._hysteresis))
+        return self._step(t, on, off, weight)
+
+    def _message(self, weight):
+        if not self.active:
+            return f"Peso normalizado ({weight:.3f} kg)"
+        if self._high is not None and weight > self._high:
+            return f"Peso {weight:.3f} kg acima do limite de {self._high} kg"
+        return f"Peso {weight:.3f} kg abaixo do limite de {self._low} kg"
+
+
+class RateRule(_Rule):
+    """Magnitude of the flow slope (rate of change of the weight) above max_rate kg/s."""
+    __slots__ = ("_max_rate", "_hysteresis")
+
+    def __init__(self, name, scale_id, max_rate, hysteresis=0.0, **timing):
+        super().__init__(name, (scale_id,), **timing)
+        self._max_rate = max_rate
+        self._hysteresis = hysteresis
+
+    def update(self, t, weight, flow):
+        magnitude = abs(flow)
+        return self._step(t, magnitude > self._max_rate, magnitude < self._max_rate - self._hysteresis, flow)
+
+    def _message(self, flow):
+        if self.active:
+            return f"Variação de peso {flow:+.3f} kg/s excede {self._max_rate} kg/s"
+        return f"Variação de peso normalizada ({flow:+.3f} kg/s)"
+
+
+class StuckRule(_Rule):
+    """Weight within tolerance of the same value for window_s seconds (a frozen sensor or ADC)."""
+    __slots__ = ("_window", "_tolerance", "_reference", "_reference_t")
+
+    def __init__(self, name, scale_id, window_s, tolerance, **timing):
+        super().__init__(name, (scale_id,), **timing)
+        self._window = window_s
+        self._tolerance = tolerance
+        self._reference = None
+        self._reference_t = None
+
+    def update(self, t, weight, flow):
+        moved = self._reference is None or abs(weight - self._reference) > self._tolerance
+        if moved:
+            self._reference, self._reference_t = weight, t
+        return self._step(t, t - self._reference_t >= self._window, moved, weight)
+
+    def _message(self, weight):
+        if self.active:
+            return f"Sensor parado em {weight:.3f} kg há {self._window:.0f} s"
+        return "Sensor voltou a variar"
+
+
+class TimeoutRule(_Rule):
+    """No sample for timeout_s seconds; checked periodically by check() rather than per sample."""
+    __slots__ = ("_timeout", "_last_t")
+
+    def __init__(self, name, scale_id, timeout_s, **timing):
+        super().__init__(name, (scale_id,), **timing)
+        self._timeout = timeout_s
+        self._last_t = None
+
+    def update(self, t, weight, flow):
+        gap = t - self._last_t if self._last_t is not None else 0.0
+        self._last_t = t
+        if not self.active:
+            return None
+        return self._step(t, False, True, gap)
+
+    def check(self, now):
+        if self._last_t is None:
+            self._last_t = now # Timing starts with the first check
+        silence = now - self._last_t
+        if self.active:
+            # Clearing is up to update(); a new silence restarts its clear delay
+            if silence > self._timeout:
+                self._since = None
+            return None
+        return self._step(now, silence > self._timeout, False, silence)
+
+    def _message(self, silence):
+        if self.active:
+            return f"Sem amostras há {silence:.1f} s"
+        return f"Amostras restabelecidas após {silence:.1f} s"
+
+
+class DivergenceRule(_Rule):
+    """
+    Two scales fed from the same line whose weights or flow slopes (quantity) differ by more
+    than max_diff. Only values less than max_age_s apart are compared.
+    """
+    __slots__ = ("_quantity", "_max_diff", "_hysteresis", "_max_age", "_latest")
+
+    def __init__(self, name, scale_ids, max_diff, quantity="flow", hysteresis=0.0, max_age_s=1.0, **timing):
+        if quantity not in ("flow", "weight"):
+            raise ValueError(f"unknown divergence quantity '{quantity}'")
+        if len(scale_ids) != 2:
+            raise ValueError("a divergence rule compares two scales")
+        super().__init__(name, scale_ids, **timing)
+        self._quantity = quantity
+        self._max_diff = max_diff
+        self._hysteresis = hysteresis
+        self._max_age = max_age_s
+        self._latest = [None, None] # (t, value) of each scale
+
+    def updater(self, side):
+        """Returns the per-sample update function of one of the two scales."""
+        use_flow = self._quantity == "flow"
+        other = 1 - side
+
+        def update(t, weight, flow):
+            self._latest[side] = (t, flow if use_flow else weight)
+            latest = self._latest[other]
+            if latest is None or t - latest[0] > self._max_age:
+                return None
+            difference = abs(self._latest[0][1] - self._latest[1][1])
+            return self._step(t, difference > self._max_diff, difference < self._max_diff - self._hysteresis, difference)
+        return update
+
+    def _message(self, difference):
+        unit = "kg/s" if self._quantity == "flow" else "kg"
+        if self.active:
+            return f"Divergência de {difference:.3f} {unit} entre {' e '.join(self.scale_ids)}"
+        return f"Divergência normalizada ({difference:.3f} {unit})"
+
+
+_RULE_TYPES = {"threshold": ThresholdRule, "rate": RateRule, "stuck": StuckRule, "timeout": TimeoutRule}
+
+
+class AlarmEngine:
+    """
+    Instantiates the rule specs for every scale added with add_scale() and evaluates them.
+    update()/update_many() run the rules of one scale on its new samples; check() runs the
+    timeout rules and has to be called periodically. All return the AlarmEvents produced.
+    Not thread-safe: IngestCore calls it under its lock.
+    """
+    def __init__(self, specs, metrics=None):
+        self._specs = []
+        for spec in specs:
+            spec = dict(spec)
+            kind = spec.pop("type")
+            name = spec.pop("name", kind)
+            self._specs.append((kind, name, spec))
+            self._create(kind, name, spec, "?") # Fails here, not on the first sample, if the spec is invalid
+        self._scales = []
+        self._updaters = {} # scale_id -> update functions of its rules
+        self._timeouts = []
+        self._rules = []
+
+        metrics = metrics or MetricsRegistry()
+        self._m_raised = metrics.counter("smfm_alarms_raised_total", "Alarms raised, by rule", ("rule",))
+        metrics.gauge("smfm_alarms_active", "Alarms currently active").set_function(
+            lambda: sum(rule.active for rule in self._rules)
+        )
+        metrics.gauge("smfm_alarm_rules", "Alarm rules evaluated").set_function(lambda: len(self._rules))
+
+    @staticmethod
+    def _matches(selector, scale_id):
+        if selector == "*":
+            return True
+        return scale_id == selector if isinstance(selector, str) else scale_id in selector
+
+    def add_scale(self, scale_id):
+        """Creates the rules of a new scale, and the divergence rules it completes."""
+        if scale_id in self._updaters:
+            return
+        self._scales.append(scale_id)
+        updaters = self._updaters[scale_id] = []
+        for kind, name, spec in self._specs:
+            if kind == "divergence":
+                scale_ids = tuple(spec["scales"])
+                if scale_id in scale_ids and all(other in self._updaters for other in scale_ids):
+                    rule = self._create(kind, name, spec, scale_id)
+                    for side, other in enumerate(scale_ids):
+                        self._updaters[other].append(rule.updater(side))
+                    self._rules.append(rule)
+            elif self._matches(spec.get("scale", "*"), scale_id):
+                rule = self._create(kind, name, spec, scale_id)
+                updaters.append(rule.update)
+                self._rules.append(rule)
+                if kind == "timeout":
+                    self._timeouts.append(rule)
+
+    @staticmethod
+    def _create(kind, name, spec, scale_id):
+        options = {key: value for key, value in spec.items() if key not in ("scale", "scales")}
+        if kind == "divergence":
+            return DivergenceRule(name, tuple(spec["scales"]), **options)
+        if kind not in _RULE_TYPES:
+            raise ValueError(f"unknown alarm rule type '{kind}'")
+        return _RULE_TYPES[kind](name, scale_id, **options)
+
+    def _count(self, events):
+        for event in events:
+            if event.active:
+                self._m_raised.labels(event.alarm.rsplit("/", 1)[1]).inc()
+        return events
+
+    def update(self, scale_id, t, weight, flow):
+        """Evaluates one sample."""
+        events = []
+        for update in self._updaters.get(scale_id, ()):
+            event = update(t, weight, flow)
+            if event is not None:
+                events.append(event)
+        return self._count(events) if events else events
+
+    def update_many(self, scale_id, times, weights, flows):
+        """Evaluates an array of samples in order."""
+        events = []
+        updaters = self._updaters.get(scale_id)
+        if not updaters:
+            return events
+        for t, weight, flow in zip(times.tolist(), weights.tolist(), flows.tolist()):
+            for update in updaters:
+                event = update(t, weight, flow)
+                if event is not None:
+                    events.append(event)
+        return self._count(events) if events else events
+
+    def check(self, now):
+        """Evaluates the timeout rules."""
+        events = [event for event in (rule.check(now) for rule in self._timeouts) if event is not None]
+        return self._count(events) if events else events
+
+    def active_alarms(self):
+        return [rule.alarm for rule in self._rules if rule.active]
@@ -0,0 +1,99 @@
+"""
+Time alignment of the scales: device clocks mapped onto the receive clock, and the
+weights of every scale resampled onto one common time grid for cross-scale sums
+(e.g. the total mass on a line).
+"""
+from collections import deque
+
+import numpy as np
+
+
+class DeviceClock:
+    """
+    Maps a device's sample times onto the receive clock (utils.clock) for one scale.
+
+    Every message bounds the offset between the two clocks from above: its receive
+    time minus the device time of its newest sample is the offset plus the network
+    latency. The estimate is the smallest bound of the messages from the last
+    window_s seconds of device time, so latency jitter and messages queued by the
+    broker keep their device spacing, while clock drift is still followed.
+    reset() forgets the estimate (the device restarted and its clock with it).
+    """
+    __slots__ = ("_window", "_bounds")
+
+    def __init__(self, window_s):
+        self._window = window_s
+        self._bounds = deque() # (device time, bound) with increasing bounds: the sliding-window minimum
+
+    def reset(self):
+        self._bounds.clear()
+
+    def offset(self, device_time, receive_time):
+        """Adds the bound of a message whose newest sample has device_time, and returns the current offset."""
+        bound = receive_time - device_time
+        bounds = self._bounds
+        if bounds and device_time < bounds[-1][0]:
+            bounds.clear() # Device time went backwards
+        while bounds and bounds[-1][1] >= bound:
+            bounds.pop()
+        bounds.append((device_time, bound))
+        while bounds[0][0] < device_time - self._window:
+            bounds.popleft()
+        return bounds[0][1]
+
+
+class TimeAligner:
+    """
+    Resamples the weights of every scale onto a grid of multiples of step_s by linear
+    interpolation, incrementally: add() takes each scale's new samples (in time order)
+    and advance() returns the grid points completed since the previous call.
+
+    A grid point is complete once every scale has a sample at or after it, or once it
+    is max_lag_s older than now: a scale that stopped publishing holds its last value
+    instead of holding back the grid. A scale reads NaN before its first sample.
+    Only the samples from the last grid point on are kept, so memory stays bounded;
+    after a gap of more than max_points grid points the older points are skipped.
+    """
+    def __init__(self, step_s, max_lag_s, max_points):
+        self._step = step_s
+        self._max_lag = max_lag_s
+        self._max_points = max_points
+        self._samples = {} # scale_id -> (times, weights) not yet behind the grid
+        self._pending = {} # scale_id -> [(times, weights)] added since advance()
+        self._next = None # Index of the next grid point (its time is index * step_s)
+
+    def add(self, scale_id, times, weights):
+        if len(times):
+            self._pending.setdefault(scale_id, []).append((times, weights))
+
+    def advance(self, now):
+        """Returns (grid times, {scale_id: weights on the grid}) of the new grid points, or None."""
+        for scale_id, parts in self._pending.items():
+            if scale_id in self._samples:
+                parts.insert(0, self._samples[scale_id])
+            # A copy, so the caller's arrays (e.g. views of shared buffers) may change afterwards
+            self._samples[scale_id] = (
+                np.concatenate([times for times, _ in parts]), np.concatenate([weights for _, weights in parts])
+            )
+        self._pending = {}
+        if not self._samples:
+            return None
+
+        latest = [times[-1] for times, _ in self._samples.values()]
+        end = min(max(min(latest), now - self._max_lag), max(latest))
+        last = int(np.floor(end / self._step))
+        if self._next is None:
+            self._next = int(np.ceil(min(times[0] for times, _ in self._samples.values()) / self._step))
+        if last < self._next:
+            return None
+        first = max(self._next, last - self._max_points + 1)
+        self._next = last + 1
+
+        grid = np.arange(first, last + 1) * self._step
+        values = {}
+        for scale_id, (times, weights) in self._samples.items():
+            values[scale_id] = np.interp(grid, times, weights, left=np.nan)
+            keep = max(int(np.searchsorted(times, grid[-1], side="right")) - 1, 0)
+            if keep:
+                self._samples[scale_id] = (times[keep:], weights[keep:])
+        return grid, values
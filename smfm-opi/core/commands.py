@@ -0,0 +1,164 @@
+"""
+Command pipeline: correlation ids, acknowledgements, retries and fan-out to groups of scales.
+
+With the envelope enabled, every command carries a correlation id and devices
+acknowledge it on their ack topic:
+
+    request  smfm/<scale id>/operation/<command>   {"cid": "<id>", "value": <payload>}
+    ack      smfm/<scale id>/operation/ack         {"cid": "<id>", "ok": true, "detail": "..."}
+
+Devices that still take the plain payloads (envelope disabled) may acknowledge
+with {"cmd": "<command>", "ok": true}, which completes the oldest pending command
+of that name on that scale. Commands without an ack after ack_timeout_s are sent
+again (same cid, so devices can discard duplicates) up to max_retries times.
+Plain payloads carry no cid, so a device could not tell a resend from a new
+command (a second tare): without the envelope commands are never resent, only timed out.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+ACKED = "acked"
+REJECTED = "rejected"
+TIMED_OUT = "timeout"
+
+# Outcome of one command on one scale. rtt is measured from the last attempt (None unless acknowledged).
+CommandResult = namedtuple("CommandResult", ["cid", "scale_id", "command", "status", "attempts", "rtt", "detail"])
+# Outcome of a command sent to a group of scales, delivered once every scale has a result
+GroupResult = namedtuple("GroupResult", ["group_id", "command", "results"])
+
+
+class _PendingCommand:
+    __slots__ = ("cid", "scale_id", "command", "topic", "wire_payload", "qos", "attempts", "sent_at", "group_id")
+
+    def __init__(self, cid, scale_id, command, topic, wire_payload, qos, group_id):
+        self.cid = cid
+        self.scale_id = scale_id
+        self.command = command
+        self.topic = topic
+        self.wire_payload = wire_payload
+        self.qos = qos
+        self.attempts = 0
+        self.sent_at = None
+        self.group_id = group_id
+
+
+class _Group:
+    __slots__ = ("command", "remaining", "results")
+
+    def __init__(self, command, size):
+        self.command = command
+        self.remaining = size
+        self.results = []
+
+
+def _wire_payload(cid, payload):
+    """Wraps a command payload in the correlation envelope. JSON payloads are embedded as JSON."""
+    try:
+        value = json.loads(payload) if payload else payload
+    except ValueError:
+        value = payload
+    return json.dumps({"cid": cid, "value": value})
+
+
+class CommandTracker:
+    """
+    Tracks commands until they are acknowledged, rejected or time out. Thread-safe and
+    Qt-free: the caller publishes what submit() and expire() return.
+    """
+    def __init__(self, ack_timeout_s, max_retries, envelope=True):
+        self._ack_timeout = ack_timeout_s
+        self._max_retries = max_retries if envelope else 0
+        self._envelope = envelope
+        self._lock = threading.Lock()
+        self._pending = {} # cid -> _PendingCommand, in submission order
+        self._groups = {} # group_id -> _Group
+        self._next_id = itertools.count(1)
+        # Random per run, so a late ack for a command of a previous run cannot match
+        self._run_id = os.urandom(3).hex()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, targets, command, payload, qos, now=None):
+        """
+        Registers command for every (scale_id, topic) in targets.
+        Returns (group_id, publishes) with publishes as (topic, wire payload, qos) to send now.
+        """
+        now = time.monotonic() if now is None else now
+        if not targets:
+            return None, []
+        with self._lock:
+            group_id = next(self._next_id)
+            self._groups[group_id] = _Group(command, len(targets))
+            publishes = []
+            for scale_id, topic in targets:
+                cid = f"{self._run_id}-{next(self._next_id)}"
+                wire_payload = _wire_payload(cid, payload) if self._envelope else payload
+                pending = _PendingCommand(cid, scale_id, command, topic, wire_payload, qos, group_id)
+                self._pending[cid] = pending
+                publishes.append(self._send(pending, now))
+        return group_id, publishes
+
+    def _send(self, pending, now):
+        pending.attempts += 1
+        pending.sent_at = now
+        return pending.topic, pending.wire_payload, pending.qos
+
+    def acknowledge(self, scale_id, ack, now=None):
+        """
+        Matches an ack (decoded JSON object) from scale_id to its pending command.
+        Returns (results, groups) completed by it; both empty if nothing matched.
+        """
+        now = time.monotonic() if now is None else now
+        if not isinstance(ack, dict):
+            raise ValueError("command ack is not a JSON object")
+        with self._lock:
+            pending = self._pending.get(ack.get("cid"))
+            if pending is None and "cmd" in ack:
+                pending = next(
+                    (p for p in self._pending.values() if p.scale_id == scale_id and p.command == ack["cmd"]), None
+                )
+            if pending is None or pending.scale_id != scale_id:
+                return [], []
+            status = ACKED if ack.get("ok", True) else REJECTED
+            return self._complete(pending, status, now - pending.sent_at, str(ack.get("detail", "")))
+
+    def expire(self, now=None):
+        """
+        Resends the commands whose ack is overdue and gives up on those out of retries.
+        Returns (publishes, results, groups).
+        """
+        now = time.monotonic() if now is None else now
+        publishes, results, groups = [], [], []
+        with self._lock:
+            overdue = [p for p in self._pending.values() if now - p.sent_at >= self._ack_timeout]
+            for pending in overdue:
+                if pending.attempts <= self._max_retries:
+                    publishes.append(self._send(pending, now))
+                else:
+                    done, finished_groups = self._complete(pending, TIMED_OUT, None, "")
+                    results.extend(done)
+                    groups.extend(finished_groups)
+        return publishes, results, groups
+
+    def restart_timers(self, now=None):
+        """Restarts the ack timeout of every pending command, e.g. once commands held while offline were sent."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for pending in self._pending.values():
+                pending.sent_at = now
+
+    def _complete(self, pending, status, rtt, detail):
+        del self._pending[pending.cid]
+        result = CommandResult(pending.cid, pending.scale_id, pending.command, status, pending.attempts, rtt, detail)
+        group = self._groups[pending.group_id]
+        group.results.append(result)
+        group.remaining -= 1
+        if group.remaining:
+            return [result], []
+        del self._groups[pending.group_id]
+        return [result], [GroupResult(pending.group_id, group.command, group.results)]
@@ -0,0 +1,265 @@
+"""
+Mass flow rate (dm/dt), totalizer and time-to-empty estimation.
+
+FlowEstimator updates the estimates of one scale in O(1) per sample;
+compute_flow() produces the same quantities for a whole recorded array with
+vectorized NumPy operations, for offline recomputation.
+"""
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Latest estimates of one scale. Flow rates are in kg/s (negative while dispensing),
+# totals in kg and time_to_empty in seconds (None when the scale is not emptying).
+FlowReading = namedtuple(
+    "FlowReading", ["t", "weight", "flow_ema", "flow_slope", "dispensed", "filled", "time_to_empty"]
+)
+
+# Chunk sizes used by compute_flow to keep cumulative sums and exponentials well conditioned
+_SLOPE_CHUNK_SAMPLES = 1 << 16
+_EMA_CHUNK_TAUS = 500.0
+
+
+class FlowEstimator:
+    """
+    Streaming flow estimates of one scale:
+    - flow_ema: exponentially smoothed sample-to-sample derivative (time constant ema_tau_s),
+    - flow_slope: least-squares slope over the last window_samples samples,
+    - dispensed / filled: integral of flow_slope while its magnitude exceeds threshold,
+    - time_to_empty: weight / -flow_slope while dispensing.
+    """
+    def __init__(self, ema_tau_s, window_samples, threshold):
+        self._tau = ema_tau_s
+        self._window = window_samples
+        self._threshold = threshold
+
+        self._times = np.zeros(window_samples)
+        self._weights = np.zeros(window_samples)
+        self._n = 0 # Samples in the window
+        self._head = 0 # Slot of the oldest sample once the window is full
+        self._since_recenter = 0
+        self._t_ref = 0.0
+        # Running sums over the window, with times relative to _t_ref
+        self._s_t = self._s_w = self._s_tt = self._s_tw = 0.0
+
+        self._last_t = None
+        self._last_w = None
+        self.flow_ema = 0.0
+        self.flow_slope = 0.0
+        self.dispensed = 0.0
+        self.filled = 0.0
+
+    def update(self, t, weight):
+        """Adds one sample and returns the updated FlowReading."""
+        if self._last_t is not None:
+            t = max(t, self._last_t) # A clock step backwards counts as no elapsed time
+        if self._last_t is not None and t > self._last_t:
+            dt = t - self._last_t
+            alpha = 1.0 - math.exp(-dt / self._tau)
+            self.flow_ema += alpha * ((weight - self._last_w) / dt - self.flow_ema)
+        else:
+            dt = 0.0
+
+        self._add_to_window(t, weight)
+        self.flow_slope = self._slope()
+
+        if self.flow_slope < -self._threshold:
+            self.dispensed -= self.flow_slope * dt
+        elif self.flow_slope > self._threshold:
+            self.filled += self.flow_slope * dt
+
+        self._last_t, self._last_w = t, weight
+        return self.reading()
+
+    def extend(self, times, weights):
+        """
+        Adds samples in time order, with the same result as calling update() for each
+        one but vectorized (for batched payloads). Returns the flow_slope of every sample.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(times) == 0:
+            return np.empty(0)
+        if self._last_t is None:
+            first = self.update(times[0], weights[0]).flow_slope
+            return np.concatenate(([first], self.extend(times[1:], weights[1:])))
+
+        t = np.maximum.accumulate(np.maximum(times, self._last_t))
+        # The previous sample leads every array, so the first new sample has a predecessor
+        all_t = np.concatenate(([self._last_t], t))
+        dt = np.diff(all_t)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            derivative = np.where(dt > 0, np.diff(np.concatenate(([self._last_w], weights))) / dt, 0.0)
+        flow_ema = _irregular_ema(all_t, np.concatenate(([0.0], derivative)), self._tau, self.flow_ema)
+
+        order = np.arange(self._head, self._head + self._n) % self._window
+        window_t = np.concatenate((self._times[order], t))
+        window_w = np.concatenate((self._weights[order], weights))
+        slope = _sliding_slope(window_t, window_w, self._window)[self._n:]
+
+        self.dispensed += float(np.sum(np.where(slope < -self._threshold, -slope * dt, 0.0)))
+        self.filled += float(np.sum(np.where(slope > self._threshold, slope * dt, 0.0)))
+
+        # Keep the newest samples as the window, oldest first
+        self._n = min(self._window, len(window_t))
+        self._times[:self._n] = window_t[-self._n:]
+        self._weights[:self._n] = window_w[-self._n:]
+        self._head = 0
+        self._recenter()
+
+        self.flow_ema = float(flow_ema[-1])
+        self.flow_slope = float(slope[-1])
+        self._last_t, self._last_w = float(t[-1]), float(weights[-1])
+        return slope
+
+    def reading(self):
+        emptying = self.flow_slope < -self._threshold and self._last_w is not None
+        return FlowReading(
+            self._last_t, self._last_w, self.flow_ema, self.flow_slope, self.dispensed, self.filled,
+            max(0.0, self._last_w / -self.flow_slope) if emptying else None
+        )
+
+    def _add_to_window(self, t, weight):
+        if self._n == self._window:
+            # Remove the oldest sample from the sums; its slot is reused for the new one
+            slot = self._head
+            old_t = self._times[slot] - self._t_ref
+            old_w = self._weights[slot]
+            self._s_t -= old_t
+            self._s_w -= old_w
+            self._s_tt -= old_t * old_t
+            self._s_tw -= old_t * old_w
+            self._head = (self._head + 1) % self._window
+        else:
+            slot = self._n
+            self._n += 1
+            if self._n == 1:
+                self._t_ref = t
+
+        self._times[slot] = t
+        self._weights[slot] = weight
+        rel_t = t - self._t_ref
+        self._s_t += rel_t
+        self._s_w += weight
+        self._s_tt += rel_t * rel_t
+        self._s_tw += rel_t * weight
+
+        # Recompute the sums around the current window once per window length, so
+        # rounding errors cannot accumulate (amortized O(1) per sample).
+        self._since_recenter += 1
+        if self._since_recenter >= self._window:
+            self._recenter()
+
+    def _recenter(self):
+        times = self._times[:self._n]
+        weights = self._weights[:self._n]
+        self._t_ref = float(times.min())
+        rel_t = times - self._t_ref
+        self._s_t = float(rel_t.sum())
+        self._s_w = float(weights.sum())
+        self._s_tt = float((rel_t * rel_t).sum())
+        self._s_tw = float((rel_t * weights).sum())
+        self._since_recenter = 0
+
+    def _slope(self):
+        n = self._n
+        denominator = n * self._s_tt - self._s_t * self._s_t
+        if n < 2 or denominator <= 0.0:
+            return 0.0
+        return (n * self._s_tw - self._s_t * self._s_w) / denominator
+
+
+def _windowed_sum(values, window):
+    """Sum of each value and the window - 1 values before it."""
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    upper = np.arange(1, len(values) + 1)
+    return sums[upper] - sums[np.maximum(0, upper - window)]
+
+
+def _sliding_slope(t, w, window):
+    """Least-squares slope over the trailing window of each sample (growing window at the start)."""
+    n = len(t)
+    slope = np.zeros(n)
+    for start in range(0, n, _SLOPE_CHUNK_SAMPLES):
+        end = min(n, start + _SLOPE_CHUNK_SAMPLES)
+        # Include the samples of the previous chunk that fall into the first windows
+        lead = min(start, window - 1)
+        ct = t[start - lead:end] - t[start - lead]
+        cw = w[start - lead:end]
+        counts = np.minimum(np.arange(1, len(ct) + 1) + (start - lead), window).astype(np.float64)
+        s_t, s_w = _windowed_sum(ct, window), _windowed_sum(cw, window)
+        s_tt, s_tw = _windowed_sum(ct * ct, window), _windowed_sum(ct * cw, window)
+        denominator = counts * s_tt - s_t * s_t
+        with np.errstate(divide="ignore", invalid="ignore"):
+            chunk_slope = np.where(
+                (counts >= 2) & (denominator > 0), (counts * s_tw - s_t * s_w) / denominator, 0.0
+            )
+        slope[start:end] = chunk_slope[lead:]
+    return slope
+
+
+def _irregular_ema(t, x, tau, initial=0.0):
+    """
+    Exponential moving average y_i = y_(i-1) + a_i (x_i - y_(i-1)) with a_i = 1 - exp(-dt_i / tau).
+    Since the decay between two samples is exp(-(t_j - t_i) / tau), the recurrence has a
+    closed form; it is evaluated in chunks spanning at most _EMA_CHUNK_TAUS time constants
+    so the exponentials stay finite.
+    """
+    n = len(t)
+    y = np.empty(n)
+    if n == 0:
+        return y
+    dt = np.diff(t, prepend=t[0])
+    alpha = 1.0 - np.exp(-dt / tau)
+    previous = initial
+    start = 0
+    while start < n:
+        end = int(np.searchsorted(t, t[start] + _EMA_CHUNK_TAUS * tau, side="right"))
+        end = max(end, start + 1)
+        rel = (t[start:end] - t[start]) / tau
+        weighted = np.cumsum(alpha[start:end] * x[start:end] * np.exp(rel))
+        decay = np.exp(-rel)
+        # Decay of the value carried in from before the chunk over the chunk's first step
+        carried = previous * (1.0 - alpha[start])
+        y[start:end] = decay * (carried + weighted)
+        previous = y[end - 1]
+        start = end
+    return y
+
+
+def compute_flow(t, w, ema_tau_s, window_samples, threshold):
+    """
+    Vectorized equivalent of feeding every (t, w) sample to a new FlowEstimator.
+    Returns a dict of arrays: flow_ema, flow_slope, dispensed, filled and time_to_empty
+    (NaN when not emptying).
+    """
+    # A clock step backwards counts as no elapsed time, as in FlowEstimator
+    t = np.maximum.accumulate(np.asarray(t, dtype=np.float64))
+    w = np.asarray(w, dtype=np.float64)
+    n = len(t)
+    if n == 0:
+        empty = np.empty(0)
+        return {"flow_ema": empty, "flow_slope": empty, "dispensed": empty, "filled": empty, "time_to_empty": empty}
+
+    dt = np.diff(t, prepend=t[0])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        derivative = np.where(dt > 0, np.diff(w, prepend=w[0]) / dt, 0.0)
+    # Samples with dt == 0 leave the average unchanged, which alpha == 0 already does
+    flow_ema = _irregular_ema(t, derivative, ema_tau_s)
+
+    slope = _sliding_slope(t, w, window_samples)
+    dispensing = slope < -threshold
+    filling = slope > threshold
+    dispensed = np.cumsum(np.where(dispensing, -slope * dt, 0.0))
+    filled = np.cumsum(np.where(filling, slope * dt, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        time_to_empty = np.where(dispensing, np.maximum(0.0, w / -slope), np.nan)
+
+    return {
+        "flow_ema": flow_ema,
+        "flow_slope": slope,
+        "dispensed": dispensed,
+        "filled": filled,
+        "time_to_empty": time_to_empty,
+    }
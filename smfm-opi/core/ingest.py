@@ -0,0 +1,390 @@
+"""
+Qt-free ingest pipeline: routing, parsing, flow estimation and recording of MQTT messages.
+
+IngestCore.handle_message() is called from the MQTT network thread for every
+message, stamped on the receive clock (utils.clock), and does all per-sample work there. Consumers (the GUI through
+MqttWorker, or the headless daemon) periodically call drain() to collect
+everything ingested since the previous call as one IngestBatch.
+"""
+import json
+import threading
+import time
+
+import numpy as np
+
+from core.alarms import AlarmEngine
+from core.alignment import DeviceClock
+from core.commands import ACKED, REJECTED, TIMED_OUT
+from core.flow import FlowEstimator
+from core.payload import WEIGHT_BATCH_FORMAT, SEQUENCE_MODULO, is_weight_batch, decode_weight_batch
+from core.scale_registry import ScaleRegistry
+from storage.recorder import EVENT_COMMAND_ACKED, EVENT_COMMAND_REJECTED, EVENT_COMMAND_TIMED_OUT
+from utils import clock
+from utils.metrics import MetricsRegistry
+from utils.constants import (
+    TOPIC_WEIGHT_WILDCARD, TOPIC_STATUS_WILDCARD, TOPIC_ACK_WILDCARD, TOPIC_LOG, TOPIC_CAPABILITIES,
+    WEIGHT_TOPIC_SUFFIX, STATUS_TOPIC_SUFFIX, ACK_TOPIC_SUFFIX, WEIGHT_BATCH_MAX_SAMPLES, DEVICE_CLOCK_WINDOW_S
+)
+
+# Recorded event kind of each command outcome
+_COMMAND_EVENTS = {ACKED: EVENT_COMMAND_ACKED, REJECTED: EVENT_COMMAND_REJECTED, TIMED_OUT: EVENT_COMMAND_TIMED_OUT}
+
+
+class IngestBatch:
+    """
+    Everything ingested between two drain() calls.
+
+    samples:    {scale_id: (times, weights, device times)} as arrays; times are on the receive
+                clock, device times are NaN for samples without one (text payloads)
+    flows:      {scale_id: (receive times, flow rates, latest FlowReading)}
+    statuses:   list of (scale_id, status code, receive time), in arrival order
+    logs:       list of (source, message) for the consumer's log
+    new_scales: Scale objects registered since the previous batch
+    command_results / command_groups: CommandResult / GroupResult completed since the previous batch
+    alarms:     AlarmEvents raised or cleared since the previous batch (core.alarms)
+    aligned:    (grid times, {scale_id: weights}) resampled by a core.alignment.TimeAligner, or None
+                (set by the consumer that aligns the merged batches, see MqttWorker)
+    """
+    __slots__ = (
+        "samples", "flows", "statuses", "logs", "new_scales", "command_results", "command_groups", "alarms",
+        "aligned", "message_count", "oldest_receive_time"
+    )
+
+    def __init__(self):
+        self.samples = {}
+        self.flows = {}
+        self.statuses = []
+        self.logs = []
+        self.new_scales = []
+        self.command_results = []
+        self.command_groups = []
+        self.alarms = []
+        self.aligned = None
+        self.message_count = 0
+        self.oldest_receive_time = None
+
+    def merge(self, other):
+        """Adds the contents of other (a batch of other scales, e.g. from an ingest shard) to this batch."""
+        self.samples.update(other.samples)
+        self.flows.update(other.flows)
+        self.statuses.extend(other.statuses)
+        self.logs.extend(other.logs)
+        self.new_scales.extend(other.new_scales)
+        self.command_results.extend(other.command_results)
+        self.command_groups.extend(other.command_groups)
+        self.alarms.extend(other.alarms)
+        self.message_count += other.message_count
+        if other.oldest_receive_time is not None and (
+                self.oldest_receive_time is None or other.oldest_receive_time < self.oldest_receive_time):
+            self.oldest_receive_time = other.oldest_receive_time
+
+
+class _ScaleStage:
+    """
+    Per-scale samples staged since the last drain: text samples accumulate in lists,
+    binary batches are kept as arrays (parts) and joined once at drain time.
+    """
+    __slots__ = (
+        "times", "weights", "device_times", "flows", "parts", "estimator", "device_clock", "last_time",
+        "last_sequence", "last_status"
+    )
+
+    def __init__(self, estimator):
+        self.times = []
+        self.weights = []
+        self.device_times = []
+        self.flows = []
+        self.parts = [] # (times, weights, device times, flows) arrays, in arrival order
+        self.estimator = estimator
+        self.device_clock = DeviceClock(DEVICE_CLOCK_WINDOW_S)
+        self.last_time = -np.inf
+        self.last_sequence = None
+        self.last_status = None
+
+    def seal(self):
+        """Moves the samples staged in the lists into parts."""
+        if self.times:
+            self.parts.append((
+                np.array(self.times), np.array(self.weights),
+                np.array(self.device_times, dtype=np.float64), np.array(self.flows)
+            ))
+            self.times, self.weights, self.device_times, self.flows = [], [], [], []
+
+    def take(self):
+        """Returns the staged (times, weights, device times, flows) arrays and clears the stage."""
+        self.seal()
+        parts, self.parts = self.parts, []
+        if len(parts) == 1:
+            return parts[0]
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+class IngestCore:
+    """
+    Routes each message through the ScaleRegistry and processes it off the consumer's thread:
+    weight samples are parsed, timestamped, passed to the scale's FlowEstimator and
+    to the recorder, and staged for the next drain(). Text samples are stamped with
+    their receive time; the samples of binary batches keep their device time and are
+    placed on the receive clock through the scale's DeviceClock.
+    The recorder also gets every status change and command outcome (for core.report).
+    flow_settings is (ema_tau_s, window_samples, threshold), or None to disable flow estimation.
+
+    Weight topics accept text floats and binary batches (core.payload); the binary
+    format is offered to the devices through the retained capabilities message.
+    Commands are tracked by command_tracker (a core.commands.CommandTracker), which
+    receives the acks; the caller publishes what submit_command()/expire_commands() return.
+    With subscribe_weights off the weight topics are left out of subscription_topics (and
+    listed in unsubscription_topics, for a persistent session that still has them), for a
+    core whose weights are ingested by shard processes (core.sharding).
+    alarm_rules (core.alarms specs) are evaluated on every sample, and the timeouts at each drain().
+    capture (a storage.capture.CaptureWriter) gets every message as received, for replay.
+    """
+    def __init__(self, known_scale_ids=(), recorder=None, flow_settings=None, metrics=None, command_tracker=None,
+                 subscribe_weights=True, alarm_rules=(), capture=None):
+        self._recorder = recorder
+        self._capture = capture
+        self._subscribe_weights = subscribe_weights
+        self._commands = command_tracker
+        self._flow_settings = flow_settings
+        self._lock = threading.Lock() # Guards the staged data shared with drain()
+
+        self._stages = {} # scale_id -> _ScaleStage
+        self._batch = IngestBatch()
+
+        self.metrics = metrics or MetricsRegistry()
+        self._m_messages = self.metrics.counter("smfm_mqtt_messages_total", "MQTT messages received, by topic", ("topic",))
+        self._m_parse_errors = self.metrics.counter("smfm_parse_errors_total", "Payloads that could not be parsed, by topic", ("topic",))
+        self._m_unknown_topics = self.metrics.counter("smfm_unknown_topic_messages_total", "Messages on topics without a handler")
+        self._m_rejected_topics = self.metrics.counter("smfm_rejected_topic_messages_total", "Messages on scale topics with an invalid scale id")
+        self._m_samples = self.metrics.counter("smfm_weight_samples_total", "Weight samples ingested, by scale", ("scale",))
+        self._m_lost = self.metrics.counter("smfm_lost_weight_messages_total", "Binary weight messages missing from the sequence numbers")
+        self._m_handle_time = self.metrics.histogram(
+            "smfm_ingest_message_seconds", "Processing time of one message in the ingest core",
+            buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.1)
+        )
+        self.metrics.gauge("smfm_ingest_staged_messages", "Messages ingested but not yet drained").set_function(
+            lambda: self._batch.message_count
+        )
+        self._m_commands = self.metrics.counter("smfm_commands_total", "Commands completed, by outcome", ("status",))
+        self._m_command_sends = self.metrics.counter("smfm_command_sends_total", "Command messages published, retries included")
+        self._m_command_rtt = self.metrics.histogram("smfm_command_rtt_seconds", "Time from sending a command to its ack")
+        if command_tracker is not None:
+            self.metrics.gauge("smfm_commands_pending", "Commands waiting for an ack").set_function(lambda: len(command_tracker))
+        if recorder:
+            self.metrics.gauge("smfm_recorder_dropped_samples", "Samples dropped because the recorder fell behind").set_function(
+                lambda: recorder.dropped_samples
+            )
+        self._alarms = AlarmEngine(alarm_rules, self.metrics) if alarm_rules else None
+
+        topic_handlers = {WEIGHT_TOPIC_SUFFIX: self._handle_weight, STATUS_TOPIC_SUFFIX: self._handle_status}
+        if command_tracker is not None:
+            topic_handlers[ACK_TOPIC_SUFFIX] = self._handle_ack
+        self.scale_registry = ScaleRegistry(topic_handlers, on_scale_added=self._on_scale_added)
+        self.scale_registry.add_route(TOPIC_LOG, self._handle_device_log)
+        for scale_id in known_scale_ids:
+            self.scale_registry.get_or_create(scale_id)
+
+    @property
+    def subscription_topics(self):
+        # Wildcards let new scales appear as soon as they publish
+        topics = [TOPIC_STATUS_WILDCARD, TOPIC_LOG]
+        if self._subscribe_weights:
+            topics.insert(0, TOPIC_WEIGHT_WILDCARD)
+        if self._commands is not None:
+            topics.append(TOPIC_ACK_WILDCARD)
+        return topics
+
+    @property
+    def unsubscription_topics(self):
+        return [] if self._subscribe_weights else [TOPIC_WEIGHT_WILDCARD]
+
+    @property
+    def retained_messages(self):
+        """(topic, payload) pairs to publish with the retain flag after connecting."""
+        capabilities = {"weight_formats": ["text", WEIGHT_BATCH_FORMAT], "max_samples_per_message": WEIGHT_BATCH_MAX_SAMPLES}
+        return [(TOPIC_CAPABILITIES, json.dumps(capabilities))]
+
+    def _on_scale_added(self, scale):
+        estimator = FlowEstimator(*self._flow_settings) if self._flow_settings else None
+        self._stages[scale.scale_id] = _ScaleStage(estimator)
+        if self._alarms:
+            self._alarms.add_scale(scale.scale_id)
+        self._batch.new_scales.append(scale)
+
+    def handle_message(self, topic, payload, receive_time):
+        """Processes one MQTT message. payload may be bytes or str."""
+        started = time.perf_counter()
+        if self._capture:
+            self._capture.write(receive_time, topic, payload)
+        with self._lock:
+            batch = self._batch
+            batch.message_count += 1
+            self._m_messages.labels(topic).inc()
+            if batch.oldest_receive_time is None:
+                batch.oldest_receive_time = receive_time
+            try:
+                if isinstance(payload, bytes) and not is_weight_batch(payload):
+                    payload = payload.decode("utf-8")
+                try:
+                    route = self.scale_registry.resolve(topic)
+                except ValueError:
+                    self._m_rejected_topics.inc()
+                    batch.logs.append(("unknown_topic", f"Tópico rejeitado (identificador de balança inválido): '{topic}'"))
+                    return
+                if route is None:
+                    self._m_unknown_topics.inc()
+                    batch.logs.append(("unknown_topic", f"Mensagem recebida: Tópico='{topic}', Payload='{payload}'"))
+                    return
+                scale, handler = route
+                handler(scale, payload, receive_time)
+            except ValueError as e:
+                self._m_parse_errors.labels(topic).inc()
+                if isinstance(payload, str):
+                    batch.logs.append(("parse_error", f"Error parsing payload from {topic}: '{payload}'"))
+                else:
+                    batch.logs.append(("parse_error", f"Error parsing {len(payload)}-byte payload from {topic}: {e}"))
+            except Exception as e:
+                batch.logs.append(("app", f"Unknown error processing MQTT: {e}"))
+            finally:
+                self._m_handle_time.observe(time.perf_counter() - started)
+
+    def _handle_weight(self, scale, payload, receive_time):
+        if not isinstance(payload, str):
+            self._handle_weight_batch(scale, payload, receive_time)
+            return
+        weight = float(payload)
+        stage = self._stages[scale.scale_id]
+        receive_time = max(receive_time, stage.last_time) # Keeps each scale's times ordered
+        stage.last_time = receive_time
+        stage.times.append(receive_time)
+        stage.weights.append(weight)
+        stage.device_times.append(np.nan)
+        flow = stage.estimator.update(receive_time, weight).flow_slope if stage.estimator else 0.0
+        stage.flows.append(flow)
+        self._m_samples.labels(scale.scale_id).inc()
+        if self._alarms:
+            self._batch.alarms.extend(self._alarms.update(scale.scale_id, receive_time, weight, flow))
+        if self._recorder:
+            self._recorder.record(scale.scale_id, receive_time, weight)
+
+    def _handle_weight_batch(self, scale, payload, receive_time):
+        batch = decode_weight_batch(payload)
+        if batch.scale_id != scale.scale_id:
+            raise ValueError(f"weight batch of scale '{batch.scale_id}'")
+        n = len(batch)
+        if n == 0:
+            return
+        stage = self._stages[scale.scale_id]
+        self._check_sequence(scale, stage, batch.sequence)
+
+        device_times = batch.t_base + batch.offsets
+        offset = stage.device_clock.offset(device_times[-1], receive_time)
+        times = np.maximum(device_times + offset, stage.last_time)
+        stage.last_time = times[-1]
+        flows = stage.estimator.extend(times, batch.weights) if stage.estimator else np.zeros(n)
+        stage.seal()
+        stage.parts.append((times, batch.weights, device_times, flows))
+        self._m_samples.labels(scale.scale_id).inc(n)
+        if self._alarms:
+            self._batch.alarms.extend(self._alarms.update_many(scale.scale_id, times, batch.weights, flows))
+        if self._recorder:
+            self._recorder.record_many(scale.scale_id, times, batch.weights)
+
+    def _check_sequence(self, scale, stage, sequence):
+        if stage.last_sequence is not None:
+            missing = (sequence - stage.last_sequence - 1) % SEQUENCE_MODULO
+            # A large jump backwards is a device restart, not a loss
+            if 0 < missing < SEQUENCE_MODULO // 2:
+                self._m_lost.inc(missing)
+                self._batch.logs.append(("sequence", f"{scale.name}: {missing} weight message(s) lost before #{sequence}"))
+            elif missing:
+                stage.device_clock.reset()
+        stage.last_sequence = sequence
+
+    def _handle_status(self, scale, payload, receive_time):
+        status = int(payload)
+        self._batch.statuses.append((scale.scale_id, status, receive_time))
+        stage = self._stages[scale.scale_id]
+        # Devices repeat their status periodically; only changes are recorded
+        if self._recorder and status != stage.last_status:
+            self._recorder.record_status(scale.scale_id, receive_time, status)
+        stage.last_status = status
+
+    def _handle_ack(self, scale, payload, receive_time):
+        self._stage_command_results(*self._commands.acknowledge(scale.scale_id, json.loads(payload)))
+
+    def _stage_command_results(self, results, groups):
+        now = clock.now()
+        for result in results:
+            self._m_commands.labels(result.status).inc()
+            if result.status == ACKED:
+                self._m_command_rtt.observe(result.rtt)
+            if self._recorder:
+                self._recorder.record_command(result.scale_id, now, result.command, _COMMAND_EVENTS[result.status], result.rtt)
+        self._batch.command_results.extend(results)
+        self._batch.command_groups.extend(groups)
+
+    def submit_command(self, scale_ids, command, payload, qos):
+        """
+        Sends command to the given scales (unknown ones are skipped) as one group.
+        Returns the (topic, payload, qos) messages to publish.
+        """
+        targets = []
+        for scale_id in scale_ids:
+            scale = self.scale_registry.get(scale_id)
+            if scale is not None:
+                targets.append((scale_id, scale.command_prefix + command))
+        _, publishes = self._commands.submit(targets, command, payload, qos)
+        self._m_command_sends.inc(len(publishes))
+        return publishes
+
+    def expire_commands(self):
+        """Handles overdue acks. Returns the (topic, payload, qos) messages to publish again."""
+        if self._commands is None:
+            return []
+        publishes, results, groups = self._commands.expire()
+        if results or groups:
+            with self._lock:
+                self._stage_command_results(results, groups)
+        self._m_command_sends.inc(len(publishes))
+        return publishes
+
+    def restart_command_timers(self):
+        """Gives pending commands a full ack timeout again, after a reconnection sent them."""
+        if self._commands is not None:
+            self._commands.restart_timers()
+
+    def _handle_device_log(self, scale, payload, receive_time):
+        self._batch.logs.append(("device", f"LOG Balança: {payload}"))
+
+    def active_alarms(self):
+        """Ids of the alarms currently active."""
+        if self._alarms is None:
+            return []
+        with self._lock:
+            return self._alarms.active_alarms()
+
+    def log(self, message, source="app"):
+        """Adds a message to the next batch's logs (e.g. from the MQTT client)."""
+        with self._lock:
+            self._batch.logs.append((source, message))
+
+    def drain(self):
+        """Returns everything ingested since the previous call, or None if nothing was."""
+        if self._capture:
+            self._capture.flush()
+        with self._lock:
+            batch = self._batch
+            if self._alarms:
+                batch.alarms.extend(self._alarms.check(clock.now()))
+            staged = [(scale_id, stage) for scale_id, stage in self._stages.items() if stage.times or stage.parts]
+            if not staged and not (batch.statuses or batch.logs or batch.new_scales or batch.message_count
+                                   or batch.command_results or batch.command_groups or batch.alarms):
+                return None
+            self._batch = IngestBatch()
+            for scale_id, stage in staged:
+                times, weights, device_times, flows = stage.take()
+                batch.samples[scale_id] = (times, weights, device_times)
+                if stage.estimator:
+                    batch.flows[scale_id] = (times, flows, stage.estimator.reading())
+        return batch
@@ -0,0 +1,79 @@
+"""
+Binary batched weight payload ("binary/1"), accepted on the weight topics next to the text format.
+
+One message carries count samples of one scale:
+
+    offset  size  field
+    0       2     magic b"SW"
+    2       1     format version (1)
+    3       1     flags (reserved, 0)
+    4       8     scale id, ASCII, zero padded
+    12      4     sequence number (uint32, +1 per message, wraps)
+    16      8     device time of the first sample, s (float64)
+    24      2     count (uint16)
+    26      8*n   samples: offset from the time base in us (uint32), weight in kg (float32)
+
+All fields are little endian. A text payload can never start with the magic,
+so both formats can share a topic.
+"""
+import struct
+
+import numpy as np
+
+WEIGHT_BATCH_MAGIC = b"SW"
+WEIGHT_BATCH_VERSION = 1
+WEIGHT_BATCH_FORMAT = f"binary/{WEIGHT_BATCH_VERSION}" # Name announced in the capabilities message
+
+_HEADER = struct.Struct("<2sBB8sIdH")
+SAMPLE_DTYPE = np.dtype([("dt_us", "<u4"), ("weight", "<f4")])
+SEQUENCE_MODULO = 1 << 32
+
+
+class WeightBatch:
+    """Decoded binary weight message. Arrays are float64 views ready for the sample buffers."""
+    __slots__ = ("scale_id", "sequence", "t_base", "offsets", "weights")
+
+    def __init__(self, scale_id, sequence, t_base, offsets, weights):
+        self.scale_id = scale_id
+        self.sequence = sequence
+        self.t_base = t_base
+        self.offsets = offsets # Seconds from t_base
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.weights)
+
+
+def is_weight_batch(payload):
+    return isinstance(payload, (bytes, bytearray, memoryview)) and bytes(payload[:2]) == WEIGHT_BATCH_MAGIC
+
+
+def encode_weight_batch(scale_id, sequence, t_base, offsets_s, weights):
+    """Packs samples into a binary weight message (used by the load generator and device simulators)."""
+    samples = np.empty(len(weights), dtype=SAMPLE_DTYPE)
+    samples["dt_us"] = np.round(np.asarray(offsets_s) * 1e6)
+    samples["weight"] = weights
+    header = _HEADER.pack(
+        WEIGHT_BATCH_MAGIC, WEIGHT_BATCH_VERSION, 0, scale_id.encode("ascii"),
+        sequence % SEQUENCE_MODULO, t_base, len(samples)
+    )
+    return header + samples.tobytes()
+
+
+def decode_weight_batch(payload):
+    """
+    Decodes a binary weight message with one vectorized read of the sample array.
+    Raises ValueError if the payload is malformed or of an unsupported version.
+    """
+    if len(payload) < _HEADER.size:
+        raise ValueError("weight batch shorter than its header")
+    magic, version, _, scale_id, sequence, t_base, count = _HEADER.unpack_from(payload)
+    if magic != WEIGHT_BATCH_MAGIC or version != WEIGHT_BATCH_VERSION:
+        raise ValueError(f"unsupported weight batch version {version}")
+    if len(payload) != _HEADER.size + count * SAMPLE_DTYPE.itemsize:
+        raise ValueError(f"weight batch of {len(payload)} bytes does not hold {count} samples")
+    samples = np.frombuffer(payload, dtype=SAMPLE_DTYPE, count=count, offset=_HEADER.size)
+    return WeightBatch(
+        scale_id.rstrip(b"\0").decode("ascii"), sequence, t_base,
+        samples["dt_us"] * 1e-6, samples["weight"].astype(np.float64)
+    )
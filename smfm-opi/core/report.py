@@ -0,0 +1,346 @@
+"""
+Session reports over the recordings (storage.recorder): runs per scale, per-scale
+totals and command events, computed with vectorized NumPy operations.
+
+A run (batch) is the time a scale spends operating (SCALE_STATUS_OPERATING), from
+its change into that status to the next status change. The per-sample flow
+quantities of core.flow.compute_flow are condensed into summary segments per scale,
+cut at multiples of interval_s and at every recorded status change, so every run
+is a range of whole segments and a report only has to aggregate segments. The
+segments are cached next to the chunk files (summary.bin, summary.json), so a
+report only reads the samples recorded since the previous one.
+"""
+import csv
+import json
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from core.commands import ACKED, REJECTED, TIMED_OUT
+from core.flow import compute_flow
+from storage.recorder import (
+    RecordingReader, RECORD_DTYPE, CHUNK_HEADER_SIZE, write_json_atomically,
+    EVENT_STATUS, EVENT_COMMAND_ACKED, EVENT_COMMAND_REJECTED, EVENT_COMMAND_TIMED_OUT
+)
+from utils.constants import SCALE_STATUS_LABELS, SCALE_STATUS_OPERATING
+
+# One summary segment: [t_start, t_end) bounds, time of its last sample and totals of its samples.
+# flow_min / flow_max are extremes of the least-squares flow slope (kg/s, negative while dispensing).
+SUMMARY_DTYPE = np.dtype([
+    ("t_start", "<f8"), ("t_end", "<f8"), ("t_last", "<f8"), ("count", "<i8"),
+    ("w_first", "<f8"), ("w_last", "<f8"), ("w_min", "<f8"), ("w_max", "<f8"),
+    ("dispensed", "<f8"), ("filled", "<f8"), ("dispensing_s", "<f8"), ("filling_s", "<f8"),
+    ("flow_min", "<f8"), ("flow_max", "<f8"),
+])
+SUMMARY_MAGIC = b"SMFMSUM1"
+SUMMARY_FILE = "summary.bin"
+SUMMARY_INDEX_FILE = "summary.json"
+REPORT_FORMATS = ("csv", "npz", "parquet")
+
+# Outcome names indexed by event kind
+_COMMAND_OUTCOMES = np.array(["?"] * 4, dtype=object)
+_COMMAND_OUTCOMES[[EVENT_COMMAND_ACKED, EVENT_COMMAND_REJECTED, EVENT_COMMAND_TIMED_OUT]] = ACKED, REJECTED, TIMED_OUT
+_STATUS_COLUMNS = tuple(f"status_{code}_s" for code in range(len(SCALE_STATUS_LABELS)))
+RUN_COLUMNS = (
+    "scale", "start", "end", "start_time", "end_time", "duration_s", "end_status", "samples",
+    "weight_start_kg", "weight_end_kg", "weight_min_kg", "weight_max_kg", "dispensed_kg", "filled_kg",
+    "empty_time_s", "fill_time_s", "avg_flow_kg_s", "peak_flow_kg_s", "peak_fill_flow_kg_s", "commands",
+)
+SCALE_COLUMNS = (
+    "scale", "samples", "runs", "dispensed_kg", "filled_kg", "empty_time_s", "fill_time_s",
+    "avg_flow_kg_s", "peak_flow_kg_s", "peak_fill_flow_kg_s", "commands", "commands_failed",
+) + _STATUS_COLUMNS
+COMMAND_COLUMNS = ("scale", "t", "time", "command", "outcome", "rtt_s")
+
+# Tables are dicts of column name -> array, in the column order above.
+# Runs are those started in [t_start, t_end); ongoing runs end at their last sample, with end_status -1.
+SessionReport = namedtuple("SessionReport", ["t_start", "t_end", "runs", "scales", "commands"])
+
+
+def _time_strings(t):
+    """Local ISO 8601 times of epoch seconds ("NaT" for NaN)."""
+    return np.datetime_as_string((np.asarray(t) * 1e6).astype("datetime64[us]"), unit="s", timezone="local")
+
+
+def _summarize(times, weights, n_lead, flow_settings, interval_s, cuts):
+    """
+    Summary segments of the samples times[n_lead:], cut at multiples of interval_s and at cuts
+    (sorted times). The n_lead samples before them only fill the flow window.
+    """
+    flow = compute_flow(times, weights, *flow_settings)
+    t_all = np.maximum.accumulate(times) # As compute_flow orders them
+    dt = np.diff(t_all, prepend=t_all[0])[n_lead:]
+    t = t_all[n_lead:]
+    w = weights[n_lead:]
+    slope = flow["flow_slope"][n_lead:]
+    threshold = flow_settings[2]
+
+    grid = np.arange(np.floor(t[0] / interval_s), np.floor(t[-1] / interval_s) + 2) * interval_s
+    edges = np.union1d(grid, cuts[(cuts > grid[0]) & (cuts < grid[-1])])
+    # First sample of each segment that has samples
+    starts = np.unique(np.searchsorted(t, edges[:-1], side="left"))
+    starts = starts[starts < len(t)]
+    ends = np.append(starts[1:], len(t))
+    segment = np.searchsorted(edges, t[starts], side="right") - 1
+
+    rows = np.empty(len(starts), dtype=SUMMARY_DTYPE)
+    rows["t_start"] = edges[segment]
+    rows["t_end"] = edges[segment + 1]
+    rows["t_last"] = t[ends - 1]
+    rows["count"] = ends - starts
+    rows["w_first"] = w[starts]
+    rows["w_last"] = w[ends - 1]
+    rows["w_min"] = np.minimum.reduceat(w, starts)
+    rows["w_max"] = np.maximum.reduceat(w, starts)
+    rows["dispensed"] = np.add.reduceat(np.diff(flow["dispensed"], prepend=0.0)[n_lead:], starts)
+    rows["filled"] = np.add.reduceat(np.diff(flow["filled"], prepend=0.0)[n_lead:], starts)
+    rows["dispensing_s"] = np.add.reduceat(np.where(slope < -threshold, dt, 0.0), starts)
+    rows["filling_s"] = np.add.reduceat(np.where(slope > threshold, dt, 0.0), starts)
+    rows["flow_min"] = np.minimum.reduceat(slope, starts)
+    rows["flow_max"] = np.maximum.reduceat(slope, starts)
+    return rows
+
+
+def _aggregate(segments, group, n_groups):
+    """Totals of the segments of each group (group holds each segment's group, -1 for none)."""
+    keep = group >= 0
+    segments, group = segments[keep], group[keep]
+    totals = {
+        name: np.bincount(group, weights=segments[name], minlength=n_groups)
+        for name in ("count", "dispensed", "filled", "dispensing_s", "filling_s")
+    }
+    for name, reduce, initial in (("w_min", np.minimum, np.inf), ("w_max", np.maximum, -np.inf),
+                                  ("flow_min", np.minimum, np.inf), ("flow_max", np.maximum, -np.inf)):
+        totals[name] = np.full(n_groups, initial)
+        reduce.at(totals[name], group, segments[name])
+    # Segments are in time order, so a group's first and last segments hold its first and last weights
+    groups, first = np.unique(group, return_index=True)
+    _, last = np.unique(group[::-1], return_index=True)
+    for name, index in (("w_first", first), ("w_last", len(group) - 1 - last)):
+        totals[name] = np.full(n_groups, np.nan)
+        totals[name][groups] = segments[name][index]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        totals["avg_flow"] = np.where(totals["dispensing_s"] > 0, totals["dispensed"] / totals["dispensing_s"], np.nan)
+    totals["peak_flow"] = np.where(np.isfinite(totals["flow_min"]), np.maximum(0.0, -totals["flow_min"]), np.nan)
+    totals["peak_fill_flow"] = np.where(np.isfinite(totals["flow_max"]), np.maximum(0.0, totals["flow_max"]), np.nan)
+    return totals
+
+
+def _status_durations(status_t, status_code, t_start, t_stop):
+    """Seconds spent in each status code within [t_start, t_stop]; a status lasts until the next change."""
+    if len(status_t) == 0:
+        return np.zeros(len(SCALE_STATUS_LABELS))
+    span_start = np.clip(status_t, t_start, t_stop)
+    span_end = np.clip(np.append(status_t[1:], t_stop), t_start, t_stop)
+    known = (status_code >= 0) & (status_code < len(SCALE_STATUS_LABELS))
+    return np.bincount(
+        status_code[known], weights=(span_end - span_start)[known], minlength=len(SCALE_STATUS_LABELS)
+    )[:len(SCALE_STATUS_LABELS)]
+
+
+def _stack(tables, columns):
+    return {name: np.concatenate([table[name] for table in tables]) if tables else np.empty(0) for name in columns}
+
+
+class ReportEngine:
+    """
+    Builds SessionReports from the recordings under root_dir. flow_settings are
+    (ema_tau_s, window_samples, threshold) as for FlowEstimator. Cached summaries are
+    rebuilt when the settings or interval_s change; with use_cache off nothing is written.
+
+    Segments are only cached once they are an interval_s older than the newest sample,
+    so status changes recorded by another process (and flushed later) still cut them.
+    """
+    def __init__(self, root_dir, flow_settings, interval_s, use_cache=True):
+        self._root_dir = root_dir
+        self._reader = RecordingReader(root_dir)
+        self._flow_settings = tuple(flow_settings)
+        self._interval = float(interval_s)
+        self._use_cache = use_cache
+
+    def scale_ids(self):
+        return self._reader.scale_ids()
+
+    def summary(self, scale_id, cuts=None):
+        """
+        Returns the summary segments (SUMMARY_DTYPE) of all samples of a scale, cut at the
+        given status change times (by default, those recorded for the scale).
+        """
+        if cuts is None:
+            events, _ = self._reader.events(scale_id)
+            cuts = events["t"][events["kind"] == EVENT_STATUS]
+        cached, t_until = self._load_summary(scale_id)
+        fresh = self._summarize_samples(scale_id, t_until, np.asarray(cuts, dtype=np.float64))
+        if self._use_cache and len(fresh):
+            cache_until = (np.floor(fresh["t_last"][-1] / self._interval) - 1) * self._interval
+            done = fresh[fresh["t_end"] <= cache_until]
+            if len(done):
+                self._save_summary(scale_id, done, len(cached), cache_until)
+        return np.concatenate((cached, fresh))
+
+    def _summarize_samples(self, scale_id, t_from, cuts):
+        """Summary segments of the samples with t >= t_from, one chunk file at a time."""
+        window = self._flow_settings[1]
+        parts = []
+        lead = np.empty(0, dtype=RECORD_DTYPE) # Samples before the current part, for the flow window
+        for records in self._reader.chunks(scale_id):
+            first = 0 if t_from is None else int(np.searchsorted(records["t"], t_from, side="left"))
+            lead = np.concatenate((lead, records[max(0, first - window):first]))[-window:]
+            if first < len(records):
+                samples = np.concatenate((lead, records[first:]))
+                parts.append(_summarize(
+                    samples["t"], samples["weight"], len(lead), self._flow_settings, self._interval, cuts
+                ))
+                lead = samples[-window:]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=SUMMARY_DTYPE)
+
+    def _load_summary(self, scale_id):
+        """Returns the cached (segments, covered until), or (no segments, None) without a valid cache."""
+        scale_dir = os.path.join(self._root_dir, scale_id)
+        try:
+            with open(os.path.join(scale_dir, SUMMARY_INDEX_FILE)) as f:
+                index = json.load(f)
+            if index["interval_s"] != self._interval or tuple(index["flow_settings"]) != self._flow_settings:
+                raise ValueError("summary settings changed")
+            path = os.path.join(scale_dir, SUMMARY_FILE)
+            count = (os.path.getsize(path) - CHUNK_HEADER_SIZE) // SUMMARY_DTYPE.itemsize
+            segments = np.fromfile(path, dtype=SUMMARY_DTYPE, count=count, offset=CHUNK_HEADER_SIZE)
+        except (OSError, ValueError, KeyError):
+            return np.empty(0, dtype=SUMMARY_DTYPE), None
+        # Segments written after the index was last updated (e.g. before a crash) are not valid
+        return segments[segments["t_start"] < index["t_until"]], index["t_until"]
+
+    def _save_summary(self, scale_id, segments, n_cached, t_until):
+        scale_dir = os.path.join(self._root_dir, scale_id)
+        path = os.path.join(scale_dir, SUMMARY_FILE)
+        if n_cached:
+            f = open(path, "r+b")
+            f.truncate(CHUNK_HEADER_SIZE + n_cached * SUMMARY_DTYPE.itemsize)
+            f.seek(0, os.SEEK_END)
+        else:
+            f = open(path, "wb")
+            f.write(SUMMARY_MAGIC.ljust(CHUNK_HEADER_SIZE, b"\0"))
+        with f:
+            f.write(segments.tobytes())
+        write_json_atomically(os.path.join(scale_dir, SUMMARY_INDEX_FILE), {
+            "interval_s": self._interval, "flow_settings": list(self._flow_settings), "t_until": t_until
+        })
+
+    def report(self, t_start=None, t_end=None, scale_ids=None):
+        """Builds the report of [t_start, t_end) (epoch seconds; by default all recorded data up to now)."""
+        t_end = time.time() if t_end is None else t_end
+        lower = -np.inf if t_start is None else t_start
+        runs, scales, commands = [], [], []
+        for scale_id in (self.scale_ids() if scale_ids is None else scale_ids):
+            scale_runs, scale_totals, scale_commands = self._scale_report(scale_id, lower, t_end)
+            runs.append(scale_runs)
+            scales.append(scale_totals)
+            commands.append(scale_commands)
+        return SessionReport(
+            t_start, t_end, _stack(runs, RUN_COLUMNS), _stack(scales, SCALE_COLUMNS), _stack(commands, COMMAND_COLUMNS)
+        )
+
+    def _scale_report(self, scale_id, t_start, t_end):
+        # Runs started in the range are reported whole, so events and samples after t_end are used too
+        events, command_names = self._reader.events(scale_id)
+        statuses = events[events["kind"] == EVENT_STATUS]
+        status_t, status_code = np.asarray(statuses["t"]), np.asarray(statuses["code"])
+        segments = self.summary(scale_id, status_t)
+        last_seen = max(segments["t_last"][-1] if len(segments) else -np.inf, status_t[-1] if len(status_t) else -np.inf)
+
+        # Runs: from each change into the operating status to the next change
+        operating = np.concatenate(([False], status_code == SCALE_STATUS_OPERATING, [False]))
+        changes = np.flatnonzero(np.diff(operating.astype(np.int8)))
+        start_i, end_i = changes[0::2], np.minimum(changes[1::2], len(status_t) - 1)
+        ongoing = changes[1::2] >= len(status_t)
+        selected = (status_t[start_i] >= t_start) & (status_t[start_i] < t_end)
+        run_start = status_t[start_i][selected]
+        run_end = np.where(ongoing, last_seen, status_t[end_i])[selected]
+        run_end_status = np.where(ongoing, -1, status_code[end_i])[selected]
+        n = len(run_start)
+
+        run_of = np.searchsorted(run_start, segments["t_start"], side="right") - 1
+        if n:
+            run_of[(run_of >= 0) & (segments["t_start"] >= run_end[np.maximum(run_of, 0)])] = -1
+        totals = _aggregate(segments, run_of, n)
+
+        commands = events[(events["kind"] != EVENT_STATUS) & (events["t"] >= t_start) & (events["t"] < t_end)]
+        command_t = np.asarray(commands["t"])
+        run_commands = np.searchsorted(command_t, run_end, side="right") - np.searchsorted(command_t, run_start, side="left")
+
+        runs = {
+            "scale": np.full(n, scale_id), "start": run_start, "end": run_end,
+            "start_time": _time_strings(run_start), "end_time": _time_strings(run_end),
+            "duration_s": run_end - run_start, "end_status": run_end_status, "samples": totals["count"].astype(np.int64),
+            "weight_start_kg": totals["w_first"], "weight_end_kg": totals["w_last"],
+            "weight_min_kg": np.where(totals["count"] > 0, totals["w_min"], np.nan),
+            "weight_max_kg": np.where(totals["count"] > 0, totals["w_max"], np.nan),
+            "dispensed_kg": totals["dispensed"], "filled_kg": totals["filled"],
+            "empty_time_s": totals["dispensing_s"], "fill_time_s": totals["filling_s"],
+            "avg_flow_kg_s": totals["avg_flow"], "peak_flow_kg_s": totals["peak_flow"],
+            "peak_fill_flow_kg_s": totals["peak_fill_flow"], "commands": run_commands,
+        }
+
+        in_range = (segments["t_start"] >= t_start) & (segments["t_start"] < t_end)
+        scale = _aggregate(segments, np.where(in_range, 0, -1), 1)
+        totals = {
+            "scale": np.array([scale_id]), "samples": scale["count"].astype(np.int64), "runs": np.array([n]),
+            "dispensed_kg": scale["dispensed"], "filled_kg": scale["filled"],
+            "empty_time_s": scale["dispensing_s"], "fill_time_s": scale["filling_s"],
+            "avg_flow_kg_s": scale["avg_flow"], "peak_flow_kg_s": scale["peak_flow"],
+            "peak_fill_flow_kg_s": scale["peak_fill_flow"], "commands": np.array([len(commands)]),
+            "commands_failed": np.array([np.count_nonzero(commands["kind"] != EVENT_COMMAND_ACKED)]),
+        }
+        durations = _status_durations(status_t, status_code, t_start, min(t_end, last_seen))
+        for column, duration in zip(_STATUS_COLUMNS, durations):
+            totals[column] = np.array([duration])
+
+        names = np.array(command_names + ["?"])
+        codes = np.asarray(commands["code"])
+        kinds = np.asarray(commands["kind"])
+        command_table = {
+            "scale": np.full(len(commands), scale_id), "t": command_t, "time": _time_strings(command_t),
+            "command": names[np.where((codes >= 0) & (codes < len(command_names)), codes, len(command_names))],
+            "outcome": _COMMAND_OUTCOMES[np.where((kinds >= 0) & (kinds < len(_COMMAND_OUTCOMES)), kinds, 0)].astype(str),
+            "rtt_s": np.asarray(commands["value"]),
+        }
+        return runs, totals, command_table
+
+
+def export_report(report, out_dir, fmt="csv"):
+    """Writes the runs, scales and commands tables to out_dir as <table>.<fmt>. Returns the paths written."""
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"unknown report format '{fmt}'")
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for name in ("runs", "scales", "commands"):
+        table = getattr(report, name)
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        if fmt == "csv":
+            _write_csv(path, table)
+        elif fmt == "npz":
+            np.savez_compressed(path, **table)
+        else:
+            _write_parquet(path, table)
+        paths.append(path)
+    return paths
+
+
+def _write_csv(path, table):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(table)
+        writer.writerows(zip(*(column.tolist() for column in table.values())))
+
+
+def _write_parquet(path, table):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("the parquet format needs pyarrow (pip install pyarrow)") from None
+    pyarrow.parquet.write_table(pyarrow.table({
+        name: pyarrow.array(column.tolist() if column.dtype.kind == "U" else column) for name, column in table.items()
+    }), path)
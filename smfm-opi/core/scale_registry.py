@@ -0,0 +1,93 @@
+"""
+Registry of the scales present on the broker and the topic dispatch table built from it.
+"""
+import re
+
+from utils.constants import (
+    TOPIC_ROOT, WEIGHT_TOPIC_SUFFIX, STATUS_TOPIC_SUFFIX, COMMAND_TOPIC_SUFFIX
+)
+
+# Scale ids name directories (storage.recorder), so only plain names are accepted
+_SCALE_ID = re.compile(r"[A-Za-z0-9_-]+")
+
+
+class Scale:
+    """
+    A single scale, identified by the topic level after TOPIC_ROOT (e.g. "s01").
+    Holds its topics and command prefix.
+    """
+    def __init__(self, scale_id, index):
+        self.scale_id = scale_id
+        self.index = index # 1-based, in order of discovery
+        self.prefix = f"{TOPIC_ROOT}{scale_id}/"
+        self.weight_topic = self.prefix + WEIGHT_TOPIC_SUFFIX
+        self.status_topic = self.prefix + STATUS_TOPIC_SUFFIX
+        self.command_prefix = self.prefix + COMMAND_TOPIC_SUFFIX
+
+        digits = scale_id.lstrip("s")
+        self.name = f"Balança {digits}" if digits.isdigit() else f"Balança {scale_id}"
+
+    def __repr__(self):
+        return f"Scale({self.scale_id!r})"
+
+
+class ScaleRegistry:
+    """
+    Discovers scales from the topics they publish on and routes every message
+    through a precomputed topic -> (scale, handler) table.
+
+    topic_handlers maps a per-scale topic suffix (e.g. WEIGHT_TOPIC_SUFFIX) to a
+    handler called as handler(scale, payload, receive_time). When a message arrives on an
+    unknown scale, the scale is created, all of its routes are added to the
+    table and on_scale_added(scale) is called before the message is dispatched.
+    Scale ids other than plain names ([A-Za-z0-9_-]+) are rejected with ValueError.
+    """
+    def __init__(self, topic_handlers, on_scale_added=None):
+        self._topic_handlers = dict(topic_handlers)
+        self._on_scale_added = on_scale_added
+        self._scales = {} # scale_id -> Scale, in discovery order
+        self._routes = {} # topic -> (scale, handler)
+
+    def __len__(self):
+        return len(self._scales)
+
+    def __iter__(self):
+        return iter(self._scales.values())
+
+    def get(self, scale_id):
+        return self._scales.get(scale_id)
+
+    def add_route(self, topic, handler):
+        """Routes a topic that does not belong to any scale (e.g. TOPIC_LOG). The handler receives scale=None."""
+        self._routes[topic] = (None, handler)
+
+    def get_or_create(self, scale_id):
+        """Returns the scale with this id, registering it and its routes if needed."""
+        scale = self._scales.get(scale_id)
+        if scale is not None:
+            return scale
+        if not _SCALE_ID.fullmatch(scale_id):
+            raise ValueError(f"invalid scale id {scale_id!r}")
+
+        scale = Scale(scale_id, len(self._scales) + 1)
+        self._scales[scale_id] = scale
+        for suffix, handler in self._topic_handlers.items():
+            self._routes[scale.prefix + suffix] = (scale, handler)
+        if self._on_scale_added:
+            self._on_scale_added(scale)
+        return scale
+
+    def resolve(self, topic):
+        """Returns the (scale, handler) route for a topic, or None if the topic is not handled."""
+        route = self._routes.get(topic)
+        if route is not None:
+            return route
+
+        # Slow path, taken once per scale: smfm/<scale id>/<suffix>
+        if not topic.startswith(TOPIC_ROOT):
+            return None
+        scale_id, _, suffix = topic[len(TOPIC_ROOT):].partition("/")
+        if not scale_id or suffix not in self._topic_handlers:
+            return None
+        self.get_or_create(scale_id)
+        return self._routes.get(topic)
@@ -0,0 +1,271 @@
+"""
+Sharded ingestion: the weight topics are split across worker processes.
+
+Each shard process runs its own MqttClient, subscribed to the weight topics of its
+scales only, and its own IngestCore: it parses, estimates flow, records its scales
+and writes the samples and flow rates into SharedTimeSeriesBuffers created by the
+parent. ShardedIngest.drain() in the parent returns the new samples as views of those
+buffers, plus the small per-drain updates (message counts, flow readings, logs) the
+shards send through a queue, so samples are never pickled or copied between processes.
+
+Status, log and ack topics, commands and scale discovery stay with the parent's own
+client and IngestCore (with subscribe_weights off), whose recorder records the status
+changes and command outcomes next to the shards' samples; scales reach the shards through
+add_scale(). Scales that only publish weights are not discovered in this mode. Shard clients
+always start a clean session: scales go to the shards in discovery order, so a
+restored session could hold another shard's subscriptions and queued weights.
+The alarm rules run in the shards with the samples; the scales of a divergence rule
+are kept in the same shard so the rule sees both.
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from collections import namedtuple
+
+from core.ingest import IngestBatch, IngestCore
+from mqtt.mqtt_client import MqttClient
+from storage.capture import CaptureWriter, shard_capture_file
+from storage.recorder import SampleRecorder
+from utils import clock
+from utils.metrics import MetricsRegistry
+from utils.shared_ring_buffer import SharedTimeSeriesBuffer
+
+# Everything a shard process needs; must be picklable (client_factory included, None = paho).
+# recorder_settings are SampleRecorder's arguments, or None to record nothing.
+# time_origin is subtracted from the sample times in the buffers (their X axis), and
+# clock_anchor is the parent's utils.clock anchor, so all processes share one receive clock.
+# alarm_rules are core.alarms specs, evaluated by each shard on its scales.
+# capture_settings are (capture directory, buffer size) to capture each shard's traffic, or None.
+ShardSettings = namedtuple("ShardSettings", [
+    "broker", "port", "client_id", "keepalive_interval", "client_options", "client_factory",
+    "flow_settings", "recorder_settings", "drain_interval_s", "time_origin", "clock_anchor", "alarm_rules",
+    "capture_settings",
+])
+
+# Sent by a shard after each drain, once its samples are in the shared buffers
+_ShardUpdate = namedtuple("_ShardUpdate", ["shard", "message_count", "oldest_receive_time", "readings", "logs", "alarms"])
+
+
+def _write_batch(shard, batch, buffers, time_origin, updates, strays):
+    """Writes a drained batch into the shared buffers; samples of scales not assigned to the shard are dropped."""
+    for scale_id, (times, weights, device_times) in batch.samples.items():
+        if scale_id not in buffers:
+            if scale_id not in strays:
+                strays.add(scale_id)
+                batch.logs.append(("app", f"Ingestão {shard + 1}: amostras da balança {scale_id}, não atribuída a este processo, descartadas"))
+            continue
+        weight_buffer, flow_buffer = buffers[scale_id]
+        weight_buffer.extend(times - time_origin, weights, device_times)
+        if scale_id in batch.flows:
+            flow_times, flow_rates, _ = batch.flows[scale_id]
+            flow_buffer.extend(flow_times - time_origin, flow_rates)
+    readings = {scale_id: reading for scale_id, (_, _, reading) in batch.flows.items() if scale_id in buffers}
+    updates.put(_ShardUpdate(shard, batch.message_count, batch.oldest_receive_time, readings, batch.logs, batch.alarms))
+
+
+def _run_shard(shard, settings, control, updates):
+    """Entry point of a shard process: ingests the scales sent on control until it receives "stop"."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # The parent decides when to stop
+    updates.cancel_join_thread() # Never hang on exit if the parent stopped reading
+    clock.set_anchor(settings.clock_anchor)
+
+    recorder = None
+    if settings.recorder_settings:
+        recorder = SampleRecorder(*settings.recorder_settings)
+        recorder.start()
+    capture = None
+    if settings.capture_settings:
+        capture_dir, buffer_size = settings.capture_settings
+        capture = CaptureWriter(os.path.join(capture_dir, shard_capture_file(shard)), buffer_size)
+    core = IngestCore(
+        recorder=recorder, flow_settings=settings.flow_settings, alarm_rules=settings.alarm_rules, capture=capture
+    )
+    owned_topics = set() # Weight topics of the scales assigned to this shard
+    stray_topics = set()
+
+    def on_message(topic, payload, receive_time):
+        # Anything else (e.g. queued by the broker for a former subscription) would be recorded twice
+        if topic in owned_topics:
+            core.handle_message(topic, payload, receive_time)
+        elif topic not in stray_topics:
+            stray_topics.add(topic)
+            core.log(f"Ingestão {shard + 1}: mensagens de {topic}, não atribuído a este processo, descartadas")
+
+    client = MqttClient(
+        settings.broker, settings.port, f"{settings.client_id}_shard{shard + 1}", settings.keepalive_interval, (),
+        on_message=on_message, on_log=lambda message: core.log(f"Ingestão {shard + 1}: {message}", "mqtt"),
+        client_factory=settings.client_factory, metrics=core.metrics, **dict(settings.client_options, clean_session=True)
+    )
+    buffers = {} # scale_id -> (weight buffer, flow buffer), mapped writable
+    strays = set() # Scales received without being assigned (logged once)
+    client.start()
+
+    running = True
+    while running:
+        try:
+            command = control.get(timeout=settings.drain_interval_s)
+        except queue.Empty:
+            command = None
+        if command is not None and command[0] == "stop":
+            running = False
+        elif command is not None:
+            _, scale_id, weight_name, flow_name = command
+            buffers[scale_id] = (
+                SharedTimeSeriesBuffer.attach(weight_name, writable=True),
+                SharedTimeSeriesBuffer.attach(flow_name, writable=True),
+            )
+            weight_topic = core.scale_registry.get_or_create(scale_id).weight_topic
+            owned_topics.add(weight_topic)
+            client.subscribe(weight_topic)
+        if not running:
+            client.stop()
+        batch = core.drain()
+        if batch is not None:
+            _write_batch(shard, batch, buffers, settings.time_origin, updates, strays)
+
+    if recorder:
+        recorder.stop()
+    if capture:
+        capture.close()
+    for weight_buffer, flow_buffer in buffers.values():
+        weight_buffer.close()
+        flow_buffer.close()
+
+
+class ShardedIngest:
+    """
+    Parent side of sharded ingestion with n_shards worker processes.
+
+    add_scale() creates a scale's shared buffers (ring_capacity samples plus
+    ring_headroom) and hands the scale to the least loaded shard, or to the shard of
+    a scale in the same colocate group (a set of scale ids). drain() returns
+    an IngestBatch with the samples and flow rates written by all shards since the
+    previous call, as read-only views of the shared buffers (valid until the shards
+    write ring_headroom more samples), or None. attach_buffers() maps a scale's
+    buffers again for a consumer that reads them on its own (e.g. the plots).
+    add_scale() and drain() are meant to be called from the same thread.
+    """
+    def __init__(self, n_shards, settings, ring_capacity, ring_headroom, metrics=None, colocate=None):
+        if n_shards < 1:
+            raise ValueError("n_shards must be at least 1")
+        self._settings = settings
+        if colocate is None:
+            colocate = [rule["scales"] for rule in settings.alarm_rules or () if rule["type"] == "divergence"]
+        self._colocate = [set(group) for group in colocate]
+        self._ring_capacity = ring_capacity
+        self._ring_headroom = ring_headroom
+        # fork is unsafe once Qt and other threads are running
+        context = multiprocessing.get_context("spawn")
+        self._updates = context.Queue()
+        self._controls = [context.Queue() for _ in range(n_shards)]
+        self._processes = [
+            context.Process(
+                target=_run_shard, args=(shard, settings, control, self._updates),
+                name=f"smfm-ingest-{shard + 1}", daemon=True
+            )
+            for shard, control in enumerate(self._controls)
+        ]
+        self._lock = threading.Lock() # attach_buffers() may run in another thread than add_scale()
+        self._scales = {} # scale_id -> (shard, weight buffer, flow buffer)
+        self._loads = [0] * n_shards
+        self._readings = {} # scale_id -> latest FlowReading
+        self._exited = set()
+
+        metrics = metrics or MetricsRegistry()
+        self._m_messages = metrics.counter("smfm_shard_messages_total", "MQTT messages ingested by each shard process", ("shard",))
+        metrics.gauge("smfm_shards_alive", "Shard processes running").set_function(
+            lambda: sum(process.is_alive() for process in self._processes)
+        )
+
+    @property
+    def n_shards(self):
+        return len(self._processes)
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+
+    def stop(self):
+        """Stops the shard processes (their pending samples are recorded) and frees the shared buffers."""
+        for control in self._controls:
+            control.put(("stop",))
+        for process in self._processes:
+            process.join(timeout=10.0)
+            if process.is_alive():
+                process.terminate()
+        with self._lock:
+            for _, weight_buffer, flow_buffer in self._scales.values():
+                weight_buffer.close()
+                flow_buffer.close()
+            self._scales.clear()
+
+    def shard_of(self, scale_id):
+        with self._lock:
+            entry = self._scales.get(scale_id)
+        return entry[0] if entry else None
+
+    def add_scale(self, scale_id):
+        """Assigns a scale to a shard, which subscribes to its weight topic. Does nothing if already added."""
+        with self._lock:
+            if scale_id in self._scales:
+                return
+            shard = self._loads.index(min(self._loads))
+            for group in (group for group in self._colocate if scale_id in group):
+                placed = [self._scales[other][0] for other in group if other in self._scales]
+                if placed:
+                    shard = placed[0]
+                    break
+            self._loads[shard] += 1
+            weight_buffer = SharedTimeSeriesBuffer.create(self._ring_capacity, self._ring_headroom, with_times=True) # + device times
+            flow_buffer = SharedTimeSeriesBuffer.create(self._ring_capacity, self._ring_headroom)
+            self._scales[scale_id] = (shard, weight_buffer, flow_buffer)
+        self._controls[shard].put(("add", scale_id, weight_buffer.name, flow_buffer.name))
+
+    def attach_buffers(self, scale_id):
+        """Returns new read-only mappings of the (weight, flow) buffers of an added scale."""
+        with self._lock:
+            _, weight_buffer, flow_buffer = self._scales[scale_id]
+            return SharedTimeSeriesBuffer.attach(weight_buffer.name), SharedTimeSeriesBuffer.attach(flow_buffer.name)
+
+    def drain(self):
+        """Returns what the shards ingested since the previous call, or None if nothing was."""
+        batch = IngestBatch()
+        while True:
+            try:
+                update = self._updates.get_nowait()
+            except queue.Empty:
+                break
+            self._m_messages.labels(str(update.shard + 1)).inc(update.message_count)
+            batch.message_count += update.message_count
+            oldest = update.oldest_receive_time
+            if oldest is not None and (batch.oldest_receive_time is None or oldest < batch.oldest_receive_time):
+                batch.oldest_receive_time = oldest
+            batch.logs.extend(update.logs)
+            batch.alarms.extend(update.alarms)
+            self._readings.update(update.readings)
+
+        with self._lock:
+            scales = list(self._scales.items())
+        # The updates are sent after the samples are written, so the buffers are at least as recent
+        for scale_id, (_, weight_buffer, flow_buffer) in scales:
+            new = weight_buffer.refresh()
+            if new:
+                x, weights, device_times = weight_buffer.tail(new)
+                batch.samples[scale_id] = (x + self._settings.time_origin, weights, device_times)
+            reading = self._readings.get(scale_id)
+            if reading is not None:
+                new = flow_buffer.refresh()
+                if new:
+                    x, flow_rates, _ = flow_buffer.tail(new)
+                    batch.flows[scale_id] = (x + self._settings.time_origin, flow_rates, reading)
+
+        for shard, process in enumerate(self._processes):
+            if shard not in self._exited and process.exitcode is not None:
+                self._exited.add(shard)
+                batch.logs.append(("app", f"Processo de ingestão {shard + 1} terminou (código {process.exitcode})"))
+
+        if not (batch.samples or batch.message_count or batch.logs or batch.alarms):
+            return None
+        return batch
@@ -0,0 +1,138 @@
+"""
+Headless ingest daemon: subscribes to the scales, records every sample and
+estimates flow without importing Qt, for gateways with no display.
+
+    python daemon.py [--broker HOST] [--port PORT] [--no-record] [--capture]
+"""
+import time
+
+_STARTED_AT = time.perf_counter() # Before the other imports, so startup time includes them
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+
+from core.alarms import alarm_payload
+from core.ingest import IngestCore
+from storage.capture import CaptureWriter, CAPTURE_MAIN_FILE
+from mqtt.mqtt_client import MqttClient
+from storage.recorder import SampleRecorder
+from utils.batch_stats import BatchStats
+from utils.metrics import MetricsRegistry, MetricsServer
+from utils.process_stats import rss_mb
+from utils.constants import (
+    MQTT_BROKER, MQTT_PORT, MQTT_DAEMON_CLIENT_ID, MQTT_KEEPALIVE_INTERVAL,
+    MQTT_CLEAN_SESSION, MQTT_SUBSCRIBE_QOS, MQTT_RECONNECT_MIN_S, MQTT_RECONNECT_MAX_S, MQTT_OUTBOX_SIZE,
+    KNOWN_SCALE_IDS, BATCH_STATS_INTERVAL_S, DAEMON_DRAIN_INTERVAL_S,
+    RECORDER_DIR, RECORDER_FLUSH_INTERVAL_S, RECORDER_CHUNK_SAMPLES, RECORDER_MAX_PENDING_SAMPLES,
+    FLOW_EMA_TAU_S, FLOW_WINDOW_SAMPLES, FLOW_THRESHOLD_KG_S, METRICS_HTTP_HOST, METRICS_HTTP_PORT,
+    TOPIC_ALARMS, ALARM_QOS, ALARM_RULES, CAPTURE_DIR, CAPTURE_BUFFER_BYTES
+)
+
+log = logging.getLogger("smfm.daemon")
+
+
+def _log_batch(batch, batch_stats):
+    for scale in batch.new_scales:
+        log.info("Scale registered: %s (%s)", scale.scale_id, scale.weight_topic)
+    for scale_id, status, _ in batch.statuses:
+        log.info("Status of %s: %d", scale_id, status)
+    for event in batch.alarms:
+        if event.active:
+            log.warning("Alarm %s raised: %s", event.alarm, event.message)
+        else:
+            log.info("Alarm %s cleared: %s", event.alarm, event.message)
+    for source, message in batch.logs:
+        log.info("[%s] %s", source, message)
+    if batch.message_count:
+        report = batch_stats.record(batch.message_count, batch.oldest_receive_time)
+        if report:
+            log.info(report)
+
+
+def _publish_alarms(client, batch):
+    for event in batch.alarms:
+        client.publish(TOPIC_ALARMS, alarm_payload(event), qos=ALARM_QOS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless SMFM ingest daemon (no GUI).")
+    parser.add_argument("--broker", default=MQTT_BROKER)
+    parser.add_argument("--port", type=int, default=MQTT_PORT)
+    parser.add_argument("--no-record", action="store_true", help="do not record samples to disk")
+    parser.add_argument("--capture", action="store_true",
+                        help="capture the raw MQTT traffic to a new directory under CAPTURE_DIR (see main.py --replay)")
+    parser.add_argument("--stats-interval", type=float, default=BATCH_STATS_INTERVAL_S,
+                        help="seconds between throughput reports")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_HTTP_PORT,
+                        help="port of the Prometheus metrics endpoint (0 = disabled)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stdout)
+
+    recorder = None
+    if not args.no_record:
+        recorder = SampleRecorder(RECORDER_DIR, RECORDER_FLUSH_INTERVAL_S, RECORDER_CHUNK_SAMPLES, RECORDER_MAX_PENDING_SAMPLES)
+        recorder.start()
+    capture = None
+    if args.capture:
+        capture = CaptureWriter(
+            os.path.join(CAPTURE_DIR, time.strftime("%Y%m%d-%H%M%S"), CAPTURE_MAIN_FILE), CAPTURE_BUFFER_BYTES
+        )
+        log.info("Capturing the MQTT traffic to %s", capture.path)
+    metrics = MetricsRegistry()
+    core = IngestCore(
+        KNOWN_SCALE_IDS, recorder=recorder,
+        flow_settings=(FLOW_EMA_TAU_S, FLOW_WINDOW_SAMPLES, FLOW_THRESHOLD_KG_S), metrics=metrics,
+        alarm_rules=ALARM_RULES, capture=capture
+    )
+    client = MqttClient(
+        args.broker, args.port, MQTT_DAEMON_CLIENT_ID, MQTT_KEEPALIVE_INTERVAL, core.subscription_topics,
+        on_message=core.handle_message, on_status=lambda status: core.log(f"MQTT: {status}", "mqtt"),
+        on_log=lambda message: core.log(message, "mqtt"), retained_messages=core.retained_messages,
+        metrics=metrics, clean_session=MQTT_CLEAN_SESSION, subscribe_qos=MQTT_SUBSCRIBE_QOS,
+        reconnect_min_s=MQTT_RECONNECT_MIN_S, reconnect_max_s=MQTT_RECONNECT_MAX_S, outbox_size=MQTT_OUTBOX_SIZE
+    )
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = MetricsServer(metrics, METRICS_HTTP_HOST, args.metrics_port)
+        metrics_server.start()
+        log.info("Metrics available at http://%s:%d/metrics", METRICS_HTTP_HOST, args.metrics_port)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+
+    client.start() # Connects in the background, retrying until the broker is reachable
+    log.info(
+        "Ready in %.0f ms, RSS %.1f MB, Qt loaded: %s",
+        (time.perf_counter() - _STARTED_AT) * 1000.0, rss_mb(), "PyQt5" in sys.modules
+    )
+
+    batch_stats = BatchStats(args.stats_interval)
+    while not stopping.wait(DAEMON_DRAIN_INTERVAL_S):
+        batch = core.drain()
+        if batch is not None:
+            _publish_alarms(client, batch)
+            _log_batch(batch, batch_stats)
+
+    log.info("Stopping...")
+    client.stop()
+    batch = core.drain()
+    if batch is not None:
+        _log_batch(batch, batch_stats)
+    if capture:
+        capture.close()
+        log.info("%d messages captured", capture.frames)
+    if metrics_server:
+        metrics_server.stop()
+    if recorder:
+        recorder.stop() # Write the samples still pending
+        if recorder.dropped_samples:
+            log.warning("%d samples were dropped by the recorder", recorder.dropped_samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from PyQt5 import QtWidgets, QtCore, QtGui
+
+
+def _format_number(value):
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:.3f}"
+    return f"{int(value)}"
+
+
+def _format_histogram(name, series):
+    if series.count == 0:
+        return "n=0"
+    # Latency histograms are shown in ms; other histograms in their own unit
+    scale, unit = (1000.0, " ms") if name.endswith("_seconds") else (1.0, "")
+    p50, p99 = series.quantile(0.5), series.quantile(0.99)
+    p99_text = "+Inf" if p99 == float("inf") else f"{p99 * scale:g}{unit}"
+    return (
+        f"n={series.count}  média={series.sum / series.count * scale:.3g}{unit}  "
+        f"p50≤{p50 * scale:g}{unit}  p99≤{p99_text}"
+    )
+
+
+class DiagnosticsPanel(QtWidgets.QWidget):
+    """
+    Table of the application's metrics (counters, gauges and histogram summaries),
+    refreshed every refresh_interval_ms while the panel is visible.
+    """
+    def __init__(self, registry, refresh_interval_ms, parent=None):
+        super().__init__(parent)
+        self._registry = registry
+
+        self.table = QtWidgets.QTableWidget(0, 3)
+        self.table.setHorizontalHeaderLabels(["Métrica", "Rótulos", "Valor"])
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.setFont(QtGui.QFont("Courier", 9))
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(2, QtWidgets.QHeaderView.Stretch)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.table)
+
+        self._refresh_timer = QtCore.QTimer(self)
+        self._refresh_timer.setInterval(refresh_interval_ms)
+        self._refresh_timer.timeout.connect(self.refresh)
+        self._refresh_timer.start()
+
+    def rows(self):
+        """Returns the (metric, labels, value) text of every series."""
+        rows = []
+        for metric in self._registry.metrics():
+            for values, series in sorted(metric.series()):
+                labels = ", ".join(f"{name}={value}" for name, value in zip(metric.labelnames, values))
+                if metric.kind == "histogram":
+                    text = _format_histogram(metric.name, series)
+                elif metric.kind == "gauge":
+                    text = _format_number(series.get())
+                else:
+                    text = _format_number(series.value)
+                rows.append((metric.name, labels, text))
+        return rows
+
+    @QtCore.pyqtSlot()
+    def refresh(self):
+        if not self.isVisible():
+            return
+        rows = self.rows()
+        self.table.setRowCount(len(rows))
+        for row, texts in enumerate(rows):
+            for column, text in enumerate(texts):
+                item = self.table.item(row, column)
+                if item is None:
+                    self.table.setItem(row, column, QtWidgets.QTableWidgetItem(text))
+                elif item.text() != text:
+                    item.setText(text)
@@ -0,0 +1,185 @@
+import time
+from collections import deque
+from PyQt5 import QtWidgets, QtCore, QtGui
+
+
+class _LogEntry:
+    __slots__ = ("seq", "stamp", "message", "repeats")
+
+    def __init__(self, seq, stamp, message):
+        self.seq = seq # Absolute position in the log, used to find the entry's row
+        self.stamp = stamp
+        self.message = message
+        self.repeats = 1
+
+    def display(self):
+        text = f"[{self.stamp}] {self.message}"
+        return text if self.repeats == 1 else f"{text} (x{self.repeats})"
+
+
+class LogModel(QtCore.QAbstractListModel):
+    """List model over a fixed-capacity ring of log entries. The oldest rows are dropped when full."""
+    def __init__(self, capacity, parent=None):
+        super().__init__(parent)
+        self._entries = deque()
+        self._capacity = capacity
+        self._next_seq = 0
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._entries)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and index.isValid():
+            return self._entries[index.row()].display()
+        return None
+
+    def is_newest(self, entry):
+        """Whether entry is the last one created (the last row, or pending behind it)."""
+        return entry.seq == self._next_seq - 1
+
+    def new_entry(self, stamp, message):
+        entry = _LogEntry(self._next_seq, stamp, message)
+        self._next_seq += 1
+        return entry
+
+    def append_entries(self, entries):
+        """Appends a batch of entries with one insert notification (plus one removal when full)."""
+        if not entries:
+            return
+        entries = entries[-self._capacity:]
+        overflow = len(self._entries) + len(entries) - self._capacity
+        if overflow > 0:
+            self.beginRemoveRows(QtCore.QModelIndex(), 0, overflow - 1)
+            for _ in range(overflow):
+                self._entries.popleft()
+            self.endRemoveRows()
+        first = len(self._entries)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(entries) - 1)
+        self._entries.extend(entries)
+        self.endInsertRows()
+
+    def refresh_entries(self, entries):
+        """Notifies views that the repeat counters of entries already in the model changed."""
+        if not self._entries:
+            return
+        first_seq = self._entries[0].seq
+        for entry in entries:
+            row = entry.seq - first_seq
+            if 0 <= row < len(self._entries):
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [QtCore.Qt.DisplayRole])
+
+
+class _SourceState:
+    """Repeat collapsing and token-bucket rate limiting state of one log source."""
+    __slots__ = ("last_entry", "tokens", "last_refill", "suppressed")
+
+    def __init__(self, burst):
+        self.last_entry = None
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.suppressed = 0
+
+
+class LogPanel(QtWidgets.QGroupBox):
+    """
+    Log area of the main window.
+
+    Messages are buffered and added to a list view once per flush tick; the view
+    only lays out the visible rows. A message repeating the last line of the log,
+    from the same source, increments an "xN" counter on that line. Each source may
+    log at most rate_limit_per_s messages per second (with bursts of rate_burst),
+    repeats included, before its messages are counted as suppressed. The filter
+    box searches the retained history.
+    """
+    def __init__(self, title, capacity, flush_interval_ms, rate_limit_per_s, rate_burst, parent=None):
+        super().__init__(title, parent)
+        self._rate_limit = rate_limit_per_s
+        self._rate_burst = rate_burst
+        self._sources = {} # source -> _SourceState
+        self._pending = [] # New entries waiting for the next flush
+        self._repeated = {} # seq -> entry whose counter changed since the last flush
+
+        self.model = LogModel(capacity, self)
+        self._proxy = QtCore.QSortFilterProxyModel(self)
+        self._proxy.setSourceModel(self.model)
+        self._proxy.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
+
+        layout = QtWidgets.QVBoxLayout()
+        self.filter_entry = QtWidgets.QLineEdit()
+        self.filter_entry.setPlaceholderText("Filtrar logs...")
+        self.filter_entry.setClearButtonEnabled(True)
+        layout.addWidget(self.filter_entry)
+
+        self.view = QtWidgets.QListView()
+        self.view.setModel(self._proxy)
+        self.view.setUniformItemSizes(True) # Lets the view skip measuring every row
+        self.view.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.view.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.view.setFont(QtGui.QFont("Courier", 10))
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+
+        # Filtering runs once typing pauses instead of on every keystroke
+        self._filter_timer = QtCore.QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(250)
+        self._filter_timer.timeout.connect(self._apply_filter)
+        self.filter_entry.textChanged.connect(self._filter_timer.start)
+
+        self._flush_timer = QtCore.QTimer(self)
+        self._flush_timer.setInterval(flush_interval_ms)
+        self._flush_timer.timeout.connect(self.flush)
+        self._flush_timer.start()
+
+    def append(self, message, source="app"):
+        """Queues a message for the next flush. Must be called from the GUI thread."""
+        state = self._sources.get(source)
+        if state is None:
+            state = self._sources[source] = _SourceState(self._rate_burst)
+
+        now = time.monotonic()
+        state.tokens = min(self._rate_burst, state.tokens + (now - state.last_refill) * self._rate_limit)
+        state.last_refill = now
+        if state.tokens < 1:
+            state.suppressed += 1
+            return
+        state.tokens -= 1
+
+        # Same text as the last line of the log, from this source: only bump its counter
+        last = state.last_entry
+        if last is not None and last.message == message and not state.suppressed and self.model.is_newest(last):
+            last.repeats += 1
+            self._repeated[last.seq] = last
+            return
+
+        stamp = time.strftime("%H:%M:%S")
+        if state.suppressed:
+            self._pending.append(self.model.new_entry(stamp, f"({state.suppressed} mensagens suprimidas de '{source}')"))
+            state.suppressed = 0
+        entry = self.model.new_entry(stamp, message)
+        state.last_entry = entry
+        self._pending.append(entry)
+
+    @QtCore.pyqtSlot()
+    def flush(self):
+        """Adds the queued entries to the model in one batch."""
+        if not self._pending and not self._repeated:
+            return
+        scroll_bar = self.view.verticalScrollBar()
+        follow = scroll_bar.value() == scroll_bar.maximum()
+
+        pending, self._pending = self._pending, []
+        repeated, self._repeated = self._repeated, {}
+        self.model.refresh_entries(repeated.values())
+        self.model.append_entries(pending)
+
+        if follow and pending:
+            self.view.scrollToBottom()
+
+    def to_plain_text(self):
+        return "\n".join(self.model.data(self.model.index(row)) for row in range(self.model.rowCount()))
+
+    @QtCore.pyqtSlot()
+    def _apply_filter(self):
+        self._proxy.setFilterFixedString(self.filter_entry.text())
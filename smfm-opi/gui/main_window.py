@@ -1,5 +1,8 @@
 import json
-from collections import deque
+import os
+import threading
+import time
+import numpy as np
 from PyQt5 import QtWidgets, QtCore, QtGui
 import pyqtgraph as pg
 
@@ -7,85 +10,185 @@ import pyqtgraph as pg
 from mqtt.mqtt_worker import MqttWorker
 from utils.constants import (
     MQTT_BROKER, MQTT_PORT, MQTT_CLIENT_ID, MQTT_KEEPALIVE_INTERVAL,
-    TOPIC_WEIGHT_01, TOPIC_WEIGHT_02, TOPIC_STATUS_01, TOPIC_STATUS_02, TOPIC_LOG,
-    COMMAND_TOPIC_01_PREFIX, COMMAND_TOPIC_02_PREFIX, START_COMMAND,
-    MAX_PLOT_POINTS, PLOT_UPDATE_INTERVAL_MS
+    MQTT_CLEAN_SESSION, MQTT_SUBSCRIBE_QOS, MQTT_RECONNECT_MIN_S, MQTT_RECONNECT_MAX_S, MQTT_OUTBOX_SIZE,
+    START_COMMAND, KNOWN_SCALE_IDS, SCALE_STATUS_LABELS,
+    MAX_PLOT_POINTS, PLOT_UPDATE_INTERVAL_MS, SCALE_GRID_COLUMNS,
+    PLOT_MIN_INTERVAL_MS, PLOT_MAX_INTERVAL_MS, PLOT_FRAME_BUDGET_MS, PLOT_USE_OPENGL, PLOT_ANTIALIAS,
+    MQTT_BATCH_INTERVAL_MS, BATCH_STATS_INTERVAL_S, INGEST_SHARDS, SHARD_RING_HEADROOM,
+    RECORDER_ENABLED, RECORDER_DIR, RECORDER_FLUSH_INTERVAL_S,
+    RECORDER_CHUNK_SAMPLES, RECORDER_MAX_PENDING_SAMPLES, REPORT_DIR, REPORT_SUMMARY_INTERVAL_S, REPORT_FORMAT,
+    LOG_CAPACITY, LOG_FLUSH_INTERVAL_MS, LOG_RATE_LIMIT_PER_S, LOG_RATE_BURST,
+    FLOW_EMA_TAU_S, FLOW_WINDOW_SAMPLES, FLOW_THRESHOLD_KG_S, ALARM_RULES,
+    ALIGN_GRID_STEP_S, ALIGN_MAX_LAG_S, ALIGN_MAX_GRID_POINTS, CAPTURE_BUFFER_BYTES,
+    METRICS_HTTP_ENABLED, METRICS_HTTP_HOST, METRICS_HTTP_PORT, DIAGNOSTICS_REFRESH_INTERVAL_MS,
+    COMMAND_QOS, COMMAND_ENVELOPE, COMMAND_ACK_TIMEOUT_S, COMMAND_MAX_RETRIES, COMMAND_CHECK_INTERVAL_MS
 )
+from utils import clock
+from utils.batch_stats import BatchStats
+from utils.ring_buffer import TimeSeriesBuffer
+from utils.decimation import MinMaxPyramid
+from utils.metrics import MetricsRegistry, MetricsServer
+from core.alignment import TimeAligner
+from core.ingest import IngestCore
+from core.sharding import ShardedIngest, ShardSettings
+from core.commands import CommandTracker, ACKED, REJECTED, TIMED_OUT
+from core.report import ReportEngine, export_report
+from storage.capture import CaptureWriter, CAPTURE_MAIN_FILE
+from storage.recorder import SampleRecorder
+from gui.log_panel import LogPanel
+from gui.diagnostics_panel import DiagnosticsPanel
+from gui.render_scheduler import RenderScheduler
+
+# Curve colors, assigned to scales in order of discovery
+PLOT_COLORS = ['y', 'c', 'm', 'g', 'r', 'w']
+# Label color of each scale status code (SCALE_STATUS_LABELS)
+STATUS_COLORS = ['blue', 'blue', 'orange', 'green', 'red']
+# Render scheduler key of the total line mass plot (the others are (scale_id, "weight" | "flow"))
+TOTAL_PLOT_KEY = (None, "total")
 
 class ScaleMonitorWindow(QtWidgets.QMainWindow):
     """
     Main application window for monitoring and controlling load cells via MQTT.
+    mqtt_client_factory replaces the paho client class (used by the benchmark suite).
+    With ingest_shards > 0 the weight topics are ingested by that many processes
+    (core.sharding) and plotted straight from their shared buffers; the factory
+    then has to be picklable, and scales that are not in known_scale_ids are only
+    discovered when they publish a status. alarm_rules (core.alarms) are evaluated
+    by the ingest core, or by the shards. record turns the sample recorder on or off,
+    and capture_dir, if given, is where the raw traffic is captured (storage.capture).
     """
-    def __init__(self):
+    # Requests queued to the MQTT worker thread
+    command_requested = QtCore.pyqtSignal(object, str, str, int) # scale ids, command, payload, QoS
+    publish_requested = QtCore.pyqtSignal(str, str)              # topic, payload
+    report_finished = QtCore.pyqtSignal(str)                     # log line, emitted from the report thread
+
+    def __init__(self, mqtt_client_factory=None, ingest_shards=INGEST_SHARDS, known_scale_ids=KNOWN_SCALE_IDS,
+                 alarm_rules=ALARM_RULES, record=RECORDER_ENABLED, capture_dir=None):
         super().__init__()
         self.setWindowTitle("Sistema de Monitoramento de Fluidos por Massa")
         self.setGeometry(100, 100, 1000, 800) # x, y, width, height
 
+        # Rendering fast paths, set before any plot is created
+        pg.setConfigOptions(useOpenGL=PLOT_USE_OPENGL, antialias=PLOT_ANTIALIAS)
+
         self.central_widget = QtWidgets.QWidget()
         self.setCentralWidget(self.central_widget)
         self.main_layout = QtWidgets.QVBoxLayout(self.central_widget)
 
-        # List of topics that the MQTT worker should subscribe to
-        self._mqtt_subscription_topics = [
-            TOPIC_WEIGHT_01, TOPIC_WEIGHT_02, 
-            TOPIC_STATUS_01, TOPIC_STATUS_02, 
-            TOPIC_LOG
-        ]
+        self._session_start = clock.now() # Origin of the plots' time axis
+
+        # --- Sample Recorder (writes to disk from its own thread) ---
+        # When sharded, each shard process records its scales' samples and this one only the events
+        self.recorder = None
+        recorder_settings = (RECORDER_DIR, RECORDER_FLUSH_INTERVAL_S, RECORDER_CHUNK_SAMPLES, RECORDER_MAX_PENDING_SAMPLES)
+        if record:
+            self.recorder = SampleRecorder(*recorder_settings)
+            self.recorder.start()
+        self._report_thread = None # Generates the session report (generate_session_report)
+
+        # --- Metrics (shown in the diagnostics panel and served over HTTP) ---
+        self.metrics = MetricsRegistry()
+        self._m_batches_processed = self.metrics.counter("smfm_batches_processed_total", "Batches processed by the GUI thread")
+        self._m_batch_latency = self.metrics.histogram(
+            "smfm_batch_delivery_seconds", "Time from receiving the oldest message of a batch to processing it in the GUI"
+        )
+        self._m_render_frame = self.metrics.histogram("smfm_render_frame_seconds", "Wall time of one plot frame, including its repaint")
+        self._m_curves_drawn = self.metrics.counter("smfm_curves_drawn_total", "Plot curves redrawn")
+
+        # Plot redraws (separate from MQTT reception for performance): only curves whose data
+        # changed are redrawn, nothing runs while idle or minimized, and the frame rate adapts.
+        self.render_scheduler = RenderScheduler(
+            self._render_plots, PLOT_UPDATE_INTERVAL_MS, PLOT_MIN_INTERVAL_MS,
+            PLOT_MAX_INTERVAL_MS, PLOT_FRAME_BUDGET_MS, self
+        )
+        self.render_scheduler.frame_rendered.connect(self._m_render_frame.observe)
+        self.metrics.gauge("smfm_render_interval_ms", "Current interval between plot frames").set_function(
+            lambda: self.render_scheduler.interval_ms
+        )
+
+        # --- Ingest Core ---
+        # Routes, parses, records and estimates flow off the GUI thread (same core as daemon.py).
+        # Scales, including the known ones, reach the GUI through the first batches.
+        flow_settings = self._flow_settings = (FLOW_EMA_TAU_S, FLOW_WINDOW_SAMPLES, FLOW_THRESHOLD_KG_S)
+        client_options = dict(
+            clean_session=MQTT_CLEAN_SESSION, subscribe_qos=MQTT_SUBSCRIBE_QOS,
+            reconnect_min_s=MQTT_RECONNECT_MIN_S, reconnect_max_s=MQTT_RECONNECT_MAX_S, outbox_size=MQTT_OUTBOX_SIZE
+        )
+        self.shards = None
+        if ingest_shards:
+            # Weights go to the shard processes; this core keeps statuses, logs and commands
+            self.shards = ShardedIngest(
+                ingest_shards,
+                ShardSettings(
+                    MQTT_BROKER, MQTT_PORT, MQTT_CLIENT_ID, MQTT_KEEPALIVE_INTERVAL, client_options, mqtt_client_factory,
+                    flow_settings, recorder_settings if record else None,
+                    MQTT_BATCH_INTERVAL_MS / 1000.0, self._session_start, clock.anchor(), alarm_rules,
+                    (capture_dir, CAPTURE_BUFFER_BYTES) if capture_dir else None
+                ),
+                MAX_PLOT_POINTS, SHARD_RING_HEADROOM, metrics=self.metrics
+            )
+            self.shards.start()
+        self.capture = None
+        if capture_dir:
+            self.capture = CaptureWriter(os.path.join(capture_dir, CAPTURE_MAIN_FILE), CAPTURE_BUFFER_BYTES)
+        self.ingest_core = IngestCore(
+            known_scale_ids, recorder=self.recorder, flow_settings=flow_settings, metrics=self.metrics,
+            command_tracker=CommandTracker(COMMAND_ACK_TIMEOUT_S, COMMAND_MAX_RETRIES, COMMAND_ENVELOPE),
+            subscribe_weights=self.shards is None, alarm_rules=alarm_rules if self.shards is None else (),
+            capture=self.capture
+        )
+
         # --- MQTT Thread Setup ---
         self.mqtt_thread = QtCore.QThread()
         self.mqtt_worker = MqttWorker(
-            MQTT_BROKER, MQTT_PORT, MQTT_CLIENT_ID, 
-            MQTT_KEEPALIVE_INTERVAL, self._mqtt_subscription_topics
+            self.ingest_core, MQTT_BROKER, MQTT_PORT, MQTT_CLIENT_ID,
+            MQTT_KEEPALIVE_INTERVAL,
+            batch_interval_ms=MQTT_BATCH_INTERVAL_MS, client_factory=mqtt_client_factory,
+            command_check_interval_ms=COMMAND_CHECK_INTERVAL_MS, shards=self.shards,
+            aligner=TimeAligner(ALIGN_GRID_STEP_S, ALIGN_MAX_LAG_S, ALIGN_MAX_GRID_POINTS), **client_options
         )
         self.mqtt_worker.moveToThread(self.mqtt_thread)
+        self.command_requested.connect(self.mqtt_worker.submit_command)
+        self.publish_requested.connect(self.mqtt_worker.publish_message)
+        batches_emitted = self.mqtt_worker.batches_emitted
+        self.metrics.gauge("smfm_gui_pending_batches", "Batches queued to the GUI thread and not yet processed").set_function(
+            lambda: batches_emitted.value - self._m_batches_processed.value
+        )
 
         # Connect signals from worker to slots in main window
         self.mqtt_thread.started.connect(self.mqtt_worker.start_mqtt)
-        self.mqtt_worker.message_received.connect(self.process_mqtt_message)
+        self.mqtt_worker.batch_received.connect(self.process_mqtt_batch)
+        self.batch_stats = BatchStats(BATCH_STATS_INTERVAL_S)
         self.mqtt_worker.connection_status.connect(self.update_mqtt_status)
-        self.mqtt_worker.log_message.connect(self.log_message)
+        self.mqtt_worker.log_message.connect(self._log_worker_message)
+        self.report_finished.connect(self.log_message)
         
         # Start the MQTT thread
         self.mqtt_thread.start()
 
         # --- UI Elements ---
         self._create_mqtt_status_frame()
-        self.scales_horizontal_layout = QtWidgets.QHBoxLayout()
-        self._create_scale_frames() # Este método agora adicionará os frames ao layout horizontal
-        self.main_layout.addLayout(self.scales_horizontal_layout) # Adicione o layout horizontal ao layout principal
+        self._create_scale_frames()
+        self._create_total_frame()
         self._create_control_frame()
         self._create_log_frame()
-        
-        # Group of radio buttons for scale selection
-        self.selected_scale_group = QtWidgets.QButtonGroup(self)
-        self.radio_button_scale1 = QtWidgets.QRadioButton("Balança 01")
-        self.radio_button_scale2 = QtWidgets.QRadioButton("Balança 02")
-        self.selected_scale_group.addButton(self.radio_button_scale1, 1) # ID 1 for scale 01
-        self.selected_scale_group.addButton(self.radio_button_scale2, 2) # ID 2 for scale 02
-        self.radio_button_scale1.setChecked(True) # Default selection
-
-        # Add radio buttons to the control frame layout
+        self._create_diagnostics_dock()
+        self.metrics_server = self._start_metrics_server()
+
+        # Scale selector for commands, filled as scales are registered
+        self.scale_selector = QtWidgets.QComboBox()
         control_layout = self.control_frame.layout()
-        control_layout.addWidget(QtWidgets.QLabel("Selecionar Balança:"), 0, 0) # Spans 1 row, 3 columns
-        control_layout.addWidget(self.radio_button_scale1, 0, 1)
-        control_layout.addWidget(self.radio_button_scale2, 0, 2)
+        control_layout.addWidget(QtWidgets.QLabel("Selecionar Balança:"), 0, 0)
+        control_layout.addWidget(self.scale_selector, 0, 1, 1, 2) # Row 0, Col 1, Spans 1 row, 2 columns
+        self.all_scales_checkbox = QtWidgets.QCheckBox("Enviar para todas as balanças")
+        control_layout.addWidget(self.all_scales_checkbox, 6, 0, 1, 3)
 
         # --- Plotting Data Initialization ---
-        self.time_data_01 = deque(maxlen=MAX_PLOT_POINTS)
-        self.weight_data_01 = deque(maxlen=MAX_PLOT_POINTS)
-        self.time_data_02 = deque(maxlen=MAX_PLOT_POINTS)
-        self.weight_data_02 = deque(maxlen=MAX_PLOT_POINTS)
-        self.current_time_idx = 0 # Simple index for the X-axis of the plot (number of samples)
-
-        # Configure plots within their respective frames
-        self.plot_curve_01 = self.scale_frames["scale_01"]["plot_widget"].plot(pen=pg.mkPen(color='y', width=2)) # Yellow line
-        self.plot_curve_02 = self.scale_frames["scale_02"]["plot_widget"].plot(pen=pg.mkPen(color='c', width=2)) # Cyan line
-
-        # Timer for plot updates (separate from MQTT reception for performance)
-        self.plot_timer = QtCore.QTimer(self)
-        self.plot_timer.setInterval(PLOT_UPDATE_INTERVAL_MS) # Update plots every X ms
-        self.plot_timer.timeout.connect(self.update_plots)
-        self.plot_timer.start()
+        # Frames, curves and plot buffers are created by _add_scale when a batch announces a scale.
+        self.scales = {} # scale_id -> Scale, in order of discovery
+        self.plot_curves = {} # scale_id -> plot curve
+        self.flow_curves = {} # scale_id -> flow rate plot curve
+
 
         # NEW: Operation state variable
         self._operation_active = False # False = Stopped, True = Running
@@ -99,45 +202,168 @@ class ScaleMonitorWindow(QtWidgets.QMainWindow):
         self.mqtt_status_frame.setLayout(layout)
         self.main_layout.addWidget(self.mqtt_status_frame)
 
+    def _create_diagnostics_dock(self):
+        self.diagnostics_panel = DiagnosticsPanel(self.metrics, DIAGNOSTICS_REFRESH_INTERVAL_MS)
+        self.diagnostics_dock = QtWidgets.QDockWidget("Diagnóstico", self)
+        self.diagnostics_dock.setObjectName("diagnostics_dock")
+        self.diagnostics_dock.setWidget(self.diagnostics_panel)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.diagnostics_dock)
+        self.diagnostics_dock.hide()
+        # Shown/hidden from a button in the MQTT status frame
+        diagnostics_button = QtWidgets.QToolButton()
+        diagnostics_button.setDefaultAction(self.diagnostics_dock.toggleViewAction())
+        self.mqtt_status_frame.layout().addWidget(diagnostics_button, alignment=QtCore.Qt.AlignRight)
+
+    def _start_metrics_server(self):
+        """Serves the metrics in Prometheus text format on the local HTTP endpoint, if enabled."""
+        if not METRICS_HTTP_ENABLED:
+            return None
+        try:
+            server = MetricsServer(self.metrics, METRICS_HTTP_HOST, METRICS_HTTP_PORT)
+        except OSError as e:
+            self.log_message(f"Metrics endpoint not started on {METRICS_HTTP_HOST}:{METRICS_HTTP_PORT}: {e}")
+            return None
+        server.start()
+        self.log_message(f"Metrics available at http://{METRICS_HTTP_HOST}:{METRICS_HTTP_PORT}/metrics")
+        return server
+
     def _create_scale_frames(self):
         self.scale_frames = {}
-        for i in range(1, 3): # For scale 01 and 02
-            frame = QtWidgets.QGroupBox(f"Balança 0{i}")
-            layout = QtWidgets.QGridLayout() # Using QGridLayout for better internal alignment
-
-            # Weight and Status Labels
-            weight_label_text = QtWidgets.QLabel("Peso Atual:")
-            weight_value_label = QtWidgets.QLabel("0.000 kg")
-            weight_value_label.setFont(QtGui.QFont("Arial", 16, QtGui.QFont.Bold))
-            
-            status_label_text = QtWidgets.QLabel("Status:")
-            status_value_label = QtWidgets.QLabel("Desconectada")
-            status_value_label.setStyleSheet("color: blue; font-weight: bold;") # Cor inicial
-
-            layout.addWidget(weight_label_text, 0, 0)
-            layout.addWidget(weight_value_label, 0, 1)
-            layout.addWidget(status_label_text, 1, 0)
-            layout.addWidget(status_value_label, 1, 1)
-
-            # Plot Widget for this scale
-            plot_widget = pg.PlotWidget()
-            plot_widget.setTitle(f"Balança 0{i} - Peso em Tempo Real")
-            plot_widget.setLabel('left', 'Peso', units='kg')
-            plot_widget.setLabel('bottom', 'Tempo (amostras)')
-            plot_widget.setBackground('k') # Black background
-            plot_widget.showGrid(x=True, y=True) # Show grid
-
-            layout.addWidget(plot_widget, 2, 0, 1, 2) # Row 2, Col 0, Spans 1 row, 2 columns
-
-            frame.setLayout(layout)
-            # NOVO: Adicione o frame ao layout horizontal das balanças
-            self.scales_horizontal_layout.addWidget(frame) 
-            self.scale_frames[f"scale_0{i}"] = {
-                "weight_label": weight_value_label,
-                "status_label": status_value_label,
-                "plot_widget": plot_widget,
-                "frame_layout": layout # Armazena o layout do frame para potencial adição futura
-            }
+        # Scale frames are laid out on a grid inside a scroll area, so any number of scales fits
+        scales_widget = QtWidgets.QWidget()
+        self.scales_grid_layout = QtWidgets.QGridLayout(scales_widget)
+        scroll_area = QtWidgets.QScrollArea()
+        scroll_area.setWidgetResizable(True)
+        scroll_area.setWidget(scales_widget)
+        # Plots scrolled into view are drawn if they changed while hidden
+        scroll_area.verticalScrollBar().valueChanged.connect(lambda *_: self.render_scheduler.wake())
+        scroll_area.horizontalScrollBar().valueChanged.connect(lambda *_: self.render_scheduler.wake())
+        scroll_area.viewport().installEventFilter(self)
+        self.main_layout.addWidget(scroll_area, stretch=1)
+
+    def _create_total_frame(self):
+        """Total mass on the line: the sum of the scales resampled onto a common time grid."""
+        frame = QtWidgets.QGroupBox("Linha")
+        layout = QtWidgets.QGridLayout()
+        self.total_label = QtWidgets.QLabel("0.000 kg")
+        self.total_label.setFont(QtGui.QFont("Arial", 12, QtGui.QFont.Bold))
+        layout.addWidget(QtWidgets.QLabel("Massa Total:"), 0, 0)
+        layout.addWidget(self.total_label, 0, 1)
+        self.total_plot_widget = pg.PlotWidget()
+        self.total_plot_widget.setTitle("Massa Total da Linha")
+        self.total_plot_widget.setLabel('left', 'Peso', units='kg')
+        self.total_plot_widget.setLabel('bottom', 'Tempo', units='s')
+        self.total_plot_widget.setBackground('k')
+        self.total_plot_widget.showGrid(x=True, y=True)
+        self.total_plot_widget.setMinimumHeight(150)
+        self.total_plot_widget.installEventFilter(self)
+        layout.addWidget(self.total_plot_widget, 1, 0, 1, 2)
+        layout.setColumnStretch(1, 1)
+        frame.setLayout(layout)
+        self.main_layout.addWidget(frame)
+
+        self.total_data = TimeSeriesBuffer(MAX_PLOT_POINTS)
+        self.total_pyramid = MinMaxPyramid(MAX_PLOT_POINTS)
+        self.total_curve = self.total_plot_widget.plot(pen=pg.mkPen(color='w', width=2))
+        self.total_plot_widget.getViewBox().sigXRangeChanged.connect(
+            lambda *_: self._on_x_range_changed(self.total_plot_widget, self.total_curve, self.total_data, self.total_pyramid)
+        )
+
+    def _add_scale(self, scale):
+        """Creates the frame, plot curves, plot buffers and selector entry of a newly registered scale."""
+        frame = QtWidgets.QGroupBox(scale.name)
+        layout = QtWidgets.QGridLayout() # Using QGridLayout for better internal alignment
+
+        # Weight and Status Labels
+        weight_label_text = QtWidgets.QLabel("Peso Atual:")
+        weight_value_label = QtWidgets.QLabel("0.000 kg")
+        weight_value_label.setFont(QtGui.QFont("Arial", 16, QtGui.QFont.Bold))
+        
+        status_label_text = QtWidgets.QLabel("Status:")
+        status_value_label = QtWidgets.QLabel("Desconectada")
+        status_value_label.setStyleSheet("color: blue; font-weight: bold;") # Cor inicial
+
+        flow_value_label = QtWidgets.QLabel("-- kg/s")
+        dispensed_value_label = QtWidgets.QLabel("0.000 kg")
+        time_to_empty_value_label = QtWidgets.QLabel("--")
+        alarms_value_label = QtWidgets.QLabel("Nenhum")
+        alarms_value_label.setStyleSheet("color: green;")
+
+        layout.addWidget(weight_label_text, 0, 0)
+        layout.addWidget(weight_value_label, 0, 1)
+        layout.addWidget(status_label_text, 1, 0)
+        layout.addWidget(status_value_label, 1, 1)
+        layout.addWidget(QtWidgets.QLabel("Vazão:"), 2, 0)
+        layout.addWidget(flow_value_label, 2, 1)
+        layout.addWidget(QtWidgets.QLabel("Total Dispensado:"), 3, 0)
+        layout.addWidget(dispensed_value_label, 3, 1)
+        layout.addWidget(QtWidgets.QLabel("Tempo p/ Esvaziar:"), 4, 0)
+        layout.addWidget(time_to_empty_value_label, 4, 1)
+        layout.addWidget(QtWidgets.QLabel("Alarmes:"), 5, 0)
+        layout.addWidget(alarms_value_label, 5, 1)
+
+        # Plot Widget for this scale
+        plot_widget = pg.PlotWidget()
+        plot_widget.setTitle(f"{scale.name} - Peso em Tempo Real")
+        plot_widget.setLabel('left', 'Peso', units='kg')
+        plot_widget.setLabel('bottom', 'Tempo', units='s')
+        plot_widget.setBackground('k') # Black background
+        plot_widget.showGrid(x=True, y=True) # Show grid
+        plot_widget.setMinimumHeight(250)
+
+        layout.addWidget(plot_widget, 6, 0, 1, 2) # Row 6, Col 0, Spans 1 row, 2 columns
+
+        # Flow rate plot, below the weight plot
+        flow_plot_widget = pg.PlotWidget()
+        flow_plot_widget.setTitle(f"{scale.name} - Vazão")
+        flow_plot_widget.setLabel('left', 'Vazão', units='kg/s')
+        flow_plot_widget.setLabel('bottom', 'Tempo', units='s')
+        flow_plot_widget.setBackground('k')
+        flow_plot_widget.showGrid(x=True, y=True)
+        flow_plot_widget.setMinimumHeight(150)
+        layout.addWidget(flow_plot_widget, 7, 0, 1, 2)
+        plot_widget.installEventFilter(self)
+        flow_plot_widget.installEventFilter(self)
+
+        frame.setLayout(layout)
+        row, column = divmod(scale.index - 1, SCALE_GRID_COLUMNS)
+        self.scales_grid_layout.addWidget(frame, row, column)
+        self.scale_frames[scale.scale_id] = {
+            "weight_label": weight_value_label,
+            "status_label": status_value_label,
+            "flow_label": flow_value_label,
+            "dispensed_label": dispensed_value_label,
+            "time_to_empty_label": time_to_empty_value_label,
+            "alarms_label": alarms_value_label,
+            "alarms": {}, # Active alarm id -> rule name
+            "plot_widget": plot_widget,
+            "flow_plot_widget": flow_plot_widget,
+            "frame_layout": layout, # Armazena o layout do frame para potencial adição futura
+            # Plot data, only touched from the GUI thread
+            "weight_pyramid": MinMaxPyramid(MAX_PLOT_POINTS),
+            "flow_pyramid": MinMaxPyramid(MAX_PLOT_POINTS),
+        }
+        if self.shards is not None:
+            # Read-only mappings of the buffers written by the scale's shard process
+            weight_data, flow_data = self.shards.attach_buffers(scale.scale_id)
+        else:
+            weight_data, flow_data = TimeSeriesBuffer(MAX_PLOT_POINTS), TimeSeriesBuffer(MAX_PLOT_POINTS)
+        self.scale_frames[scale.scale_id].update(weight_data=weight_data, flow_data=flow_data)
+        self.scales[scale.scale_id] = scale
+
+        color = PLOT_COLORS[(scale.index - 1) % len(PLOT_COLORS)]
+        self.plot_curves[scale.scale_id] = plot_widget.plot(pen=pg.mkPen(color=color, width=2))
+        self.flow_curves[scale.scale_id] = flow_plot_widget.plot(pen=pg.mkPen(color=color, width=1))
+        data = self.scale_frames[scale.scale_id]
+        # Pan/zoom redraws immediately from the matching level of detail
+        plot_widget.getViewBox().sigXRangeChanged.connect(
+            lambda *_: self._on_x_range_changed(plot_widget, self.plot_curves[scale.scale_id], data["weight_data"], data["weight_pyramid"])
+        )
+        flow_plot_widget.getViewBox().sigXRangeChanged.connect(
+            lambda *_: self._on_x_range_changed(flow_plot_widget, self.flow_curves[scale.scale_id], data["flow_data"], data["flow_pyramid"])
+        )
+
+        self.scale_selector.addItem(scale.name, scale.scale_id)
 
     def _create_control_frame(self):
         self.control_frame = QtWidgets.QGroupBox("Controle e Calibração")
@@ -174,24 +400,30 @@ class ScaleMonitorWindow(QtWidgets.QMainWindow):
         set_cal_factor_button.clicked.connect(self.send_set_calibration_factor_command)
         layout.addWidget(set_cal_factor_button, 5, 2)
 
+        report_button = QtWidgets.QPushButton("Gerar Relatório da Sessão")
+        report_button.clicked.connect(self.generate_session_report)
+        layout.addWidget(report_button, 7, 0, 1, 3)
+
         self.control_frame.setLayout(layout)
         self.main_layout.addWidget(self.control_frame)
 
     def _create_log_frame(self):
-        self.log_frame = QtWidgets.QGroupBox("Logs da Balança")
-        layout = QtWidgets.QVBoxLayout()
-        self.log_text_edit = QtWidgets.QTextEdit()
-        self.log_text_edit.setReadOnly(True)
-        self.log_text_edit.setFont(QtGui.QFont("Courier", 10))
-        layout.addWidget(self.log_text_edit)
-        self.log_frame.setLayout(layout)
+        # Bounded, batched and rate-limited log view (see LogPanel)
+        self.log_frame = LogPanel(
+            "Logs da Balança", LOG_CAPACITY, LOG_FLUSH_INTERVAL_MS,
+            LOG_RATE_LIMIT_PER_S, LOG_RATE_BURST
+        )
         self.main_layout.addWidget(self.log_frame)
 
     @QtCore.pyqtSlot(str)
-    def log_message(self, message):
-        """Adds a message to the log area in the GUI. Called from MQTT worker thread via signal."""
-        # This slot is executed in the GUI thread, so it's safe to update QTextEdit.
-        self.log_text_edit.append(f"[{QtCore.QDateTime.currentDateTime().toString('HH:mm:ss')}] {message}")
+    def log_message(self, message, source="app"):
+        """Adds a message to the log area in the GUI. Lines are shown at the next log flush."""
+        self.log_frame.append(message, source)
+
+    @QtCore.pyqtSlot(str)
+    def _log_worker_message(self, message):
+        """Log messages of the MQTT worker. Called from MQTT worker thread via signal."""
+        self.log_message(message, source="mqtt")
 
     @QtCore.pyqtSlot(str)
     def update_mqtt_status(self, status_message):
@@ -204,76 +436,192 @@ class ScaleMonitorWindow(QtWidgets.QMainWindow):
         else:
             self.mqtt_connection_label.setStyleSheet("color: blue; font-weight: bold;")
 
-    @QtCore.pyqtSlot(str, str)
-    def process_mqtt_message(self, topic, payload):
-        """Processes incoming MQTT messages and updates the GUI. Called from MQTT worker thread via signal."""
-        try:
-            # We increment the time index only when a weight message arrives for either scale
-            # to keep the X-axis consistent across both plots if readings are roughly simultaneous.
-            if topic in [TOPIC_WEIGHT_01, TOPIC_WEIGHT_02]:
-                self.current_time_idx += 1 
-
-            if topic == TOPIC_WEIGHT_01:
-                weight = float(payload)
-                self.scale_frames["scale_01"]["weight_label"].setText(f"{weight:.3f} kg")
-                if len(self.weight_data_01) == MAX_PLOT_POINTS:
-                    self.time_data_01.popleft()
-                    self.weight_data_01.popleft()
-                    self.time_data_01.append(self.current_time_idx)
-                    self.weight_data_01.append(weight)
-                else:
-                    self.time_data_01.append(self.current_time_idx)
-                    self.weight_data_01.append(weight)
-
-            elif topic == TOPIC_WEIGHT_02:
-                weight = float(payload)
-                self.scale_frames["scale_02"]["weight_label"].setText(f"{weight:.3f} kg")
-                self.time_data_02.append(self.current_time_idx)
-                self.weight_data_02.append(weight)
-
-            elif topic == TOPIC_STATUS_01:
-                self._update_scale_status_display("scale_01", payload)
-            elif topic == TOPIC_STATUS_02:
-                self._update_scale_status_display("scale_02", payload)
-            elif topic == TOPIC_LOG:
-                self.log_message(f"LOG Balança: {payload}")
+    @QtCore.pyqtSlot(object)
+    def process_mqtt_batch(self, batch):
+        """
+        Shows an IngestBatch delivered by the worker: registers new scales, appends the
+        samples and flow rates to the plot buffers and updates the labels once per batch.
+        """
+        for scale in batch.new_scales:
+            self._add_scale(scale)
+
+        for scale_id, (times, weights, device_times) in batch.samples.items():
+            frame = self.scale_frames[scale_id]
+            if self.shards is not None:
+                frame["weight_data"].refresh() # Already written by the shard process
             else:
-                self.log_message(f"Mensagem recebida: Tópico='{topic}', Payload='{payload}'")
-        except ValueError:
-            self.log_message(f"Error parsing payload from {topic}: '{payload}'")
-        except Exception as e:
-            self.log_message(f"Unknown error processing MQTT: {e}")
+                frame["weight_data"].extend(times - self._session_start, weights)
+            frame["weight_label"].setText(f"{weights[-1]:.3f} kg")
+        self.render_scheduler.mark_dirty((scale_id, "weight") for scale_id in batch.samples)
+
+        for scale_id, (times, flow_rates, reading) in batch.flows.items():
+            frame = self.scale_frames[scale_id]
+            if self.shards is not None:
+                frame["flow_data"].refresh()
+            else:
+                frame["flow_data"].extend(times - self._session_start, flow_rates)
+            frame["flow_label"].setText(f"{reading.flow_slope:+.3f} kg/s (EMA {reading.flow_ema:+.3f})")
+            frame["dispensed_label"].setText(f"{reading.dispensed:.3f} kg")
+            frame["time_to_empty_label"].setText(self._format_duration(reading.time_to_empty))
+        self.render_scheduler.mark_dirty((scale_id, "flow") for scale_id in batch.flows)
+
+        if batch.aligned is not None:
+            grid, weights = batch.aligned
+            total = np.nansum(np.vstack(list(weights.values())), axis=0)
+            self.total_data.extend(grid - self._session_start, total)
+            self.total_label.setText(f"{total[-1]:.3f} kg")
+            self.render_scheduler.mark_dirty([TOTAL_PLOT_KEY])
+
+        for scale_id, status, receive_time in batch.statuses:
+            self._update_scale_status_display(scale_id, status)
+
+        for event in batch.alarms:
+            self._update_alarm_display(event)
+
+        for source, message in batch.logs:
+            self.log_message(message, source)
+
+        for group in batch.command_groups:
+            self.log_message(self._describe_command_group(group), source="commands")
+
+        self._m_batches_processed.inc()
+        if batch.message_count:
+            self._m_batch_latency.observe(clock.now() - batch.oldest_receive_time)
+            report = self.batch_stats.record(batch.message_count, batch.oldest_receive_time)
+            if report:
+                self.log_message(report)
+
+    def _scale_name(self, scale_id):
+        scale = self.scales.get(scale_id)
+        return scale.name if scale else scale_id
+
+    def _describe_command_group(self, group):
+        """Log line with the outcome of a command sent to one scale or to a group of scales."""
+        if len(group.results) == 1:
+            result = group.results[0]
+            name = self._scale_name(result.scale_id)
+            if result.status == ACKED:
+                retries = f" ({result.attempts} tentativas)" if result.attempts > 1 else ""
+                return f"Comando '{group.command}' confirmado por {name} em {result.rtt * 1000:.0f} ms{retries}"
+            if result.status == REJECTED:
+                return f"Comando '{group.command}' rejeitado por {name}: {result.detail}"
+            return f"Comando '{group.command}' sem confirmação de {name} após {result.attempts} tentativas"
+
+        acked = [r for r in group.results if r.status == ACKED]
+        text = f"Comando '{group.command}' para {len(group.results)} balanças: {len(acked)} confirmadas"
+        if acked:
+            text += f" (RTT máx. {max(r.rtt for r in acked) * 1000:.0f} ms)"
+        for status, label in ((REJECTED, "rejeitadas"), (TIMED_OUT, "sem confirmação")):
+            names = [self._scale_name(r.scale_id) for r in group.results if r.status == status]
+            if names:
+                text += f"; {len(names)} {label}: {', '.join(names)}"
+        return text
+
+    @staticmethod
+    def _format_duration(seconds):
+        if seconds is None:
+            return "--"
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours} h {minutes:02d} min" if hours else f"{minutes} min {seconds:02d} s"
+
+    def _render_plots(self, keys):
+        """
+        Redraws the (scale_id, "weight" | "flow") curves and the total (TOTAL_PLOT_KEY) in keys.
+        Called by the render scheduler. Returns the keys of plots that are not visible;
+        they are drawn once they are.
+        """
+        deferred = []
+        for key in keys:
+            scale_id, kind = key
+            if key == TOTAL_PLOT_KEY:
+                plot_widget, curve = self.total_plot_widget, self.total_curve
+                buffer, pyramid = self.total_data, self.total_pyramid
+            else:
+                frame = self.scale_frames[scale_id]
+                if kind == "weight":
+                    plot_widget, curve = frame["plot_widget"], self.plot_curves[scale_id]
+                else:
+                    plot_widget, curve = frame["flow_plot_widget"], self.flow_curves[scale_id]
+                buffer, pyramid = frame[f"{kind}_data"], frame[f"{kind}_pyramid"]
+            # The view's viewport covers the whole widget, so its region tells what is on screen
+            if plot_widget.viewport().visibleRegion().isEmpty():
+                deferred.append(key)
+                continue
+            self._draw_series(plot_widget, curve, buffer, pyramid)
+        self._m_curves_drawn.inc(len(keys) - len(deferred))
+        return deferred
+
+    def eventFilter(self, watched, event):
+        # Plots shown for the first time or uncovered by a resize are drawn if they changed while hidden
+        if event.type() in (QtCore.QEvent.Show, QtCore.QEvent.Resize):
+            self.render_scheduler.wake()
+        return super().eventFilter(watched, event)
+
+    def changeEvent(self, event):
+        # Nothing is drawn while minimized
+        if event.type() == QtCore.QEvent.WindowStateChange:
+            self.render_scheduler.set_paused(self.isMinimized())
+            self.render_scheduler.wake()
+        super().changeEvent(event)
+
+    def hideEvent(self, event):
+        self.render_scheduler.set_paused(True)
+        super().hideEvent(event)
+
+    def showEvent(self, event):
+        self.render_scheduler.set_paused(self.isMinimized())
+        self.render_scheduler.wake()
+        super().showEvent(event)
+
+    def _draw_series(self, plot_widget, curve, buffer, pyramid):
+        """Draws the visible X range of a buffer with about two points per screen pixel."""
+        pyramid.update(buffer)
+        view_box = plot_widget.getViewBox()
+        if view_box.autoRangeEnabled()[0]:
+            x_min, x_max = -np.inf, np.inf # Auto range shows the whole history
+        else:
+            x_min, x_max = view_box.viewRange()[0]
+        max_points = 2 * max(int(view_box.width()), 100)
+        # Raw samples come as views of the ring buffer; decimated ones as min/max pairs
+        curve.setData(*pyramid.query(buffer, x_min, x_max, max_points))
 
-    @QtCore.pyqtSlot()
-    def update_plots(self):
-        """Updates the pyqtgraph plots with new data. Called by the QTimer."""
-        # Set data for the plot curves.
-        # list() is used to convert deque to list for pyqtgraph.
-        self.plot_curve_01.setData(list(self.time_data_01), list(self.weight_data_01))
-        self.plot_curve_02.setData(list(self.time_data_02), list(self.weight_data_02))
+    def _on_x_range_changed(self, plot_widget, curve, buffer, pyramid):
+        # In auto range the plot timer redraws anyway, and redrawing here would re-trigger the range change
+        if not plot_widget.getViewBox().autoRangeEnabled()[0]:
+            self._draw_series(plot_widget, curve, buffer, pyramid)
 
-    def _update_scale_status_display(self, scale_key, payload):
-            status_label = self.scale_frames[scale_key]["status_label"]
+    def _update_scale_status_display(self, scale_id, payload):
+            status_label = self.scale_frames[scale_id]["status_label"]
 
             # Define a cor com base no status
-            if int(payload) == 0:
-                status_label.setText("Desconectada")
-                status_label.setStyleSheet("color: blue; font-weight: bold;")
-            elif int(payload) == 1:
-                status_label.setText("Conectada - Desativada")
-                status_label.setStyleSheet("color: blue; font-weight: bold;")
-            elif int(payload) == 2:
-                status_label.setText("Conectada - Stand-By")
-                status_label.setStyleSheet("color: orange; font-weight: bold;")
-            elif int(payload) == 3:
-                status_label.setText("Conectada - Operando")
-                status_label.setStyleSheet("color: green; font-weight: bold;")
-            elif int(payload) == 4:
-                status_label.setText("Conectada - Vazia")
-                status_label.setStyleSheet("color: red; font-weight: bold;")
+            status = int(payload)
+            if 0 <= status < len(SCALE_STATUS_LABELS):
+                status_label.setText(SCALE_STATUS_LABELS[status])
+                status_label.setStyleSheet(f"color: {STATUS_COLORS[status]}; font-weight: bold;")
             else:
                 status_label.setStyleSheet("color: grey; font-weight: bold;") # Status desconhecido/padrão
 
+    def _update_alarm_display(self, event):
+        """Logs an alarm raised or cleared and updates the alarm labels of its scales."""
+        names = ", ".join(self._scale_name(scale_id) for scale_id in event.scale_ids)
+        state = "ALARME" if event.active else "Alarme normalizado"
+        self.log_message(f"{state} [{names}]: {event.message}", source="alarms")
+        for scale_id in event.scale_ids:
+            frame = self.scale_frames.get(scale_id)
+            if frame is None:
+                continue
+            if event.active:
+                frame["alarms"][event.alarm] = event.alarm.rsplit("/", 1)[1]
+            else:
+                frame["alarms"].pop(event.alarm, None)
+            if frame["alarms"]:
+                frame["alarms_label"].setText(", ".join(sorted(frame["alarms"].values())))
+                frame["alarms_label"].setStyleSheet("color: red; font-weight: bold;")
+            else:
+                frame["alarms_label"].setText("Nenhum")
+                frame["alarms_label"].setStyleSheet("color: green;")
+
     @QtCore.pyqtSlot() # NEW slot for the operation button
     def _toggle_operation_start(self):
         """Toggles the operation state and sends the corresponding MQTT command."""
@@ -287,27 +635,30 @@ class ScaleMonitorWindow(QtWidgets.QMainWindow):
         self.operation_button.setStyleSheet(f"background-color: {button_color};")
 
         # Send the MQTT command
-        self.mqtt_worker.publish_message(START_COMMAND, str(payload_value))
+        self.publish_requested.emit(START_COMMAND, str(payload_value))
         self.log_message(f"Comando de Operação: '{button_text}' ({payload_value}) enviado para {START_COMMAND}")
 
     def get_command_topic_prefix(self):
         """Returns the appropriate command topic prefix based on the selected scale."""
-        selected_id = self.selected_scale_group.checkedId()
-        if selected_id == 1: # Scale 01
-            return COMMAND_TOPIC_01_PREFIX
-        elif selected_id == 2: # Scale 02
-            return COMMAND_TOPIC_02_PREFIX
-        return "" # Should not happen
+        scale = self.scales.get(self.scale_selector.currentData())
+        if scale is None:
+            return "" # No scale registered yet
+        return scale.command_prefix
 
     def send_command(self, command_suffix, payload=""):
-        """Generic method to send a command via MQTT."""
-        topic_prefix = self.get_command_topic_prefix()
-        if not topic_prefix: return
-
-        command_topic = topic_prefix + command_suffix
-        # Publish message through the worker thread
-        self.mqtt_worker.publish_message(command_topic, payload)
-        self.log_message(f"Command '{command_suffix}' sent to Scale {self.selected_scale_group.checkedId()}. Topic: {command_topic}, Payload: {payload if payload else 'N/A'}")
+        """
+        Queues a command to the selected scale, or to every scale when "Enviar para todas" is
+        checked, through the worker's command pipeline. Results are logged when they arrive.
+        """
+        if self.all_scales_checkbox.isChecked():
+            scale_ids, target = list(self.scales), "todas as balanças"
+        else:
+            scale_id = self.scale_selector.currentData()
+            if scale_id is None:
+                return # No scale registered yet
+            scale_ids, target = [scale_id], self.scale_selector.currentText()
+        self.command_requested.emit(scale_ids, command_suffix, payload, COMMAND_QOS)
+        self.log_message(f"Command '{command_suffix}' sent to {target}. Payload: {payload if payload else 'N/A'}")
 
     # --- Command Sending Methods (slots connected to buttons) ---
     @QtCore.pyqtSlot()
@@ -340,10 +691,48 @@ class ScaleMonitorWindow(QtWidgets.QMainWindow):
         except Exception as e:
             self.log_message(f"Error preparing calibration factor setting: {e}")
 
+    @QtCore.pyqtSlot()
+    def generate_session_report(self):
+        """Exports the report of the runs since the application started, computed in a background thread."""
+        if self.recorder is None:
+            self.log_message("Relatório indisponível: a gravação de amostras está desativada.")
+            return
+        if self._report_thread is not None and self._report_thread.is_alive():
+            return # Still generating the previous one
+        out_dir = os.path.join(REPORT_DIR, time.strftime("%Y%m%d-%H%M%S"))
+        self._report_thread = threading.Thread(
+            target=self._write_session_report, args=(out_dir,), name="SessionReport", daemon=True
+        )
+        self._report_thread.start()
+        self.log_message("Gerando relatório da sessão...")
+
+    def _write_session_report(self, out_dir):
+        # Give the recorders (shard processes included) one flush to write the latest samples and events
+        time.sleep(RECORDER_FLUSH_INTERVAL_S)
+        try:
+            engine = ReportEngine(RECORDER_DIR, self._flow_settings, REPORT_SUMMARY_INTERVAL_S)
+            report = engine.report(self._session_start)
+            export_report(report, out_dir, REPORT_FORMAT)
+        except Exception as e:
+            self.report_finished.emit(f"Erro ao gerar o relatório: {e}")
+            return
+        dispensed = report.runs["dispensed_kg"].sum()
+        self.report_finished.emit(
+            f"Relatório salvo em {out_dir}: {len(report.runs['scale'])} ciclos, {dispensed:.3f} kg dispensados"
+        )
+
     def closeEvent(self, event):
         """Handles the window close event to gracefully stop the MQTT thread."""
         self.log_message("Closing application. Disconnecting MQTT...")
         self.mqtt_worker.stop_mqtt() # Tell the worker to stop MQTT
         self.mqtt_thread.quit()      # Tell the thread to quit its event loop
         self.mqtt_thread.wait()      # Wait for the thread to finish
+        if self.shards is not None:
+            self.shards.stop()       # The shard processes record their pending samples
+        if self.recorder:
+            self.recorder.stop()     # Write the samples still pending
+        if self.capture:
+            self.capture.close()
+        if self.metrics_server:
+            self.metrics_server.stop()
         super().closeEvent(event)
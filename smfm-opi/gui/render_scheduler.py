@@ -0,0 +1,89 @@
+import time
+from PyQt5 import QtCore
+
+
+class RenderScheduler(QtCore.QObject):
+    """
+    Schedules plot redraws on demand instead of on a fixed timer.
+
+    Producers call mark_dirty(keys) when the data behind some curves changed; one
+    frame later render(keys) is called with every key marked since the previous
+    frame, and returns the keys it could not draw (e.g. plots that are not visible),
+    which stay dirty until the next mark_dirty() or wake(). Nothing runs while
+    nothing changes or while paused.
+
+    The interval between frames adapts to the measured frame time (the render call
+    plus the repaint it triggers): it grows while frames take longer than
+    frame_budget_ms and shrinks back towards min_interval_ms when there is headroom.
+    """
+    frame_rendered = QtCore.pyqtSignal(float) # frame time in seconds
+
+    def __init__(self, render, interval_ms, min_interval_ms, max_interval_ms, frame_budget_ms, parent=None):
+        super().__init__(parent)
+        self._render = render
+        self._min_interval = min_interval_ms
+        self._max_interval = max_interval_ms
+        self._budget = frame_budget_ms / 1000.0
+        self.interval_ms = interval_ms
+
+        self._dirty = set()
+        self._wanted = False # A mark_dirty()/wake() arrived since the last frame
+        self._paused = False
+        self._frame_started = None
+        self._frame_time = None # Smoothed frame time in seconds
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._render_frame)
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def mark_dirty(self, keys):
+        self._dirty.update(keys)
+        self._wanted = True
+        self._schedule()
+
+    def wake(self):
+        """Retries the keys left dirty by render(), e.g. after plots became visible."""
+        if self._dirty:
+            self._wanted = True
+            self._schedule()
+
+    def set_paused(self, paused):
+        self._paused = paused
+        if paused:
+            self._timer.stop()
+        else:
+            self._schedule()
+
+    def _schedule(self):
+        if self._wanted and not self._paused and self._frame_started is None and not self._timer.isActive():
+            self._timer.start(int(self.interval_ms))
+
+    @QtCore.pyqtSlot()
+    def _render_frame(self):
+        keys, self._dirty = self._dirty, set()
+        self._wanted = False
+        self._frame_started = time.perf_counter()
+        try:
+            deferred = self._render(keys)
+            if deferred:
+                self._dirty.update(deferred)
+        finally:
+            # A zero timer runs after the repaint requests posted by render(); always posted,
+            # so a failing render cannot leave the frame open and stop the plots for good
+            QtCore.QTimer.singleShot(0, self._frame_done)
+
+    @QtCore.pyqtSlot()
+    def _frame_done(self):
+        frame_time = time.perf_counter() - self._frame_started
+        self._frame_started = None
+        self._frame_time = frame_time if self._frame_time is None else 0.7 * self._frame_time + 0.3 * frame_time
+        if self._frame_time > self._budget:
+            self.interval_ms = min(self._max_interval, self.interval_ms * 1.5)
+        elif self._frame_time < self._budget / 2:
+            self.interval_ms = max(self._min_interval, self.interval_ms / 1.2)
+        self.frame_rendered.emit(frame_time)
+        self._schedule()
@@ -1,15 +1,41 @@
+import argparse
+import functools
+import os
 import sys
+import time
 from PyQt5 import QtWidgets
 
 # Import the main window class from your gui module
 from gui.main_window import ScaleMonitorWindow
+from mqtt.replay_client import ReplayClient
+from storage.capture import capture_paths
+from utils import clock
+from utils.constants import CAPTURE_DIR, REPLAY_START_DELAY_S
 
 def main():
     """
     Main function to run the PyQt application.
+
+        python main.py [--capture] [--replay CAPTURE [--speed N]]
     """
-    app = QtWidgets.QApplication(sys.argv)
-    window = ScaleMonitorWindow()
+    parser = argparse.ArgumentParser(description="SMFM operation interface.")
+    parser.add_argument("--capture", action="store_true", help="capture the raw MQTT traffic to a new directory under CAPTURE_DIR")
+    parser.add_argument("--replay", metavar="CAPTURE", help="play a capture file or directory back instead of connecting to the broker")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed (1 = real time, 0 = as fast as possible)")
+    args, qt_args = parser.parse_known_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    options = {}
+    if args.capture:
+        options["capture_dir"] = os.path.join(CAPTURE_DIR, time.strftime("%Y%m%d-%H%M%S"))
+    if args.replay:
+        # Replayed traffic is not recorded again
+        options["mqtt_client_factory"] = functools.partial(
+            ReplayClient, paths=capture_paths(args.replay), speed=args.speed,
+            start_time=clock.now() + REPLAY_START_DELAY_S
+        )
+        options["record"] = False
+    window = ScaleMonitorWindow(**options)
     window.show()
     sys.exit(app.exec_())
 
@@ -0,0 +1,234 @@
+import random
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+from utils import clock
+from utils.metrics import MetricsRegistry
+
+class MqttClient:
+    """
+    Qt-free MQTT client used by both the GUI worker and the headless daemon.
+
+    start() returns at once: connecting, running the network loop and reconnecting
+    after a failure or a lost connection (with a jittered exponential backoff between
+    reconnect_min_s and reconnect_max_s) all happen in the client's own thread.
+    Messages published while disconnected are held in a bounded outbox and sent on
+    reconnection. With clean_session off, the broker keeps the session of our (stable)
+    client_id, so QoS >= 1 messages published meanwhile are delivered when we are back.
+
+    All callbacks are called from the network thread:
+    on_message(topic, payload bytes, receive_time on utils.clock), on_status(status message), on_log(log message)
+    and on_connect() after every successful (re)connection, once the outbox was sent.
+    retained_messages are (topic, payload) pairs published with the retain flag on every connection.
+    topics_to_unsubscribe are dropped on every connection, before subscribing: subscriptions a
+    persistent session may still hold from another configuration of the same client_id.
+    """
+    def __init__(self, broker, port, client_id, keepalive_interval, topics_to_subscribe,
+                 on_message, on_status=None, on_log=None, client_factory=None, retained_messages=(), metrics=None,
+                 on_connect=None, clean_session=False, subscribe_qos=1,
+                 reconnect_min_s=0.5, reconnect_max_s=8.0, outbox_size=200, topics_to_unsubscribe=()):
+        self._broker = broker
+        self._port = port
+        self._client_id = client_id
+        self._keepalive = keepalive_interval
+        self._topics_to_subscribe = list(topics_to_subscribe)
+        self._topics_to_unsubscribe = list(topics_to_unsubscribe)
+        self._retained_messages = list(retained_messages)
+        self._on_message_callback = on_message
+        self._on_status = on_status or (lambda status: None)
+        self._on_log = on_log or (lambda message: None)
+        self._on_connect_callback = on_connect or (lambda: None)
+        self._clean_session = clean_session
+        self._subscribe_qos = subscribe_qos
+        self._reconnect_min = reconnect_min_s
+        self._reconnect_max = reconnect_max_s
+        # Builds the paho client; replaced by an in-process fake client when benchmarking
+        self._client_factory = client_factory or mqtt.Client
+        self._client = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+        # The outbox and the online flag change together, so a publish never lands
+        # in the outbox after it was sent
+        self._lock = threading.Lock()
+        self._online = False
+        self._outbox = deque(maxlen=outbox_size)
+        # monotonic time of the connection loss (or start) until the first message after connecting
+        self._offline_since = None
+        self._connected_at = None
+
+        metrics = metrics or MetricsRegistry()
+        self._m_connected = metrics.gauge("smfm_mqtt_connected", "1 while connected to the broker")
+        self._m_connects = metrics.counter("smfm_mqtt_connects_total", "Successful connections to the broker")
+        self._m_disconnects = metrics.counter("smfm_mqtt_disconnects_total", "Unexpected disconnections (each one starts a reconnect)")
+        self._m_connect_errors = metrics.counter("smfm_mqtt_connect_errors_total", "Failed connection attempts")
+        self._m_published = metrics.counter("smfm_mqtt_published_total", "Messages published")
+        self._m_publish_errors = metrics.counter("smfm_mqtt_publish_errors_total", "Messages that could not be published")
+        self._m_outbox = metrics.gauge("smfm_mqtt_outbox_messages", "Messages waiting in the outbox for a connection")
+        self._m_outbox.set_function(lambda: len(self._outbox))
+        self._m_outbox_dropped = metrics.counter("smfm_mqtt_outbox_dropped_total", "Messages dropped because the outbox was full")
+        self._m_first_message = metrics.histogram(
+            "smfm_mqtt_time_to_first_message_seconds",
+            "Time from the connection loss (or start) to the first message received after connecting",
+            buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+        )
+
+    @property
+    def is_online(self):
+        return self._online
+
+    def start(self):
+        """Starts connecting in the background; returns immediately."""
+        self._client = self._client_factory(
+            mqtt.CallbackAPIVersion.VERSION2, client_id=self._client_id, clean_session=self._clean_session
+        )
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message # on_message signature is compatible
+        self._client.on_disconnect = self._on_disconnect
+
+        self._stopping.clear()
+        self._offline_since = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="MqttNetwork", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops reconnecting and disconnects gracefully."""
+        self._on_log("Stopping MQTT client...")
+        if self._thread is None:
+            return
+        self._stopping.set()
+        with self._lock:
+            self._online = False
+        self._client.disconnect() # Wakes the network loop
+        # A connect() in progress cannot be interrupted, but it times out by itself
+        self._thread.join(timeout=10.0)
+        self._thread = None
+        self._m_connected.set(0)
+        self._on_log("MQTT client disconnected.")
+        self._on_status("Desconectado")
+
+    def _run(self):
+        """Connects, runs the network loop until the connection is lost and tries again after a delay."""
+        self._backoff = self._reconnect_min
+        while not self._stopping.is_set():
+            self._on_log(f"Attempting to connect to MQTT broker at {self._broker}:{self._port}...")
+            self._on_status("Conectando...")
+            try:
+                self._client.connect(self._broker, self._port, self._keepalive)
+            except Exception as e:
+                self._m_connect_errors.inc()
+                self._on_log(f"MQTT connection error: {e}")
+            else:
+                while not self._stopping.is_set():
+                    if self._client.loop(timeout=1.0) != mqtt.MQTT_ERR_SUCCESS:
+                        break
+            if self._stopping.is_set():
+                break
+            # "Equal jitter": at least half the backoff, so retries stay spaced out but never synchronized
+            delay = random.uniform(self._backoff / 2, self._backoff)
+            self._backoff = min(self._reconnect_max, self._backoff * 2)
+            self._on_status(f"Reconectando em {delay:.1f} s")
+            self._stopping.wait(delay)
+
+    # on_connect callback for API V2
+    def _on_connect(self, client, userdata, connect_flags, reason_code, properties):
+        if reason_code != 0:
+            self._m_connect_errors.inc()
+            self._on_log(f"Failed to connect, return code {reason_code}")
+            self._on_status(f"Falha na Conexão ({reason_code})")
+            return
+        self._m_connects.inc()
+        self._m_connected.set(1)
+        self._backoff = self._reconnect_min
+        self._connected_at = time.monotonic()
+        session_present = getattr(connect_flags, "session_present", False)
+        self._on_log(f"Successfully connected to MQTT broker (session present: {bool(session_present)}).")
+        self._on_status("Conectado")
+        for topic, payload in self._retained_messages:
+            client.publish(topic, payload, qos=1, retain=True)
+        with self._lock:
+            for topic in self._topics_to_unsubscribe:
+                client.unsubscribe(topic)
+                self._on_log(f"Unsubscribed from topic: {topic}")
+            # Subscribe to predefined topics after successful connection
+            for topic in self._topics_to_subscribe:
+                client.subscribe(topic, qos=self._subscribe_qos)
+                self._on_log(f"Subscribed to topic: {topic}")
+            held = list(self._outbox)
+            self._outbox.clear()
+            for topic, payload, qos, retain in held:
+                self._publish(topic, payload, qos, retain)
+            self._online = True
+        if held:
+            self._on_log(f"Sent {len(held)} messages held while disconnected.")
+        self._on_connect_callback()
+
+    # on_message callback (signature compatible with V1 and V2)
+    def _on_message(self, client, userdata, msg):
+        # Replayed messages (mqtt/replay_client.py) carry their own receive time
+        receive_time = getattr(msg, "receive_time", None)
+        if receive_time is None:
+            receive_time = clock.now()
+        if self._offline_since is not None:
+            self._report_first_message()
+        self._on_message_callback(msg.topic, msg.payload, receive_time)
+
+    def _report_first_message(self):
+        now = time.monotonic()
+        offline_s = now - self._offline_since
+        self._offline_since = None
+        self._m_first_message.observe(offline_s)
+        self._on_log(
+            f"First message after {offline_s:.2f} s without connection "
+            f"({(now - self._connected_at) * 1000.0:.0f} ms after connecting)."
+        )
+
+    # on_disconnect callback for API V2
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        with self._lock:
+            self._online = False
+        self._m_connected.set(0)
+        if self._stopping.is_set():
+            return
+        self._m_disconnects.inc()
+        if self._offline_since is None:
+            self._offline_since = time.monotonic()
+        self._on_log(f"MQTT disconnected with result code {reason_code}. Reconnecting...")
+        self._on_status("Reconectando...")
+
+    def subscribe(self, topic):
+        """Adds a subscription, made now if connected and again on every reconnection."""
+        with self._lock:
+            self._topics_to_subscribe.append(topic)
+            if self._online:
+                self._client.subscribe(topic, qos=self._subscribe_qos)
+                self._on_log(f"Subscribed to topic: {topic}")
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Publishes a message to an MQTT topic, or holds it in the outbox until the client is connected."""
+        with self._lock:
+            if self._online and self._publish(topic, payload, qos, retain):
+                return
+            if (topic, payload, qos, retain) in self._outbox:
+                return # A retry of a message that is still waiting (commands resend the same payload)
+            if len(self._outbox) == self._outbox.maxlen:
+                self._m_outbox_dropped.inc()
+                self._on_log(f"MQTT outbox full, dropped the oldest message ({self._outbox[0][0]}).")
+            self._outbox.append((topic, payload, qos, retain))
+
+    def _publish(self, topic, payload, qos, retain):
+        """Publishes now; returns False if the connection is gone."""
+        try:
+            info = self._client.publish(topic, payload, qos=qos, retain=retain)
+        except Exception as e:
+            self._m_publish_errors.inc()
+            self._on_log(f"Error publishing to {topic}: {e}")
+            return True # Not worth retrying
+        # paho keeps QoS >= 1 messages itself and sends them after reconnecting
+        if info.rc == mqtt.MQTT_ERR_NO_CONN and qos == 0:
+            return False
+        self._m_published.inc()
+        return True
@@ -1,91 +1,130 @@
-import paho.mqtt.client as mqtt
 from PyQt5 import QtCore
 
+from core.alarms import alarm_payload
+from mqtt.mqtt_client import MqttClient
+from utils import clock
+from utils.constants import TOPIC_ALARMS, ALARM_QOS
+
 class MqttWorker(QtCore.QObject):
     """
-    Worker object to handle MQTT client operations in a separate thread.
-    Emits signals to communicate with the GUI thread.
+    Qt adapter between an IngestCore and the GUI, living in a separate thread.
+    Messages are processed by the core in the MQTT network thread; this worker
+    drains the core once per tick and delivers the result as a single signal.
+    With shards (a core.sharding.ShardedIngest), the scales registered by the core are
+    handed to the shard processes and their samples are merged into the same batches.
+    Alarm events in a batch are published on TOPIC_ALARMS before the batch is delivered.
+    With an aligner (a core.alignment.TimeAligner), the samples of all scales are resampled
+    onto its time grid here, off the GUI thread, and delivered in IngestBatch.aligned.
     """
     # Signals to be emitted
-    message_received = QtCore.pyqtSignal(str, str) # topic, payload
+    batch_received = QtCore.pyqtSignal(object)     # IngestBatch
     connection_status = QtCore.pyqtSignal(str)     # status message
     log_message = QtCore.pyqtSignal(str)          # log message
 
-    def __init__(self, broker, port, client_id, keepalive_interval, topics_to_subscribe=None):
+    def __init__(self, ingest_core, broker, port, client_id, keepalive_interval,
+                 batch_interval_ms=0, client_factory=None, command_check_interval_ms=100, shards=None,
+                 aligner=None, **client_options):
+        """client_options are passed on to MqttClient (session, reconnection backoff, outbox size)."""
         super().__init__()
-        self._broker = broker
-        self._port = port
-        self._client_id = client_id
-        self._keepalive = keepalive_interval
-        self._topics_to_subscribe = topics_to_subscribe if topics_to_subscribe is not None else []
-        self._client = None
-        self._running = True
+        if shards is not None and batch_interval_ms <= 0:
+            raise ValueError("sharded ingestion needs a batch interval")
+        self._core = ingest_core
+        self._shards = shards
+        self._aligner = aligner
+        self._client = MqttClient(
+            broker, port, client_id, keepalive_interval, ingest_core.subscription_topics,
+            on_message=self._on_message, on_status=self.connection_status.emit,
+            on_log=self.log_message.emit, client_factory=client_factory,
+            retained_messages=ingest_core.retained_messages, metrics=ingest_core.metrics,
+            on_connect=ingest_core.restart_command_timers,
+            topics_to_unsubscribe=ingest_core.unsubscription_topics, **client_options
+        )
+        self.batches_emitted = ingest_core.metrics.counter("smfm_batches_emitted_total", "Batches delivered to the GUI thread")
+        self._m_batch_size = ingest_core.metrics.histogram(
+            "smfm_batch_messages", "Messages per batch delivered to the GUI", buckets=(1, 10, 100, 1000, 10000)
+        )
+        # Batches are delivered every batch_interval_ms (0 = after every message)
+        self._batch_interval_ms = batch_interval_ms
+        self._batch_timer = None
+        self._command_check_interval_ms = command_check_interval_ms
+        self._command_timer = None
 
     def start_mqtt(self):
-        """Initializes and connects the MQTT client."""
-        self.log_message.emit(f"Attempting to connect to MQTT broker at {self._broker}:{self._port}...")
-        
-        # Initialize the MQTT client with Callback API Version 2
-        self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=self._client_id)
-        
-        # Connect callbacks for API V2
-        self._client.on_connect = self._on_connect
-        self._client.on_message = self._on_message # on_message signature is compatible
-        self._client.on_disconnect = self._on_disconnect
-
-        try:
-            self._client.connect(self._broker, self._port, self._keepalive)
-            # Start the MQTT network loop in a non-blocking way in this thread.
-            # This is crucial so the GUI remains responsive.
-            self._client.loop_start() 
-            self.connection_status.emit("Conectado")
-        except Exception as e:
-            self.connection_status.emit("Erro de Conexão")
-            self.log_message.emit(f"MQTT connection error: {e}")
-            self.stop_mqtt() # Ensure cleanup if connection fails immediately
+        """Starts the batch timer and starts connecting the MQTT client (without waiting for the broker)."""
+        # The timer is created here so that it lives in the worker thread.
+        if self._batch_interval_ms > 0:
+            self._batch_timer = QtCore.QTimer(self)
+            self._batch_timer.setInterval(self._batch_interval_ms)
+            self._batch_timer.timeout.connect(self._flush_batch)
+            self._batch_timer.start()
+        self._command_timer = QtCore.QTimer(self)
+        self._command_timer.setInterval(self._command_check_interval_ms)
+        self._command_timer.timeout.connect(self._check_commands)
+        self._command_timer.start()
+        self._client.start()
 
     def stop_mqtt(self):
-        """Stops the MQTT client loop and disconnects gracefully."""
-        self.log_message.emit("Stopping MQTT client...")
-        self._running = False 
-        if self._client:
-            self._client.loop_stop() # Stop the internal thread if loop_start was used
-            self._client.disconnect()
-            self.log_message.emit("MQTT client disconnected.")
-            self.connection_status.emit("Desconectado")
-
-    # on_connect callback for API V2
-    def _on_connect(self, client, userdata, connect_flags, reason_code, properties):
-        if reason_code == 0:
-            self.log_message.emit("Successfully connected to MQTT broker.")
-            self.connection_status.emit("Conectado")
-            # Subscribe to predefined topics after successful connection
-            for topic in self._topics_to_subscribe:
-                client.subscribe(topic)
-                self.log_message.emit(f"Subscribed to topic: {topic}")
-        else:
-            self.log_message.emit(f"Failed to connect, return code {reason_code}")
-            self.connection_status.emit(f"Falha na Conexão ({reason_code})")
+        """Stops the MQTT client and delivers what was ingested so far."""
+        for timer in (self._batch_timer, self._command_timer):
+            if timer is None:
+                continue
+            # Timers can only be stopped from their own thread
+            if QtCore.QThread.currentThread() is self.thread():
+                timer.stop()
+            else:
+                QtCore.QMetaObject.invokeMethod(timer, "stop", QtCore.Qt.BlockingQueuedConnection)
+        self._client.stop()
+        self._flush_batch()
 
-    # on_message callback (signature compatible with V1 and V2)
-    def _on_message(self, client, userdata, msg):
-        payload = msg.payload.decode('utf-8')
-        self.message_received.emit(msg.topic, payload)
+    def _on_message(self, topic, payload, receive_time):
+        # Called from the MQTT network thread
+        self._core.handle_message(topic, payload, receive_time)
+        if self._batch_interval_ms <= 0:
+            self._flush_batch()
 
-    # on_disconnect callback for API V2
-    def _on_disconnect(self, client, userdata, reason_code, properties):
-        self.log_message.emit(f"MQTT disconnected with result code {reason_code}. Reconnecting...")
-        self.connection_status.emit("Reconectando...")
-        # The paho-mqtt client's loop_start automatically tries to reconnect
-        # for most disconnect reasons, so no explicit reconnect logic needed here.
+    def _flush_batch(self):
+        """Delivers everything ingested since the last tick as a single batch."""
+        batch = self._core.drain()
+        if self._shards is not None:
+            # Scales are handed to the shards before the GUI hears of them
+            for scale in batch.new_scales if batch is not None else ():
+                self._shards.add_scale(scale.scale_id)
+            shard_batch = self._shards.drain()
+            if batch is None:
+                batch = shard_batch
+            elif shard_batch is not None:
+                batch.merge(shard_batch)
+        if batch is not None and self._aligner is not None:
+            for scale_id, (times, weights, _) in batch.samples.items():
+                self._aligner.add(scale_id, times, weights)
+            batch.aligned = self._aligner.advance(clock.now())
+        if batch is not None:
+            for event in batch.alarms:
+                self._client.publish(TOPIC_ALARMS, alarm_payload(event), qos=ALARM_QOS)
+            self.batches_emitted.inc()
+            self._m_batch_size.observe(batch.message_count)
+            self.batch_received.emit(batch)
 
+    @QtCore.pyqtSlot(str, str)
     def publish_message(self, topic, payload):
-        """Publishes a message to an MQTT topic."""
-        if self._client and self._client.is_connected():
-            try:
-                self._client.publish(topic, payload)
-                # self.log_message.emit(f"Published to {topic}: {payload}") # Optional: log all publications
-            except Exception as e:
-                self.log_message.emit(f"Error publishing to {topic}: {e}")
-        else:
-            self.log_message.emit(f"Cannot publish, MQTT client not connected.")
+        """Publishes a message to an MQTT topic, without acknowledgement tracking."""
+        self._client.publish(topic, payload)
+
+    @QtCore.pyqtSlot(object, str, str, int)
+    def submit_command(self, scale_ids, command, payload, qos):
+        """
+        Sends a command to one or more scales through the ingest core's command tracker.
+        Results arrive later in IngestBatch.command_results / command_groups.
+        Connect it to a signal so it runs in the worker thread.
+        """
+        for topic, wire_payload, qos in self._core.submit_command(scale_ids, command, payload, qos):
+            self._client.publish(topic, wire_payload, qos=qos)
+
+    def _check_commands(self):
+        # Commands held in the outbox are not overdue; their timers restart on reconnection
+        if not self._client.is_online:
+            return
+        for topic, wire_payload, qos in self._core.expire_commands():
+            self._client.publish(topic, wire_payload, qos=qos)
+        if self._batch_interval_ms <= 0:
+            self._flush_batch()
@@ -0,0 +1,155 @@
+"""
+Replays a capture (storage/capture.py) through the normal MQTT path, without a broker.
+
+ReplayClient stands in for paho's Client as MqttClient's client_factory, so the
+replayed messages go through MqttClient, the ingest core, the MQTT worker and the
+GUI exactly like live traffic. Bind the options with functools.partial; the result
+can be pickled, so shard processes (core.sharding) replay their own topics:
+
+    client_factory = functools.partial(ReplayClient, paths=capture_paths(path), speed=10.0, start_time=clock.now())
+
+Once connected, the client drives utils.clock.now() of its process from the replay
+timeline, so everything measured against the clock (alarm timeouts, the alignment
+hold, latencies) runs in captured time, at the replay speed.
+"""
+import threading
+
+from paho.mqtt.client import topic_matches_sub
+
+from storage.capture import read_captures
+from utils import clock
+
+
+class _ReplayedMessage:
+    """Minimal paho MQTTMessage replacement; MqttClient uses receive_time instead of the clock."""
+    __slots__ = ("topic", "payload", "receive_time")
+
+    def __init__(self, topic, payload, receive_time):
+        self.topic = topic
+        self.payload = payload
+        self.receive_time = receive_time
+
+
+class _PublishInfo:
+    __slots__ = ("rc",)
+
+    def __init__(self, rc):
+        self.rc = rc
+
+
+class ReplayClient:
+    """
+    Stand-in for paho.mqtt.client.Client that plays the captured messages of the
+    subscribed topics, streaming them from paths (merged in time order).
+
+    The capture is moved onto a timeline starting at start_time (receive clock, default:
+    the first connect()): every message is stamped with its captured time on that timeline,
+    and delivered once the receive clock reaches start_time + elapsed / speed. speed 0
+    delivers from start_time on as fast as the consumer takes them. The sample times, and
+    so the plots and flow rates, keep the captured pace at any speed. now() is the time on
+    that timeline (see utils.clock.set_source()). Published messages are dropped;
+    finished is set once the whole capture was delivered.
+    """
+    def __init__(self, callback_api_version=None, client_id="", clean_session=None, paths=(), speed=1.0,
+                 start_time=None):
+        self._paths = list(paths)
+        self._speed = speed
+        self._start_time = start_time
+        self._connected = False
+        self._stopping = threading.Event()
+        self._subscriptions = []
+        self._matches = {} # topic -> whether a subscription matches it
+        self._thread = None
+        self._latest = None # Timeline time of the newest delivered message
+        self._finished_at = None # Receive clock time the capture ended at (speed 0)
+        self.finished = threading.Event()
+        self.delivered_messages = 0
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+
+    def connect(self, host, port=1883, keepalive=60):
+        self._connected = True
+        if self.on_connect:
+            self.on_connect(self, None, None, 0, None)
+        if self._thread is None:
+            if self._start_time is None:
+                self._start_time = clock.real_now()
+            clock.set_source(self.now)
+            self._thread = threading.Thread(target=self._replay, name="Replay", daemon=True)
+            self._thread.start()
+        return 0
+
+    def loop(self, timeout=1.0):
+        self._stopping.wait(timeout)
+        return 0 if self._connected else 7 # MQTT_ERR_CONN_LOST
+
+    def disconnect(self):
+        self._connected = False
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def now(self):
+        """Current time on the replay timeline; never behind the newest delivered message."""
+        real_now = clock.real_now()
+        start_time = self._start_time
+        if start_time is None or real_now < start_time:
+            return real_now
+        latest = self._latest
+        if self._speed > 0:
+            timeline = start_time + (real_now - start_time) * self._speed
+        elif self._finished_at is not None:
+            timeline = latest + (real_now - self._finished_at) # After the capture, time goes on in real time
+        else:
+            timeline = start_time
+        return timeline if latest is None or timeline > latest else latest
+
+    def is_connected(self):
+        return self._connected
+
+    def subscribe(self, topic, qos=0):
+        self._subscriptions = self._subscriptions + [topic]
+        self._matches = {}
+        return 0, 0
+
+    def unsubscribe(self, topic):
+        if topic in self._subscriptions:
+            self._subscriptions = [sub for sub in self._subscriptions if sub != topic]
+            self._matches = {}
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        return _PublishInfo(0)
+
+    def _subscribed(self, topic):
+        matches = self._matches
+        matched = matches.get(topic)
+        if matched is None:
+            matched = matches[topic] = any(topic_matches_sub(sub, topic) for sub in self._subscriptions)
+        return matched
+
+    def _replay(self):
+        start_time, speed = self._start_time, self._speed
+        if self._stopping.wait(max(0.0, start_time - clock.real_now())):
+            return
+        first = None
+        for receive_time, topic, payload in read_captures(self._paths):
+            if self._stopping.is_set():
+                return
+            if first is None:
+                first = receive_time
+            elapsed = receive_time - first
+            if speed > 0:
+                delay = start_time + elapsed / speed - clock.real_now()
+                # Messages less than a couple of ms apart go out together rather than one sleep each
+                if delay > 0.002 and self._stopping.wait(delay):
+                    return
+            self._latest = start_time + elapsed
+            if self._subscribed(topic):
+                self.on_message(self, None, _ReplayedMessage(topic, payload, self._latest))
+                self.delivered_messages += 1
+        if self._latest is None:
+            self._latest = start_time
+        self._finished_at = clock.real_now()
+        self.finished.set()
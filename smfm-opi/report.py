@@ -0,0 +1,74 @@
+"""
+Session reports from the recordings: runs (batches) of every scale, per-scale
+totals and command events, exported as CSV or a columnar format (see core/report.py).
+
+    python report.py [--from 2026-10-01] [--to 2026-10-02T06:00] [--scales s01,s02] [--format csv|npz|parquet] [--out DIR]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+from core.report import ReportEngine, export_report, REPORT_FORMATS
+from utils.constants import (
+    RECORDER_DIR, REPORT_DIR, REPORT_SUMMARY_INTERVAL_S, REPORT_FORMAT, SCALE_STATUS_LABELS,
+    FLOW_EMA_TAU_S, FLOW_WINDOW_SAMPLES, FLOW_THRESHOLD_KG_S
+)
+
+
+def _timestamp(text):
+    """Epoch seconds of an ISO 8601 date or date and time (local time unless it has an offset)."""
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def _print_report(report):
+    runs = report.runs
+    for i in range(len(runs["scale"])):
+        end_status = int(runs["end_status"][i])
+        ending = SCALE_STATUS_LABELS[end_status] if 0 <= end_status < len(SCALE_STATUS_LABELS) else "em andamento"
+        print(
+            f"{runs['scale'][i]}  {runs['start_time'][i]}  {runs['duration_s'][i] / 60.0:7.1f} min  "
+            f"{runs['dispensed_kg'][i]:9.3f} kg  avg {runs['avg_flow_kg_s'][i]:.3f} kg/s  "
+            f"peak {runs['peak_flow_kg_s'][i]:.3f} kg/s  -> {ending}"
+        )
+    scales = report.scales
+    for i in range(len(scales["scale"])):
+        print(
+            f"{scales['scale'][i]}: {scales['runs'][i]} runs, {scales['dispensed_kg'][i]:.3f} kg dispensed, "
+            f"{scales['filled_kg'][i]:.3f} kg filled, {scales['commands'][i]} commands ({scales['commands_failed'][i]} failed)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SMFM session reports from the recorded samples and events.")
+    parser.add_argument("--recordings", default=RECORDER_DIR, help="recording directory")
+    parser.add_argument("--from", dest="t_from", type=_timestamp, help="start (ISO 8601, default: first recording)")
+    parser.add_argument("--to", dest="t_to", type=_timestamp, help="end (ISO 8601, default: now)")
+    parser.add_argument("--scales", help="comma-separated scale ids (default: all recorded)")
+    parser.add_argument("--format", choices=REPORT_FORMATS, default=REPORT_FORMAT)
+    parser.add_argument("--out", help="output directory (default: a new directory under REPORT_DIR)")
+    parser.add_argument("--no-cache", action="store_true", help="do not write summary caches to the recordings")
+    args = parser.parse_args()
+
+    engine = ReportEngine(
+        args.recordings, (FLOW_EMA_TAU_S, FLOW_WINDOW_SAMPLES, FLOW_THRESHOLD_KG_S), REPORT_SUMMARY_INTERVAL_S,
+        use_cache=not args.no_cache
+    )
+    started = time.perf_counter()
+    report = engine.report(args.t_from, args.t_to, args.scales.split(",") if args.scales else None)
+    elapsed = time.perf_counter() - started
+    out_dir = args.out or os.path.join(REPORT_DIR, time.strftime("%Y%m%d-%H%M%S"))
+    try:
+        paths = export_report(report, out_dir, args.format)
+    except RuntimeError as e:
+        sys.exit(f"Error: {e}")
+
+    _print_report(report)
+    print(f"Report of {len(report.scales['scale'])} scales computed in {elapsed:.2f} s, written to:")
+    for path in paths:
+        print(f"  {path}")
+
+
+if __name__ == "__main__":
+    main()
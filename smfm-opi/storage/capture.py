@@ -0,0 +1,121 @@
+"""
+Raw MQTT traffic capture: every (receive time, topic, payload) the ingest core sees,
+appended to a compact file that mqtt/replay_client.py plays back.
+
+A capture file starts with CAPTURE_MAGIC, followed by one frame per message:
+
+    offset  size  field
+    0       8     receive time, epoch s on the receive clock (float64)
+    8       2     topic length (uint16)
+    10      4     payload length (uint32)
+    14      t     topic, UTF-8
+    14+t    p     payload bytes, as received
+
+All fields are little endian. A frame cut short by a crash ends the capture.
+With sharded ingestion every process writes its own file into the capture
+directory (CAPTURE_MAIN_FILE and shard<n>.smfmcap); read_captures() merges them
+back into one stream in time order.
+"""
+import heapq
+import os
+import struct
+import threading
+
+CAPTURE_MAGIC = b"SMFMCAP1"
+CAPTURE_EXTENSION = ".smfmcap"
+CAPTURE_MAIN_FILE = "main" + CAPTURE_EXTENSION
+
+_FRAME = struct.Struct("<dHI")
+
+
+def shard_capture_file(shard):
+    return f"shard{shard + 1}{CAPTURE_EXTENSION}"
+
+
+class CaptureWriter:
+    """
+    Appends frames to a capture file through a write buffer of buffer_size bytes.
+    write() is called from the MQTT network thread and only copies into the buffer;
+    flush() (called at every drain of the ingest core) bounds what a crash loses.
+    """
+    def __init__(self, path, buffer_size):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._file = open(path, "xb", buffering=buffer_size)
+        self._file.write(CAPTURE_MAGIC)
+        self._lock = threading.Lock()
+        self._topics = {} # topic -> encoded topic
+        self.frames = 0
+
+    def write(self, receive_time, topic, payload):
+        encoded_topic = self._topics.get(topic)
+        if encoded_topic is None:
+            encoded_topic = self._topics[topic] = topic.encode("utf-8")
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(_FRAME.pack(receive_time, len(encoded_topic), len(payload)))
+            self._file.write(encoded_topic)
+            self._file.write(payload)
+            self.frames += 1
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def iter_capture(path, block_size=1 << 20):
+    """
+    Yields the (receive time, topic, payload bytes) frames of a capture file, reading
+    it block_size bytes at a time, so memory use does not depend on the file size.
+    Raises ValueError if the file is not a capture.
+    """
+    topics = {} # Encoded topic -> topic; captures have few distinct topics
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        data, position = b"", 0
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            data = data[position:] + block # The partial frame left over, if any, and the new block
+            position = 0
+            end = len(data)
+            while position + _FRAME.size <= end:
+                receive_time, topic_length, payload_length = _FRAME.unpack_from(data, position)
+                topic_start = position + _FRAME.size
+                payload_start = topic_start + topic_length
+                frame_end = payload_start + payload_length
+                if frame_end > end:
+                    break
+                encoded_topic = data[topic_start:payload_start]
+                topic = topics.get(encoded_topic)
+                if topic is None:
+                    topic = topics[encoded_topic] = encoded_topic.decode("utf-8")
+                yield receive_time, topic, data[payload_start:frame_end]
+                position = frame_end
+
+
+def capture_paths(path):
+    """The capture files of path: the file itself, or every capture file of a capture directory."""
+    if not os.path.isdir(path):
+        return [path]
+    names = sorted(name for name in os.listdir(path) if name.endswith(CAPTURE_EXTENSION))
+    if not names:
+        raise ValueError(f"no capture files in {path}")
+    return [os.path.join(path, name) for name in names]
+
+
+def read_captures(paths):
+    """Yields the frames of several capture files merged in receive time order (streaming)."""
+    if len(paths) == 1:
+        return iter_capture(paths[0])
+    return heapq.merge(*(iter_capture(path) for path in paths), key=lambda frame: frame[0])
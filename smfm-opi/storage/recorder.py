@@ -0,0 +1,380 @@
+"""
+Append-only on-disk recording of weight samples and scale events.
+
+Each scale gets its own directory with fixed-size chunk files of packed
+(receive timestamp, weight) records and an index.json describing them:
+
+    <root>/<scale id>/chunk_000000.bin
+    <root>/<scale id>/chunk_000001.bin
+    <root>/<scale id>/index.json
+    <root>/<scale id>/events.bin
+    <root>/<scale id>/events.json
+
+A chunk file is a 16-byte header followed by raw RECORD_DTYPE records, so it
+can be opened with np.memmap without any parsing. events.bin has the same
+layout with EVENT_DTYPE records (status changes and command outcomes), and
+events.json lists the command names their codes refer to. Samples and events
+are written by separate writers, so a scale's samples may be recorded by one
+process (an ingest shard) and its events by another.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+RECORD_DTYPE = np.dtype([("t", "<f8"), ("weight", "<f8")])
+CHUNK_MAGIC = b"SMFMREC1"
+CHUNK_HEADER_SIZE = 16 # Magic followed by reserved bytes
+INDEX_FILE = "index.json"
+
+# Events: t is the receive time; code is the status code for EVENT_STATUS and the
+# command's position in events.json for the command outcomes, whose value is the ack round-trip time (NaN if none)
+EVENT_DTYPE = np.dtype([("t", "<f8"), ("kind", "<i4"), ("code", "<i4"), ("value", "<f8")])
+EVENT_STATUS = 0
+EVENT_COMMAND_ACKED = 1
+EVENT_COMMAND_REJECTED = 2
+EVENT_COMMAND_TIMED_OUT = 3
+EVENT_MAGIC = b"SMFMEVT1"
+EVENTS_FILE = "events.bin"
+EVENTS_INDEX_FILE = "events.json"
+
+
+def _chunk_file_name(number):
+    return f"chunk_{number:06d}.bin"
+
+
+def write_json_atomically(path, data):
+    """Writes to a temporary file and renames it, so readers never see a partial file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class _ScaleChunkWriter:
+    """Appends records of one scale to its current chunk, rotating chunks and keeping the index up to date."""
+    def __init__(self, scale_dir, chunk_samples):
+        self._dir = scale_dir
+        self._chunk_samples = chunk_samples
+        os.makedirs(self._dir, exist_ok=True)
+        self._chunks = self._load_index()
+        self._file = None
+        if self._chunks:
+            self._reopen_last_chunk()
+        else:
+            self._open_new_chunk()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self._dir, INDEX_FILE)) as f:
+                return json.load(f)["chunks"]
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def _write_index(self):
+        index = {
+            "dtype": RECORD_DTYPE.descr,
+            "header_size": CHUNK_HEADER_SIZE,
+            "chunks": self._chunks,
+        }
+        write_json_atomically(os.path.join(self._dir, INDEX_FILE), index)
+
+    def _open_new_chunk(self):
+        number = len(self._chunks)
+        self._chunks.append({"file": _chunk_file_name(number), "count": 0, "t_first": None, "t_last": None})
+        self._file = open(os.path.join(self._dir, self._chunks[-1]["file"]), "wb")
+        self._file.write(CHUNK_MAGIC.ljust(CHUNK_HEADER_SIZE, b"\0"))
+
+    def _reopen_last_chunk(self):
+        chunk = self._chunks[-1]
+        path = os.path.join(self._dir, chunk["file"])
+        if not os.path.exists(path):
+            self._chunks.pop()
+            self._open_new_chunk()
+            return
+
+        # The file size is authoritative: the index may lag one flush behind after a crash,
+        # and a partially written trailing record is dropped.
+        count = max(0, (os.path.getsize(path) - CHUNK_HEADER_SIZE) // RECORD_DTYPE.itemsize)
+        self._file = open(path, "r+b")
+        self._file.truncate(CHUNK_HEADER_SIZE + count * RECORD_DTYPE.itemsize)
+        self._file.seek(0, os.SEEK_END)
+        chunk["count"] = count
+        if count:
+            records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=CHUNK_HEADER_SIZE, shape=(count,))
+            chunk["t_first"], chunk["t_last"] = float(records["t"][0]), float(records["t"][-1])
+            del records
+        if count >= self._chunk_samples:
+            self._file.close()
+            self._open_new_chunk()
+
+    def write(self, records):
+        """Appends records, rotating to a new chunk whenever the current one is full."""
+        while len(records):
+            chunk = self._chunks[-1]
+            part = records[:self._chunk_samples - chunk["count"]]
+            records = records[len(part):]
+
+            self._file.write(part.tobytes())
+            if chunk["t_first"] is None:
+                chunk["t_first"] = float(part["t"][0])
+            chunk["t_last"] = float(part["t"][-1])
+            chunk["count"] += len(part)
+
+            if chunk["count"] >= self._chunk_samples:
+                self._sync()
+                self._file.close()
+                self._open_new_chunk()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def commit(self):
+        """Makes everything written so far durable and updates the index."""
+        self._sync()
+        self._write_index()
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+
+class _ScaleEventWriter:
+    """Appends the events of one scale to its events file, numbering command names in events.json."""
+    def __init__(self, scale_dir):
+        self._dir = scale_dir
+        os.makedirs(self._dir, exist_ok=True)
+        try:
+            with open(os.path.join(self._dir, EVENTS_INDEX_FILE)) as f:
+                self._commands = json.load(f)["commands"]
+        except (OSError, ValueError, KeyError):
+            self._commands = []
+
+        path = os.path.join(self._dir, EVENTS_FILE)
+        if os.path.exists(path):
+            # As for chunks, a partially written trailing record is dropped
+            count = max(0, (os.path.getsize(path) - CHUNK_HEADER_SIZE) // EVENT_DTYPE.itemsize)
+            self._file = open(path, "r+b")
+            self._file.truncate(CHUNK_HEADER_SIZE + count * EVENT_DTYPE.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(EVENT_MAGIC.ljust(CHUNK_HEADER_SIZE, b"\0"))
+
+    def write(self, events):
+        """Appends (t, kind, code or command name, value) events."""
+        records = np.empty(len(events), dtype=EVENT_DTYPE)
+        names_changed = False
+        for i, (t, kind, code, value) in enumerate(events):
+            if isinstance(code, str):
+                if code not in self._commands:
+                    self._commands.append(code)
+                    names_changed = True
+                code = self._commands.index(code)
+            records[i] = (t, kind, code, value)
+        if names_changed:
+            # Names first: a reader never finds a code without its name
+            write_json_atomically(os.path.join(self._dir, EVENTS_INDEX_FILE), {"commands": self._commands})
+        self._file.write(records.tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class SampleRecorder:
+    """
+    Records (receive timestamp, weight) samples and the events of every scale to disk.
+
+    record() and the other record methods only append to an in-memory staging list and can be called from any
+    thread; a background thread writes the staged samples every flush_interval_s.
+    Staged memory is bounded by max_pending_samples (excess samples are dropped and
+    counted), and a crash loses at most the samples of the last flush interval.
+    """
+    def __init__(self, root_dir, flush_interval_s, chunk_samples, max_pending_samples):
+        self._root_dir = root_dir
+        self._flush_interval = flush_interval_s
+        self._chunk_samples = chunk_samples
+        self._max_pending = max_pending_samples
+
+        self._lock = threading.Lock()
+        self._pending = {} # scale_id -> list of parts: lists of (t, weight) or RECORD_DTYPE arrays
+        self._pending_count = 0
+        self._pending_events = {} # scale_id -> list of (t, kind, code or command name, value)
+        self.dropped_samples = 0
+
+        self._writers = {} # scale_id -> _ScaleChunkWriter, only used by the writer thread
+        self._event_writers = {} # scale_id -> _ScaleEventWriter, only used by the writer thread
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="SampleRecorder", daemon=True)
+
+    def start(self):
+        os.makedirs(self._root_dir, exist_ok=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the writer thread after a final flush."""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+        for writer in self._event_writers.values():
+            writer.close()
+        self._event_writers.clear()
+
+    def record(self, scale_id, t, weight):
+        """Stages one sample for writing."""
+        with self._lock:
+            if self._pending_count >= self._max_pending:
+                self.dropped_samples += 1
+                return
+            parts = self._pending.setdefault(scale_id, [])
+            if not parts or not isinstance(parts[-1], list):
+                parts.append([])
+            parts[-1].append((t, weight))
+            self._pending_count += 1
+
+    def record_many(self, scale_id, times, weights):
+        """Stages an array of samples for writing with one copy."""
+        with self._lock:
+            n = min(len(times), self._max_pending - self._pending_count)
+            if n < len(times):
+                self.dropped_samples += len(times) - max(n, 0)
+            if n <= 0:
+                return
+            records = np.empty(n, dtype=RECORD_DTYPE)
+            records["t"] = times[:n]
+            records["weight"] = weights[:n]
+            self._pending.setdefault(scale_id, []).append(records)
+            self._pending_count += n
+
+    def record_status(self, scale_id, t, status):
+        """Stages a status change of a scale."""
+        with self._lock:
+            self._pending_events.setdefault(scale_id, []).append((t, EVENT_STATUS, int(status), np.nan))
+
+    def record_command(self, scale_id, t, command, kind, rtt=None):
+        """Stages the outcome (an EVENT_COMMAND_* kind) of a command sent to a scale."""
+        with self._lock:
+            self._pending_events.setdefault(scale_id, []).append(
+                (t, kind, command, np.nan if rtt is None else rtt)
+            )
+
+    def _run(self):
+        while not self._stop_event.wait(self._flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Writes all staged samples to their chunk files."""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._pending_count = 0
+            pending_events = self._pending_events
+            self._pending_events = {}
+
+        for scale_id, parts in pending.items():
+            writer = self._writers.get(scale_id)
+            if writer is None:
+                writer = self._writers[scale_id] = _ScaleChunkWriter(
+                    os.path.join(self._root_dir, scale_id), self._chunk_samples
+                )
+            writer.write(np.concatenate([
+                np.array(part, dtype=RECORD_DTYPE) if isinstance(part, list) else part for part in parts
+            ]))
+            writer.commit()
+
+        for scale_id, events in pending_events.items():
+            writer = self._event_writers.get(scale_id)
+            if writer is None:
+                writer = self._event_writers[scale_id] = _ScaleEventWriter(os.path.join(self._root_dir, scale_id))
+            writer.write(events)
+
+
+class RecordingReader:
+    """Reads recorded samples and events back through memory-mapped files."""
+    def __init__(self, root_dir):
+        self._root_dir = root_dir
+
+    def scale_ids(self):
+        if not os.path.isdir(self._root_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self._root_dir)
+            if os.path.exists(os.path.join(self._root_dir, name, INDEX_FILE))
+            or os.path.exists(os.path.join(self._root_dir, name, EVENTS_FILE))
+        )
+
+    def _index(self, scale_id):
+        with open(os.path.join(self._root_dir, scale_id, INDEX_FILE)) as f:
+            return json.load(f)
+
+    def chunks(self, scale_id, t_start=None, t_end=None):
+        """
+        Returns the read-only memory-mapped RECORD_DTYPE arrays of a scale, skipping
+        the chunks that the index shows to be entirely outside [t_start, t_end].
+        """
+        chunks = []
+        if not os.path.exists(os.path.join(self._root_dir, scale_id, INDEX_FILE)):
+            return chunks # Only events recorded
+        index_chunks = self._index(scale_id)["chunks"]
+        for i, chunk in enumerate(index_chunks):
+            if chunk["t_first"] is None:
+                continue
+            # The last chunk may have grown since the index was written, so its t_last is only a lower bound
+            is_last = i == len(index_chunks) - 1
+            if t_start is not None and chunk["t_last"] < t_start and not is_last:
+                continue
+            if t_end is not None and chunk["t_first"] > t_end:
+                continue
+            path = os.path.join(self._root_dir, scale_id, chunk["file"])
+            count = (os.path.getsize(path) - CHUNK_HEADER_SIZE) // RECORD_DTYPE.itemsize
+            if count > 0:
+                chunks.append(np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=CHUNK_HEADER_SIZE, shape=(count,)))
+        return chunks
+
+    def read(self, scale_id, t_start=None, t_end=None):
+        """
+        Returns the samples of a scale with t_start <= t <= t_end as a RECORD_DTYPE array.
+        A range contained in a single chunk is returned as a memory-mapped slice without copying.
+        """
+        parts = []
+        for records in self.chunks(scale_id, t_start, t_end):
+            times = records["t"]
+            first = 0 if t_start is None else np.searchsorted(times, t_start, side="left")
+            last = len(records) if t_end is None else np.searchsorted(times, t_end, side="right")
+            if last > first:
+                parts.append(records[first:last])
+        if not parts:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def events(self, scale_id, t_start=None, t_end=None):
+        """
+        Returns (events, command names): the events of a scale with t_start <= t <= t_end as a
+        memory-mapped EVENT_DTYPE array, and the names that the command codes refer to.
+        """
+        scale_dir = os.path.join(self._root_dir, scale_id)
+        path = os.path.join(scale_dir, EVENTS_FILE)
+        try:
+            # Names are written before the events that use them, so they are read first
+            with open(os.path.join(scale_dir, EVENTS_INDEX_FILE)) as f:
+                commands = json.load(f)["commands"]
+        except (OSError, ValueError, KeyError):
+            commands = []
+        count = (os.path.getsize(path) - CHUNK_HEADER_SIZE) // EVENT_DTYPE.itemsize if os.path.exists(path) else 0
+        if count <= 0:
+            return np.empty(0, dtype=EVENT_DTYPE), commands
+        events = np.memmap(path, dtype=EVENT_DTYPE, mode="r", offset=CHUNK_HEADER_SIZE, shape=(count,))
+        times = events["t"]
+        first = 0 if t_start is None else np.searchsorted(times, t_start, side="left")
+        last = count if t_end is None else np.searchsorted(times, t_end, side="right")
+        return events[first:last], commands
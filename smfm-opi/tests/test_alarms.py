@@ -0,0 +1,50 @@
+import json
+import math
+
+from core.alarms import AlarmEngine, AlarmEvent, alarm_payload
+
+
+def test_debounced_timeout_alarm_clears_when_samples_resume():
+    engine = AlarmEngine([{"type": "timeout", "scale": "*", "timeout_s": 5.0, "delay_s": 1.0}])
+    engine.add_scale("s01")
+    engine.update("s01", 0.0, 1.0, 0.0)
+
+    raised = []
+    for i in range(1, 90): # Checks every 0.1 s without samples
+        raised.extend(engine.check(i * 0.1))
+    assert [event.active for event in raised] == [True]
+    assert engine.active_alarms() == ["s01/timeout"]
+
+    cleared = []
+    t = 9.0
+    while t < 19.0: # 10 s of samples every 50 ms, each followed by a check
+        cleared.extend(engine.update("s01", t, 1.0, 0.0))
+        cleared.extend(engine.check(t + 0.01))
+        t += 0.05
+    assert [event.active for event in cleared] == [False]
+    assert engine.active_alarms() == []
+
+
+def test_timeout_clear_delay_restarts_on_new_silence():
+    engine = AlarmEngine([{"type": "timeout", "scale": "*", "timeout_s": 5.0, "delay_s": 1.0}])
+    engine.add_scale("s01")
+    engine.update("s01", 0.0, 1.0, 0.0)
+    engine.check(5.5)
+    assert engine.check(6.5)
+    # A single sample, then silence again: the clear delay must not carry over
+    engine.update("s01", 7.0, 1.0, 0.0)
+    assert engine.check(12.5) == []
+    assert engine.update("s01", 13.0, 1.0, 0.0) == []
+    assert engine.active_alarms() == ["s01/timeout"]
+
+
+def test_alarm_payload_sends_non_finite_values_as_null():
+    for value in (math.nan, math.inf):
+        payload = alarm_payload(AlarmEvent("s01/rate", ("s01",), True, 1.5, value, "Variação"))
+        assert json.loads(payload)["value"] is None
+        assert "NaN" not in payload and "Infinity" not in payload
+    payload = alarm_payload(AlarmEvent("s01/threshold", ("s01",), False, 2.0, 61.25, "Peso normalizado"))
+    assert json.loads(payload) == {
+        "alarm": "s01/threshold", "scales": ["s01"], "state": "cleared", "t": 2.0, "value": 61.25,
+        "message": "Peso normalizado",
+    }
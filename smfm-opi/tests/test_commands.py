@@ -0,0 +1,58 @@
+import json
+
+from core.commands import ACKED, REJECTED, TIMED_OUT, CommandTracker
+
+TARE = ("s01", "smfm/s01/operation/tare")
+
+
+def test_envelope_ack_matches_by_cid():
+    tracker = CommandTracker(2.0, 2)
+    group_id, publishes = tracker.submit([TARE, ("s02", "smfm/s02/operation/tare")], "tare", "", 1, now=0.0)
+    assert len(publishes) == 2
+    cids = [json.loads(payload)["cid"] for _, payload, _ in publishes]
+
+    # An ack from the wrong scale or with an unknown cid matches nothing
+    assert tracker.acknowledge("s02", {"cid": cids[0]}, now=0.1) == ([], [])
+    assert tracker.acknowledge("s01", {"cid": "other"}, now=0.1) == ([], [])
+
+    results, groups = tracker.acknowledge("s01", {"cid": cids[0], "ok": True}, now=0.25)
+    assert [(r.scale_id, r.status, r.attempts) for r in results] == [("s01", ACKED, 1)]
+    assert abs(results[0].rtt - 0.25) < 1e-9
+    assert groups == []
+    results, groups = tracker.acknowledge("s02", {"cid": cids[1], "ok": False, "detail": "busy"}, now=0.3)
+    assert results[0].status == REJECTED and results[0].detail == "busy"
+    assert [group.group_id for group in groups] == [group_id]
+    assert len(tracker) == 0
+
+
+def test_envelope_retries_with_the_same_payload_then_gives_up():
+    tracker = CommandTracker(1.0, 2, envelope=True)
+    _, publishes = tracker.submit([TARE], "tare", '{"target": 5}', 1, now=0.0)
+    topic, payload, qos = publishes[0]
+    assert json.loads(payload)["value"] == {"target": 5}
+
+    assert tracker.expire(now=0.5) == ([], [], [])
+    for t in (1.0, 2.0):
+        resent, results, _ = tracker.expire(now=t)
+        assert resent == [(topic, payload, qos)] and results == []
+    resent, results, groups = tracker.expire(now=3.0)
+    assert resent == []
+    assert [(r.status, r.attempts) for r in results] == [(TIMED_OUT, 3)]
+    assert len(groups) == 1
+    assert len(tracker) == 0
+
+
+def test_legacy_payload_is_never_resent_and_acks_by_command():
+    tracker = CommandTracker(1.0, 2, envelope=False)
+    _, publishes = tracker.submit([TARE], "tare", "", 1, now=0.0)
+    _, second = tracker.submit([TARE], "tare", "", 1, now=0.5)
+    assert publishes[0][1] == "" # The plain payload, without a cid
+
+    # {"cmd": ...} completes the oldest pending command of that name on that scale
+    results, _ = tracker.acknowledge("s01", {"cmd": "tare", "ok": True}, now=0.2)
+    assert [(r.status, r.attempts) for r in results] == [(ACKED, 1)]
+    assert tracker.acknowledge("s02", {"cmd": "tare"}, now=0.3) == ([], [])
+
+    resent, results, _ = tracker.expire(now=1.5)
+    assert resent == []
+    assert [(r.status, r.attempts) for r in results] == [(TIMED_OUT, 1)]
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from core.flow import FlowEstimator, compute_flow
+
+TAU_S, WINDOW, THRESHOLD = 1.0, 100, 0.02 # FLOW_* defaults
+RATE_HZ = 50.0
+
+
+def _feed(times, weights):
+    estimator = FlowEstimator(TAU_S, WINDOW, THRESHOLD)
+    slopes = [estimator.update(t, w).flow_slope for t, w in zip(times, weights)]
+    return estimator, np.array(slopes)
+
+
+def test_constant_dispensing_rate():
+    t = np.arange(500) / RATE_HZ
+    w = 50.0 - 0.5 * t
+    estimator, slopes = _feed(t, w)
+    reading = estimator.reading()
+    assert slopes[1:] == pytest.approx(-0.5)
+    assert reading.flow_ema == pytest.approx(-0.5, abs=1e-3) # About ten time constants in
+    assert reading.dispensed == pytest.approx(0.5 * t[-1])
+    assert reading.filled == 0.0
+    assert reading.time_to_empty == pytest.approx(w[-1] / 0.5)
+
+
+def test_step_change_in_rate():
+    t = np.arange(1000) / RATE_HZ # 20 s, filling at 1 kg/s from t = 10 s
+    w = 10.0 + np.maximum(0.0, t - 10.0)
+    estimator, slopes = _feed(t, w)
+    reading = estimator.reading()
+    assert slopes[t < 10.0] == pytest.approx(0.0, abs=1e-9)
+    assert slopes[-1] == pytest.approx(1.0) # The window holds only the new rate
+    assert reading.flow_ema == pytest.approx(1.0, abs=1e-3) # About ten time constants later
+    # 9.98 kg were filled; the slope over a 2 s window lags the step by half a window (1 kg)
+    assert reading.filled == pytest.approx(8.98, abs=0.02)
+    assert reading.dispensed == 0.0
+    assert reading.time_to_empty is None
+
+
+def test_noise_below_threshold_adds_nothing_to_the_totals():
+    rng = np.random.default_rng(1)
+    t = np.arange(3000) / RATE_HZ
+    w = 25.0 + rng.uniform(-0.0005, 0.0005, len(t))
+    estimator = FlowEstimator(TAU_S, WINDOW, THRESHOLD)
+    for i in range(WINDOW): # The first slopes, over a few samples, still follow the noise
+        estimator.update(t[i], w[i])
+    totals = (estimator.dispensed, estimator.filled)
+    slopes = [estimator.update(t[i], w[i]).flow_slope for i in range(WINDOW, len(t))]
+    assert np.max(np.abs(slopes)) < THRESHOLD
+    assert (estimator.dispensed, estimator.filled) == totals
+    assert estimator.reading().time_to_empty is None
+
+
+def test_batch_and_vectorized_paths_match_the_streaming_one():
+    rng = np.random.default_rng(2)
+    t = np.cumsum(rng.uniform(0.01, 0.03, 2000))
+    w = 40.0 - 0.3 * t + rng.normal(0.0, 0.01, len(t))
+    streaming, slopes = _feed(t, w)
+
+    batched = FlowEstimator(TAU_S, WINDOW, THRESHOLD)
+    batch_slopes = np.concatenate([batched.extend(t[i:i + 64], w[i:i + 64]) for i in range(0, len(t), 64)])
+    assert batch_slopes == pytest.approx(slopes, abs=1e-9)
+    assert batched.reading().dispensed == pytest.approx(streaming.dispensed)
+    assert batched.flow_ema == pytest.approx(streaming.flow_ema)
+
+    flow = compute_flow(t, w, TAU_S, WINDOW, THRESHOLD)
+    assert flow["flow_slope"] == pytest.approx(slopes, abs=1e-9)
+    assert flow["flow_ema"][-1] == pytest.approx(streaming.flow_ema)
+    assert flow["dispensed"][-1] == pytest.approx(streaming.dispensed)
+    assert flow["filled"][-1] == pytest.approx(streaming.filled)
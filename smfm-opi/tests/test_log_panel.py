@@ -0,0 +1,44 @@
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import pytest
+from PyQt5 import QtWidgets
+
+from gui.log_panel import LogPanel
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def _rows(panel):
+    panel.flush()
+    return [line.split("] ", 1)[1] for line in panel.to_plain_text().splitlines()]
+
+
+def test_consecutive_repeats_collapse(app):
+    panel = LogPanel("Logs", 100, 1000, 100.0, 100)
+    for _ in range(3):
+        panel.append("Conectado", "mqtt")
+    assert _rows(panel) == ["Conectado (x3)"]
+    panel.append("Conectado", "mqtt") # Still the last line after a flush
+    assert _rows(panel) == ["Conectado (x4)"]
+
+
+def test_interleaved_sources_add_new_lines(app):
+    panel = LogPanel("Logs", 100, 1000, 100.0, 100)
+    panel.append("Conectado", "mqtt")
+    panel.append("Comando enviado", "app")
+    panel.append("Conectado", "mqtt")
+    panel.append("Conectado", "mqtt")
+    assert _rows(panel) == ["Conectado", "Comando enviado", "Conectado (x2)"]
+
+
+def test_repeats_count_against_the_rate_limit(app):
+    panel = LogPanel("Logs", 100, 1000, 0.001, 2)
+    for _ in range(5):
+        panel.append("Erro", "device")
+    panel.append("Outro", "app")
+    assert _rows(panel) == ["Erro (x2)", "Outro"]
@@ -0,0 +1,73 @@
+import struct
+
+import numpy as np
+import pytest
+
+from core.payload import (
+    SAMPLE_DTYPE, SEQUENCE_MODULO, WEIGHT_BATCH_MAGIC, decode_weight_batch, encode_weight_batch, is_weight_batch
+)
+
+HEADER_SIZE = 26
+
+
+def _batch(count=10, sequence=7):
+    offsets = np.arange(count) * 0.02
+    weights = 12.5 - 0.01 * np.arange(count)
+    return encode_weight_batch("s01", sequence, 1_700_000_000.25, offsets, weights), offsets, weights
+
+
+def test_round_trip():
+    payload, offsets, weights = _batch()
+    assert len(payload) == HEADER_SIZE + 10 * SAMPLE_DTYPE.itemsize
+    assert is_weight_batch(payload) and not is_weight_batch(b"12.500")
+    batch = decode_weight_batch(payload)
+    assert (batch.scale_id, batch.sequence, batch.t_base, len(batch)) == ("s01", 7, 1_700_000_000.25, 10)
+    # Offsets travel as whole microseconds, weights as float32
+    assert batch.offsets == pytest.approx(offsets, abs=1e-6)
+    assert batch.weights == pytest.approx(weights, abs=1e-5)
+    assert batch.offsets.dtype == batch.weights.dtype == np.float64
+
+
+def test_microsecond_offsets_convert_to_seconds():
+    payload = encode_weight_batch("s02", 0, 100.0, [0.0, 0.000001, 1.5, 4294.967295], [1.0, 2.0, 3.0, 4.0])
+    batch = decode_weight_batch(payload)
+    assert batch.offsets.tolist() == pytest.approx([0.0, 1e-6, 1.5, 4294.967295], abs=1e-9)
+    assert (batch.t_base + batch.offsets)[-1] == pytest.approx(4394.967295)
+
+
+def test_sequence_wraps():
+    payload, _, _ = _batch(sequence=SEQUENCE_MODULO + 3)
+    assert decode_weight_batch(payload).sequence == 3
+
+
+def test_empty_batch():
+    batch = decode_weight_batch(encode_weight_batch("s01", 1, 0.0, [], []))
+    assert len(batch) == 0
+
+
+@pytest.mark.parametrize("cut", [0, 5, HEADER_SIZE - 1])
+def test_shorter_than_the_header(cut):
+    payload, _, _ = _batch()
+    with pytest.raises(ValueError, match="header"):
+        decode_weight_batch(payload[:cut])
+
+
+@pytest.mark.parametrize("extra", [-1, -SAMPLE_DTYPE.itemsize, 1, SAMPLE_DTYPE.itemsize])
+def test_truncated_or_oversized_payload(extra):
+    payload, _, _ = _batch()
+    payload = payload[:extra] if extra < 0 else payload + b"\0" * extra
+    with pytest.raises(ValueError, match="does not hold 10 samples"):
+        decode_weight_batch(payload)
+
+
+def test_sample_count_must_match_the_payload():
+    payload, _, _ = _batch()
+    forged = payload[:24] + struct.pack("<H", 11) + payload[26:]
+    with pytest.raises(ValueError, match="does not hold 11 samples"):
+        decode_weight_batch(forged)
+
+
+def test_unsupported_version():
+    payload, _, _ = _batch()
+    with pytest.raises(ValueError, match="version 2"):
+        decode_weight_batch(WEIGHT_BATCH_MAGIC + b"\x02" + payload[3:])
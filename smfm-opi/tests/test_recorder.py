@@ -0,0 +1,91 @@
+import json
+import os
+
+import numpy as np
+
+from storage.recorder import (
+    CHUNK_HEADER_SIZE, EVENT_COMMAND_ACKED, EVENT_STATUS, INDEX_FILE, RECORD_DTYPE, RecordingReader, SampleRecorder
+)
+
+
+def _index(root, scale_id="s01"):
+    with open(os.path.join(root, scale_id, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def test_chunks_roll_over_and_are_indexed(tmp_path):
+    root = str(tmp_path)
+    recorder = SampleRecorder(root, 60.0, 100, 10000)
+    times = np.arange(250) / 4.0
+    recorder.record_many("s01", times, times * 2)
+    for t in (62.5, 62.75):
+        recorder.record("s01", t, t * 2)
+    recorder.flush()
+
+    chunks = _index(root)["chunks"]
+    assert [chunk["count"] for chunk in chunks] == [100, 100, 52]
+    assert [chunk["file"] for chunk in chunks] == ["chunk_000000.bin", "chunk_000001.bin", "chunk_000002.bin"]
+    assert (chunks[1]["t_first"], chunks[1]["t_last"]) == (25.0, 49.75)
+    for chunk in chunks:
+        size = os.path.getsize(os.path.join(root, "s01", chunk["file"]))
+        assert size == CHUNK_HEADER_SIZE + chunk["count"] * RECORD_DTYPE.itemsize
+
+    reader = RecordingReader(root)
+    records = reader.read("s01")
+    assert len(records) == 252 and np.all(np.diff(records["t"]) > 0)
+    assert np.array_equal(records["weight"], records["t"] * 2)
+    assert reader.read("s01", 24.9, 25.6)["t"].tolist() == [25.0, 25.25, 25.5]
+    recorder.stop()
+
+
+def test_pending_samples_are_bounded(tmp_path):
+    recorder = SampleRecorder(str(tmp_path), 60.0, 100, 50)
+    recorder.record_many("s01", np.arange(40.0), np.zeros(40))
+    recorder.record_many("s02", np.arange(20.0), np.zeros(20))
+    recorder.record("s01", 40.0, 0.0)
+    assert recorder.dropped_samples == 11
+    recorder.flush()
+    # Flushing frees the room again
+    recorder.record("s01", 41.0, 0.0)
+    recorder.flush()
+    reader = RecordingReader(str(tmp_path))
+    assert (len(reader.read("s01")), len(reader.read("s02"))) == (41, 10)
+    assert recorder.dropped_samples == 11
+
+
+def test_reopen_after_a_crash_trusts_the_file_size(tmp_path):
+    root = str(tmp_path)
+    recorder = SampleRecorder(root, 60.0, 100, 10000)
+    recorder.record_many("s01", np.arange(150.0), np.arange(150.0))
+    recorder.flush()
+    # Samples written after the last index update, and a record cut in half by the crash
+    path = os.path.join(root, "s01", "chunk_000001.bin")
+    extra = np.array([(150.0, 150.0), (151.0, 151.0)], dtype=RECORD_DTYPE).tobytes()
+    with open(path, "ab") as f:
+        f.write(extra + extra[:RECORD_DTYPE.itemsize // 2])
+    assert _index(root)["chunks"][1]["count"] == 50
+
+    recorder = SampleRecorder(root, 60.0, 100, 10000)
+    recorder.record_many("s01", np.arange(152.0, 202.0), np.arange(152.0, 202.0))
+    recorder.flush()
+    recorder.stop()
+
+    chunks = _index(root)["chunks"]
+    assert [chunk["count"] for chunk in chunks] == [100, 100, 2]
+    assert os.path.getsize(path) == CHUNK_HEADER_SIZE + 100 * RECORD_DTYPE.itemsize
+    records = RecordingReader(root).read("s01")
+    assert records["t"].tolist() == list(np.arange(202.0))
+
+
+def test_events_round_trip(tmp_path):
+    root = str(tmp_path)
+    recorder = SampleRecorder(root, 60.0, 100, 10000)
+    recorder.record_status("s01", 1.0, 2)
+    recorder.record_command("s01", 2.0, "tare", EVENT_COMMAND_ACKED, rtt=0.05)
+    recorder.flush()
+    recorder.stop()
+    events, commands = RecordingReader(root).events("s01")
+    assert commands == ["tare"]
+    assert events["kind"].tolist() == [EVENT_STATUS, EVENT_COMMAND_ACKED]
+    assert events["code"].tolist() == [2, 0]
+    assert events["value"][1] == 0.05
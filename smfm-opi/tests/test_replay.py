@@ -0,0 +1,51 @@
+import time
+
+from core.ingest import IngestCore
+from mqtt.replay_client import ReplayClient
+from storage.capture import CaptureWriter
+from utils import clock
+
+
+def _write_capture(path, start):
+    """s01 weights every 50 ms for 2 s, 6 s of silence, then 2 s more."""
+    writer = CaptureWriter(str(path), 1 << 16)
+    for i in range(200):
+        t = i * 0.05
+        if not 2.0 <= t < 8.0:
+            writer.write(start + t, "smfm/s01/measurement/weight", b"1.000")
+    writer.close()
+
+
+def test_replay_at_speed_raises_and_clears_timeout_alarm(tmp_path):
+    path = tmp_path / "gap.smfmcap"
+    _write_capture(path, start=1_000_000.0)
+    core = IngestCore(
+        known_scale_ids=("s01",), alarm_rules=[{"type": "timeout", "scale": "*", "timeout_s": 5.0}]
+    )
+    start_time = clock.real_now() + 0.1
+    client = ReplayClient(paths=[str(path)], speed=10.0, start_time=start_time)
+    client.on_message = lambda _client, _userdata, msg: core.handle_message(msg.topic, msg.payload, msg.receive_time)
+    for topic in core.subscription_topics:
+        client.subscribe(topic)
+
+    events = []
+    client.connect("replay")
+    try:
+        deadline = time.monotonic() + 10.0
+        while not client.finished.is_set() and time.monotonic() < deadline:
+            time.sleep(0.01)
+            batch = core.drain()
+            if batch is not None:
+                events.extend(batch.alarms)
+        batch = core.drain()
+        if batch is not None:
+            events.extend(batch.alarms)
+    finally:
+        client.disconnect()
+        clock.set_source(None)
+
+    assert client.finished.is_set()
+    assert [(event.alarm, event.active) for event in events] == [("s01/timeout", True), ("s01/timeout", False)]
+    # Raised within the gap on the replay timeline, about 5 s after the last sample before it
+    raised = events[0]
+    assert 6.9 < raised.t - start_time < 8.0
@@ -0,0 +1,110 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+
+from core.report import RUN_COLUMNS, SCALE_COLUMNS, SUMMARY_FILE, ReportEngine, export_report
+from storage.recorder import EVENT_COMMAND_ACKED, EVENT_COMMAND_TIMED_OUT, SampleRecorder
+from utils.constants import SCALE_STATUS_OPERATING
+
+T0 = 1_700_000_000.0
+FLOW_SETTINGS = (1.0, 100, 0.02)
+IDLE = 1
+
+
+def _weights(t):
+    """50 kg until 20 s, dispensed at 0.5 kg/s until empty at 120 s."""
+    return np.clip(50.0 - 0.5 * (t - 20.0), 0.0, 50.0)
+
+
+def _record(root, start_s, end_s, events=()):
+    recorder = SampleRecorder(root, 60.0, 400, 100000)
+    t = np.arange(start_s * 10, end_s * 10) / 10.0
+    recorder.record_many("s01", T0 + t, _weights(t))
+    for event in events:
+        event(recorder)
+    recorder.flush()
+    recorder.stop()
+
+
+def _run_recording(root):
+    _record(root, 0, 150, [
+        lambda r: r.record_status("s01", T0, IDLE),
+        lambda r: r.record_status("s01", T0 + 20.0, SCALE_STATUS_OPERATING),
+        lambda r: r.record_command("s01", T0 + 30.0, "tare", EVENT_COMMAND_ACKED, rtt=0.04),
+        lambda r: r.record_status("s01", T0 + 120.0, IDLE),
+        lambda r: r.record_command("s01", T0 + 130.0, "tare", EVENT_COMMAND_TIMED_OUT),
+    ])
+
+
+def _assert_same_tables(a, b):
+    for name in ("runs", "scales", "commands"):
+        table_a, table_b = getattr(a, name), getattr(b, name)
+        assert list(table_a) == list(table_b)
+        for column in table_a:
+            np.testing.assert_array_equal(table_a[column], table_b[column], err_msg=f"{name}.{column}")
+
+
+def test_run_totals(tmp_path):
+    root = str(tmp_path)
+    _run_recording(root)
+    report = ReportEngine(root, FLOW_SETTINGS, 10.0).report(t_end=T0 + 1000.0)
+
+    runs = report.runs
+    assert len(runs["scale"]) == 1
+    assert (runs["start"][0], runs["end"][0], runs["duration_s"][0]) == (T0 + 20.0, T0 + 120.0, 100.0)
+    assert runs["end_status"][0] == IDLE
+    assert runs["samples"][0] == 1000
+    assert runs["weight_start_kg"][0] == 50.0
+    assert runs["weight_end_kg"][0] == pytest.approx(0.05)
+    # The 10 s slope window lags the start of the flow by half a window: 2.5 kg are counted after the run
+    assert runs["dispensed_kg"][0] == pytest.approx(47.5, abs=0.05)
+    assert runs["peak_flow_kg_s"][0] == pytest.approx(0.5)
+    assert runs["filled_kg"][0] == 0.0
+    assert runs["commands"][0] == 1
+
+    scales = report.scales
+    assert scales["samples"][0] == 1500 and scales["runs"][0] == 1
+    assert scales["dispensed_kg"][0] == pytest.approx(50.0, abs=0.05)
+    assert (scales["commands"][0], scales["commands_failed"][0]) == (2, 1)
+    assert scales[f"status_{SCALE_STATUS_OPERATING}_s"][0] == pytest.approx(100.0)
+    assert scales[f"status_{IDLE}_s"][0] == pytest.approx(20.0 + 29.9)
+    assert report.commands["outcome"].tolist() == ["acked", "timeout"]
+
+
+def test_cached_and_uncached_reports_are_identical(tmp_path):
+    root = str(tmp_path)
+    _run_recording(root)
+    cached = ReportEngine(root, FLOW_SETTINGS, 10.0)
+    uncached = ReportEngine(root, FLOW_SETTINGS, 10.0, use_cache=False)
+    first = cached.report(t_end=T0 + 1000.0)
+    assert os.path.exists(os.path.join(root, "s01", SUMMARY_FILE))
+    _assert_same_tables(first, uncached.report(t_end=T0 + 1000.0))
+    _assert_same_tables(first, cached.report(t_end=T0 + 1000.0)) # Now from the cache
+
+    # Samples recorded after the cache was written are summarized on top of it
+    _record(root, 150, 200, [lambda r: r.record_status("s01", T0 + 160.0, SCALE_STATUS_OPERATING)])
+    again = cached.report(t_end=T0 + 1000.0)
+    _assert_same_tables(again, uncached.report(t_end=T0 + 1000.0))
+    assert len(again.runs["scale"]) == 2 and again.runs["end_status"][1] == -1 # Ongoing
+
+
+def test_export(tmp_path):
+    root = str(tmp_path / "recordings")
+    _run_recording(root)
+    report = ReportEngine(root, FLOW_SETTINGS, 10.0).report(t_end=T0 + 1000.0)
+
+    paths = export_report(report, str(tmp_path / "csv"), "csv")
+    assert [os.path.basename(path) for path in paths] == ["runs.csv", "scales.csv", "commands.csv"]
+    with open(paths[0], newline="") as f:
+        rows = list(csv.reader(f))
+    assert tuple(rows[0]) == RUN_COLUMNS and len(rows) == 2
+    assert float(rows[1][RUN_COLUMNS.index("dispensed_kg")]) == report.runs["dispensed_kg"][0]
+
+    paths = export_report(report, str(tmp_path / "npz"), "npz")
+    with np.load(paths[1]) as scales:
+        assert tuple(scales.files) == SCALE_COLUMNS
+        np.testing.assert_array_equal(scales["dispensed_kg"], report.scales["dispensed_kg"])
+    with pytest.raises(ValueError):
+        export_report(report, str(tmp_path / "x"), "xlsx")
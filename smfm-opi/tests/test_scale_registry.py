@@ -0,0 +1,22 @@
+import pytest
+
+from core.ingest import IngestCore
+from core.scale_registry import ScaleRegistry
+
+
+@pytest.mark.parametrize("scale_id", ["..", ".", "a b", "s01.x", "é"])
+def test_registry_rejects_scale_ids_that_are_not_plain_names(scale_id):
+    registry = ScaleRegistry({"measurement/weight": lambda scale, payload, receive_time: None})
+    with pytest.raises(ValueError):
+        registry.resolve(f"smfm/{scale_id}/measurement/weight")
+    assert len(registry) == 0
+
+
+def test_ingest_logs_and_drops_topics_with_invalid_scale_ids():
+    core = IngestCore()
+    core.handle_message("smfm/../measurement/weight", b"1.0", 1.0)
+    core.handle_message("smfm/s-01_a/measurement/weight", b"1.0", 1.0)
+    batch = core.drain()
+    assert [scale.scale_id for scale in core.scale_registry] == ["s-01_a"]
+    assert [source for source, _ in batch.logs] == ["unknown_topic"]
+    assert "smfm/../measurement/weight" in batch.logs[0][1]
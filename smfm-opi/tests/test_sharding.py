@@ -0,0 +1,107 @@
+import functools
+import time
+
+import numpy as np
+
+from core.sharding import ShardedIngest, ShardSettings
+from mqtt.replay_client import ReplayClient
+from storage.capture import CaptureWriter
+from utils import clock
+from utils.constants import TOPIC_WEIGHT_WILDCARD
+from utils.metrics import MetricsRegistry
+
+SCALE_IDS = ["s01", "s02", "s03", "s04"]
+MESSAGES = 50
+
+
+class _RestoredSessionClient(ReplayClient):
+    """A replay whose broker session still holds the weight wildcard (e.g. from another shard layout)."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.subscribe(TOPIC_WEIGHT_WILDCARD)
+
+
+def _write_capture(path):
+    writer = CaptureWriter(str(path), 1 << 16)
+    for i in range(MESSAGES):
+        t = 1_000_000.0 + i * 0.01
+        for n, scale_id in enumerate(SCALE_IDS + ["s09"]): # s09 is assigned to no shard
+            writer.write(t, f"smfm/{scale_id}/measurement/weight", f"{n * 1000 + i}".encode())
+    writer.close()
+
+
+def test_two_shards_ingest_every_sample_once(tmp_path):
+    path = tmp_path / "traffic.smfmcap"
+    _write_capture(path)
+    factory = functools.partial(
+        _RestoredSessionClient, paths=[str(path)], speed=0.0, start_time=clock.real_now() + 4.0
+    )
+    settings = ShardSettings(
+        "localhost", 1883, "test", 60, {}, factory, None, None, 0.05, 0.0, clock.anchor(), (), None
+    )
+    metrics = MetricsRegistry()
+    sharded = ShardedIngest(2, settings, 1000, 100, metrics=metrics, colocate=[{"s01", "s03"}])
+    sharded.start()
+    weights = {scale_id: [] for scale_id in SCALE_IDS}
+    logs = []
+    try:
+        for scale_id in SCALE_IDS:
+            sharded.add_scale(scale_id)
+        assert [sharded.shard_of(scale_id) for scale_id in SCALE_IDS] == [0, 1, 0, 1]
+
+        deadline = time.monotonic() + 30.0
+        while time.monotonic() < deadline:
+            batch = sharded.drain()
+            if batch is not None:
+                logs.extend(message for _, message in batch.logs)
+                for scale_id, (_, scale_weights, _) in batch.samples.items():
+                    weights[scale_id].extend(scale_weights.tolist())
+            if all(len(values) >= MESSAGES for values in weights.values()) and len(logs) >= 2:
+                break
+            time.sleep(0.05)
+        time.sleep(0.3) # Anything delivered twice would arrive by now
+        batch = sharded.drain()
+        if batch is not None:
+            logs.extend(message for _, message in batch.logs)
+            for scale_id, (_, scale_weights, _) in batch.samples.items():
+                weights[scale_id].extend(scale_weights.tolist())
+        alive = metrics.gauge("smfm_shards_alive", "").value
+    finally:
+        sharded.stop()
+
+    for n, scale_id in enumerate(SCALE_IDS):
+        assert np.array_equal(weights[scale_id], n * 1000 + np.arange(MESSAGES)), scale_id
+    # Both shards received s09 and the other shard's scales, dropped them and kept running
+    assert alive == 2
+    assert sum("smfm/s09/measurement/weight" in message for message in logs) == 2
+    assert not any("terminou" in message for message in logs)
+
+
+def test_core_without_weights_unsubscribes_the_weight_wildcard(tmp_path):
+    from core.ingest import IngestCore
+    from mqtt.mqtt_client import MqttClient
+
+    path = tmp_path / "traffic.smfmcap"
+    _write_capture(path)
+    core = IngestCore(subscribe_weights=False)
+    clients = []
+
+    def factory(*args, **kwargs):
+        clients.append(_RestoredSessionClient(*args, paths=[str(path)], speed=0.0, **kwargs))
+        return clients[-1]
+
+    client = MqttClient(
+        "localhost", 1883, "test", 60, core.subscription_topics, on_message=core.handle_message,
+        client_factory=factory, topics_to_unsubscribe=core.unsubscription_topics
+    )
+    client.start()
+    try:
+        deadline = time.monotonic() + 10.0
+        while not (clients and clients[0].finished.is_set()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        client.stop()
+        clock.set_source(None)
+    assert clients[0].finished.is_set()
+    assert clients[0].delivered_messages == 0
+    assert core.drain() is None
@@ -0,0 +1,48 @@
+"""
+Throughput and latency accounting for batched MQTT message delivery.
+"""
+from utils import clock
+
+
+class BatchStats:
+    """
+    Accumulates message batches delivered to the GUI and summarizes them once
+    per reporting window (messages/s, batches/s and receive-to-delivery latency).
+    """
+    def __init__(self, report_interval_s):
+        self._report_interval = report_interval_s
+        self._window_start = clock.now()
+        self._reset()
+
+    def _reset(self):
+        self._messages = 0
+        self._batches = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+
+    def record(self, message_count, oldest_receive_time, now=None):
+        """
+        Records one delivered batch. Returns a report string when the reporting
+        window has elapsed, otherwise None.
+        """
+        if now is None:
+            now = clock.now()
+        latency = max(0.0, now - oldest_receive_time)
+        self._messages += message_count
+        self._batches += 1
+        self._latency_sum += latency
+        self._latency_max = max(self._latency_max, latency)
+
+        elapsed = now - self._window_start
+        if elapsed < self._report_interval:
+            return None
+
+        report = (
+            f"Batch delivery: {self._messages / elapsed:.0f} msg/s in "
+            f"{self._batches / elapsed:.1f} batches/s, latency avg "
+            f"{1000.0 * self._latency_sum / self._batches:.1f} ms, "
+            f"max {1000.0 * self._latency_max:.1f} ms"
+        )
+        self._window_start = now
+        self._reset()
+        return report
@@ -0,0 +1,41 @@
+"""
+Receive clock: epoch seconds that never step backwards.
+
+now() is time.monotonic() shifted by an anchor taken once at import, so timestamps
+stay comparable with time.time() (recordings, reports) but are unaffected by NTP
+or manual changes of the wall clock while the application runs. Processes that
+share timestamps (the ingest shards) use the anchor of the parent (set_anchor()).
+
+A replay (mqtt/replay_client.py) drives now() from its timeline with set_source(),
+so alarm timeouts, alignment and latencies are measured in captured time at any
+replay speed; real_now() keeps returning the receive clock.
+"""
+import time
+
+_anchor = time.time() - time.monotonic()
+_source = None
+
+
+def now():
+    if _source is not None:
+        return _source()
+    return time.monotonic() + _anchor
+
+
+def real_now():
+    return time.monotonic() + _anchor
+
+
+def anchor():
+    return _anchor
+
+
+def set_anchor(value):
+    global _anchor
+    _anchor = value
+
+
+def set_source(source):
+    """Makes now() return source() (a function returning epoch seconds); None restores the receive clock."""
+    global _source
+    _source = source
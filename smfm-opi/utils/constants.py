@@ -7,23 +7,111 @@ MQTT_BROKER = "localhost" # Change to your MQTT broker's IP address or hostname
 MQTT_PORT = 1883
 MQTT_CLIENT_ID = "smfm_opi"
 MQTT_KEEPALIVE_INTERVAL = 60 # Seconds
+MQTT_CLEAN_SESSION = False # Persistent session: the broker keeps our subscriptions and queues QoS 1 messages while we reconnect
+MQTT_SUBSCRIBE_QOS = 1 # Messages are only queued for an offline session if both publisher and subscription use QoS >= 1
+MQTT_RECONNECT_MIN_S = 0.5 # First reconnection delay; doubles after every failed attempt...
+MQTT_RECONNECT_MAX_S = 8.0 # ...up to this delay. Each delay is randomized (jitter) so clients do not reconnect in lockstep
+MQTT_OUTBOX_SIZE = 200 # Messages held while disconnected and published on reconnection (oldest dropped first)
 
-# MQTT Scales Topics Prefixes
-SCALE_O1_PREFIX = "smfm/s01/"
-SCALE_O2_PREFIX = "smfm/s02/"
+# MQTT Scales Topics (per-scale topics are TOPIC_ROOT + <scale id> + "/" + suffix, e.g. "smfm/s01/measurement/weight")
+TOPIC_ROOT = "smfm/"
+WEIGHT_TOPIC_SUFFIX = "measurement/weight"
+STATUS_TOPIC_SUFFIX = "operation/status"
+ACK_TOPIC_SUFFIX = "operation/ack" # Command acknowledgements (see core/commands.py)
+KNOWN_SCALE_IDS = ["s01", "s02"] # Scales shown at startup; any other scale is added when it first publishes
+SCALE_STATUS_LABELS = [ # Status codes 0-4 published on the status topic
+    "Desconectada", "Conectada - Desativada", "Conectada - Stand-By", "Conectada - Operando", "Conectada - Vazia"
+]
+SCALE_STATUS_OPERATING = 3 # A run (batch) in the reports is the time a scale spends in this status
 
 # MQTT Topics for Data Publication (ESP32 -> Python)
-TOPIC_WEIGHT_01 = SCALE_O1_PREFIX + "measurement/weight"
-TOPIC_WEIGHT_02 = SCALE_O2_PREFIX + "measurement/weight"
-TOPIC_STATUS_01 = SCALE_O1_PREFIX + "operation/status"
-TOPIC_STATUS_02 = SCALE_O2_PREFIX + "operation/status"
+TOPIC_WEIGHT_WILDCARD = TOPIC_ROOT + "+/" + WEIGHT_TOPIC_SUFFIX
+TOPIC_STATUS_WILDCARD = TOPIC_ROOT + "+/" + STATUS_TOPIC_SUFFIX
+TOPIC_ACK_WILDCARD = TOPIC_ROOT + "+/" + ACK_TOPIC_SUFFIX
 TOPIC_LOG = "smfm/log"
 
 # MQTT Topics for Command Subscription (Python -> ESP32)
 START_COMMAND = "smfm/operation/start"
-COMMAND_TOPIC_01_PREFIX = SCALE_O1_PREFIX + "operation/"
-COMMAND_TOPIC_02_PREFIX = SCALE_O2_PREFIX + "operation/"
+COMMAND_TOPIC_SUFFIX = "operation/" # Command topics are TOPIC_ROOT + <scale id> + "/operation/" + <command>
+TOPIC_CAPABILITIES = "smfm/opi/capabilities" # Retained: payload formats accepted by this application (JSON)
+TOPIC_ALARMS = "smfm/opi/alarms" # Alarms raised and cleared (JSON, see core/alarms.py)
+
+# Command Pipeline Configuration
+COMMAND_QOS = 1 # MQTT QoS of command messages
+COMMAND_ENVELOPE = False # Wrap payloads as {"cid": ..., "value": ...} (firmware that acknowledges by cid); False sends the plain payloads of older firmware
+COMMAND_ACK_TIMEOUT_S = 2.0 # Time to wait for an ack before sending the command again
+COMMAND_MAX_RETRIES = 2 # Resends before a command counts as not acknowledged (envelope only: plain payloads are never resent)
+COMMAND_CHECK_INTERVAL_MS = 100 # Interval between checks for overdue acks
+
+# Weight Payload Configuration
+WEIGHT_BATCH_MAX_SAMPLES = 64 # Samples per binary weight message announced to the devices (see core/payload.py)
 
 # Plotting Configuration
-MAX_PLOT_POINTS = 300 # Maximum number of points to display on the graph
-PLOT_UPDATE_INTERVAL_MS = 150 # Graph update interval in milliseconds
+MAX_PLOT_POINTS = 100000 # Samples kept per scale for plotting (preallocated, can go up to millions)
+PLOT_UPDATE_INTERVAL_MS = 150 # Initial interval between plot frames in milliseconds (adapted between the bounds below)
+PLOT_MIN_INTERVAL_MS = 50 # Shortest interval between plot frames, used while frames are cheap
+PLOT_MAX_INTERVAL_MS = 1000 # Longest interval between plot frames, reached while frames are slow
+PLOT_FRAME_BUDGET_MS = 30 # Frames (redraw + repaint) slower than this lower the frame rate
+PLOT_USE_OPENGL = False # pyqtgraph OpenGL rendering (needs PyOpenGL and a working GL driver)
+PLOT_ANTIALIAS = False # Antialiased curves look smoother but are much slower to draw
+SCALE_GRID_COLUMNS = 2 # Number of scale frames per row
+
+# Time Alignment Configuration (core/alignment.py)
+DEVICE_CLOCK_WINDOW_S = 60.0 # Device time over which the offset of a device's clock is estimated (tracks drift)
+ALIGN_GRID_STEP_S = 0.1 # Step of the common time grid the scales are resampled onto (total line mass)
+ALIGN_MAX_LAG_S = 2.0 # A scale this far behind stops holding back the grid (its last weight is held)
+ALIGN_MAX_GRID_POINTS = 100000 # Grid points resampled at once; older ones are skipped after a long gap
+
+# Message Batching Configuration
+MQTT_BATCH_INTERVAL_MS = 50 # Interval between batches delivered to the GUI (0 = one signal per message)
+INGEST_SHARDS = 0 # Processes ingesting the weight topics, scales spread among them (0 = all in the GUI process; see core/sharding.py)
+SHARD_RING_HEADROOM = 10000 # Samples a shard can write ahead of the plots in each shared buffer (on top of MAX_PLOT_POINTS)
+BATCH_STATS_INTERVAL_S = 10 # Interval between throughput/latency reports in the log
+
+# Sample Recording Configuration
+RECORDER_ENABLED = True
+RECORDER_DIR = "recordings" # One sub-directory per scale with chunk files and an index
+RECORDER_FLUSH_INTERVAL_S = 1.0 # At most this much data is lost on a crash
+RECORDER_CHUNK_SAMPLES = 1000000 # Samples per chunk file (16 bytes per sample)
+RECORDER_MAX_PENDING_SAMPLES = 200000 # Bound on samples waiting to be written
+
+# Alarm Configuration (core/alarms.py)
+ALARM_QOS = 1 # MQTT QoS of alarm messages
+ALARM_RULES = [ # Evaluated on every sample in the ingest path; "scale" is an id, a list of ids or "*"
+    {"type": "timeout", "scale": "*", "timeout_s": 5.0}, # No sample for 5 s
+    {"type": "stuck", "scale": "*", "window_s": 60.0, "tolerance": 0.0005}, # Weight frozen for a minute
+    {"type": "threshold", "scale": "*", "low": -1.0, "high": 60.0, "hysteresis": 0.5, "delay_s": 1.0},
+    {"type": "rate", "scale": "*", "max_rate": 10.0, "delay_s": 0.5}, # |flow slope| in kg/s
+    # Two scales on the same line: {"type": "divergence", "scales": ["s01", "s02"], "quantity": "flow", "max_diff": 0.5}
+]
+
+# Capture and Replay Configuration (storage/capture.py, mqtt/replay_client.py)
+CAPTURE_DIR = "captures" # --capture writes the raw MQTT traffic to a timestamped sub-directory
+CAPTURE_BUFFER_BYTES = 1 << 20 # Write buffer of a capture file, flushed at every drain of the ingest core
+REPLAY_START_DELAY_S = 2.0 # Time for the window and the shard processes to start and subscribe before a replay begins
+
+# Report Configuration (core/report.py, report.py)
+REPORT_DIR = "reports" # Reports exported from the GUI go to a timestamped sub-directory
+REPORT_SUMMARY_INTERVAL_S = 60.0 # Length of the cached per-scale summary segments (also cut at every status change)
+REPORT_FORMAT = "csv" # "csv", "npz" or "parquet" (needs pyarrow)
+
+# Log Panel Configuration
+LOG_CAPACITY = 20000 # Log lines kept in the panel (the oldest are discarded)
+LOG_FLUSH_INTERVAL_MS = 250 # Interval between batched additions to the log panel
+LOG_RATE_LIMIT_PER_S = 20 # Lines per second allowed per log source before suppression
+LOG_RATE_BURST = 50 # Lines a source may add at once before the rate limit applies
+
+# Flow Rate Configuration
+FLOW_EMA_TAU_S = 1.0 # Time constant of the exponentially smoothed flow rate
+FLOW_WINDOW_SAMPLES = 100 # Samples in the least-squares flow rate (slope) window
+FLOW_THRESHOLD_KG_S = 0.02 # |flow| below this counts as no flow (keeps noise out of the totals)
+
+# Metrics Configuration
+METRICS_HTTP_ENABLED = True # Serve the metrics in Prometheus text format
+METRICS_HTTP_HOST = "127.0.0.1" # Local only; use "0.0.0.0" to allow scraping from other hosts
+METRICS_HTTP_PORT = 9108
+DIAGNOSTICS_REFRESH_INTERVAL_MS = 1000 # Refresh interval of the diagnostics panel while visible
+
+# Headless Ingest Daemon Configuration (daemon.py)
+MQTT_DAEMON_CLIENT_ID = "smfm_ingestd" # Distinct from MQTT_CLIENT_ID so the GUI and the daemon can run side by side
+DAEMON_DRAIN_INTERVAL_S = 0.5 # Interval between drains of the ingest core
@@ -0,0 +1,175 @@
+"""
+Min/max level-of-detail pyramid for drawing long histories of a TimeSeriesBuffer.
+"""
+import numpy as np
+
+
+class _Level:
+    """
+    Min/max envelope of fixed-size blocks of samples, kept in a mirrored ring
+    (same layout as TimeSeriesBuffer) so the newest blocks form one contiguous slice.
+    """
+    def __init__(self, block_size, capacity_blocks):
+        self.block_size = block_size
+        self.capacity = capacity_blocks
+        self.time = np.zeros(2 * capacity_blocks) # Time of the first sample of each block
+        self.low = np.zeros(2 * capacity_blocks)
+        self.high = np.zeros(2 * capacity_blocks)
+        self.count = 0 # Completed blocks ever written
+
+        # Block being filled from the items of the level below
+        self.partial_items = 0
+        self.partial_time = 0.0
+        self.partial_low = 0.0
+        self.partial_high = 0.0
+
+    def push(self, times, lows, highs):
+        n = len(times)
+        if n > self.capacity:
+            skipped = n - self.capacity
+            times, lows, highs = times[skipped:], lows[skipped:], highs[skipped:]
+            self.count += skipped
+            n = self.capacity
+        slots = (self.count + np.arange(n)) % self.capacity
+        self.time[slots] = self.time[slots + self.capacity] = times
+        self.low[slots] = self.low[slots + self.capacity] = lows
+        self.high[slots] = self.high[slots + self.capacity] = highs
+        self.count += n
+
+    def view(self):
+        if self.count < self.capacity:
+            end = self.count
+            return self.time[:end], self.low[:end], self.high[:end]
+        start = self.count % self.capacity
+        end = start + self.capacity
+        return self.time[start:end], self.low[start:end], self.high[start:end]
+
+
+def _reduce_blocks(level, factor, times, lows, highs):
+    """
+    Adds items of the level below into the blocks of level (factor items per block).
+    Returns the (times, lows, highs) of the blocks completed by these items.
+    """
+    done_times, done_lows, done_highs = [], [], []
+    start = 0
+
+    # Finish the block left partially filled by the previous call
+    if level.partial_items:
+        start = min(factor - level.partial_items, len(times))
+        level.partial_low = min(level.partial_low, lows[:start].min())
+        level.partial_high = max(level.partial_high, highs[:start].max())
+        level.partial_items += start
+        if level.partial_items == factor:
+            done_times.append([level.partial_time])
+            done_lows.append([level.partial_low])
+            done_highs.append([level.partial_high])
+            level.partial_items = 0
+
+    # Whole blocks, reduced in one vectorized call
+    full = (len(times) - start) // factor
+    if full:
+        end = start + full * factor
+        starts = np.arange(0, full * factor, factor)
+        done_times.append(times[start:end:factor])
+        done_lows.append(np.minimum.reduceat(lows[start:end], starts))
+        done_highs.append(np.maximum.reduceat(highs[start:end], starts))
+        start = end
+
+    # Leftover items open a new partial block
+    if start < len(times):
+        level.partial_items = len(times) - start
+        level.partial_time = times[start]
+        level.partial_low = lows[start:].min()
+        level.partial_high = highs[start:].max()
+
+    if not done_times:
+        return None
+    return np.concatenate(done_times), np.concatenate(done_lows), np.concatenate(done_highs)
+
+
+class MinMaxPyramid:
+    """
+    Level-of-detail layer over a TimeSeriesBuffer.
+
+    Level k summarizes blocks of factor**k raw samples by their minimum and maximum,
+    so any visible range can be drawn with about max_points vertices while short
+    spikes stay visible. update() consumes the samples appended to the buffer since
+    the last call (amortized O(1) per sample); query() picks the finest level
+    that fits the requested range into max_points.
+    """
+    def __init__(self, capacity, factor=4, min_blocks=256):
+        self._factor = factor
+        self._levels = []
+        block_size = factor
+        while capacity // block_size >= min_blocks:
+            self._levels.append(_Level(block_size, capacity // block_size + 1))
+            block_size *= factor
+        self._consumed = 0 # Raw samples already added to the pyramid
+        self._origin = 0 # Raw sample count at which the blocks start
+
+    def update(self, buffer):
+        """Adds the samples appended to buffer since the previous update."""
+        new = buffer.total_count - self._consumed
+        if new <= 0 or not self._levels:
+            self._consumed = buffer.total_count
+            return
+        if new > len(buffer):
+            # Samples were overwritten before being seen; restart the pyramid at the oldest retained sample
+            self.reset(buffer.total_count - len(buffer))
+            new = len(buffer)
+        times, values = buffer.view()
+        blocks = (times[-new:], values[-new:], values[-new:])
+        for level in self._levels:
+            blocks = _reduce_blocks(level, self._factor, *blocks)
+            if blocks is None:
+                break
+            level.push(*blocks)
+        self._consumed = buffer.total_count
+
+    def reset(self, origin=0):
+        for level in self._levels:
+            level.count = 0
+            level.partial_items = 0
+        self._consumed = origin
+        self._origin = origin
+
+    def query(self, buffer, x_min, x_max, max_points):
+        """
+        Returns (x, y) arrays to draw the samples of buffer in [x_min, x_max] with at most
+        about max_points vertices. Raw samples are returned as views when they fit;
+        otherwise each block contributes its minimum and maximum at the block's start time.
+        """
+        times, values = buffer.view()
+        first = max(0, np.searchsorted(times, x_min, side="left") - 1)
+        last = min(len(times), np.searchsorted(times, x_max, side="right") + 1)
+        if last - first <= max_points:
+            return times[first:last], values[first:last]
+
+        # Finest level whose blocks (two vertices each) fit into max_points
+        level = None
+        for candidate in self._levels:
+            level = candidate
+            if (last - first) // candidate.block_size <= max_points // 2:
+                break
+        if level is None or level.count == 0:
+            return times[first:last], values[first:last]
+
+        block_times, block_lows, block_highs = level.view()
+        n_blocks = len(block_times)
+        start = max(0, np.searchsorted(block_times, x_min, side="left") - 1)
+        end = min(n_blocks, np.searchsorted(block_times, x_max, side="right") + 1)
+        block_times, block_lows, block_highs = block_times[start:end], block_lows[start:end], block_highs[start:end]
+
+        # Raw samples newer than the last completed block are reduced on the fly
+        tail = buffer.total_count - (self._origin + level.count * level.block_size)
+        if 0 < tail <= len(times) and end == n_blocks:
+            tail_values = values[-tail:]
+            block_times = np.append(block_times, times[-tail])
+            block_lows = np.append(block_lows, tail_values.min())
+            block_highs = np.append(block_highs, tail_values.max())
+
+        x = np.repeat(block_times, 2)
+        y = np.empty(len(x))
+        y[0::2] = block_lows
+        y[1::2] = block_highs
+        return x, y
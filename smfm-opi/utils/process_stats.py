@@ -0,0 +1,14 @@
+"""
+Resource usage of the current process, for the benchmark suite and the headless daemon.
+"""
+import os
+
+
+def rss_mb():
+    """Resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        import resource # Not available on Windows; peak RSS is the best approximation elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
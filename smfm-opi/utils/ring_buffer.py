@@ -0,0 +1,77 @@
+"""
+Fixed-capacity, array-backed time series storage for the plotting path.
+"""
+import numpy as np
+
+
+class TimeSeriesBuffer:
+    """
+    Ring buffer of (time, value) samples stored in two preallocated float64 columns.
+
+    Each sample is written twice, at slot i and at slot i + capacity, so the most
+    recent samples always form one contiguous slice. view() therefore returns
+    array views that can be handed to pyqtgraph without any per-frame copy.
+    The views stay valid until the next append overwrites the oldest slot.
+    """
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self._capacity = int(capacity)
+        self._time = np.zeros(2 * self._capacity, dtype=np.float64)
+        self._value = np.zeros(2 * self._capacity, dtype=np.float64)
+        self._count = 0 # Total number of samples ever appended
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def total_count(self):
+        """Number of samples appended since creation, including the ones already overwritten."""
+        return self._count
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def append(self, t, value):
+        """Appends a single sample."""
+        i = self._count % self._capacity
+        self._time[i] = self._time[i + self._capacity] = t
+        self._value[i] = self._value[i + self._capacity] = value
+        self._count += 1
+
+    def extend(self, times, values):
+        """Appends a block of samples with a single vectorized write."""
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        n = len(times)
+        if n == 0:
+            return
+        if n > self._capacity:
+            # Only the newest samples can be kept; skip the ones that would be overwritten.
+            skipped = n - self._capacity
+            times, values = times[skipped:], values[skipped:]
+            self._count += skipped
+            n = self._capacity
+        slots = (self._count + np.arange(n)) % self._capacity
+        self._time[slots] = self._time[slots + self._capacity] = times
+        self._value[slots] = self._value[slots + self._capacity] = values
+        self._count += n
+
+    def view(self):
+        """Returns (times, values) as contiguous views ordered from oldest to newest."""
+        if self._count < self._capacity:
+            return self._time[:self._count], self._value[:self._count]
+        start = self._count % self._capacity
+        end = start + self._capacity
+        return self._time[start:end], self._value[start:end]
+
+    def latest(self):
+        """Returns the newest (time, value) sample, or None if the buffer is empty."""
+        if self._count == 0:
+            return None
+        i = (self._count - 1) % self._capacity
+        return self._time[i], self._value[i]
+
+    def clear(self):
+        self._count = 0
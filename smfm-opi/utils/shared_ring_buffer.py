@@ -0,0 +1,130 @@
+"""
+Time series ring buffers in shared memory, written by one process and mapped read-only by others.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_HEADER_FIELDS = 4 # int64: total sample count, capacity, slots, has a time column
+
+
+class SharedTimeSeriesBuffer:
+    """
+    Ring buffer of (x, value[, time]) samples in a shared memory block, with
+    the mirrored layout of TimeSeriesBuffer: the newest samples always form one
+    contiguous slice, so view() hands out array views without copying.
+
+    One process creates the block (create()); others attach to it by name (attach()),
+    at most one of them as the writer. The writer publishes the sample count after
+    writing the samples. A reader only sees the samples counted at its last refresh(),
+    so total_count, view() and tail() agree with each other between refreshes.
+    The ring has headroom slots beyond capacity: the writer can run that many samples
+    ahead of a reader before it overwrites samples the reader is still showing.
+    Readers get read-only views, valid until the buffer is closed.
+    """
+    def __init__(self, shm, writable, owner):
+        self._shm = shm
+        self._writable = writable
+        self._owner = owner
+        self._header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        self._capacity = int(self._header[1])
+        self._slots = int(self._header[2])
+        n_columns = 3 if self._header[3] else 2
+        columns = np.ndarray(
+            (n_columns, 2 * self._slots), dtype=np.float64, buffer=shm.buf, offset=_HEADER_FIELDS * 8
+        )
+        columns.flags.writeable = writable
+        self._x, self._value = columns[0], columns[1]
+        self._time = columns[2] if n_columns == 3 else None
+        self._count = int(self._header[0])
+
+    @classmethod
+    def create(cls, capacity, headroom, with_times=False):
+        """Allocates a new block and returns a read-only buffer owning it (unlinked by close())."""
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        slots = int(capacity) + int(headroom)
+        n_columns = 3 if with_times else 2
+        shm = shared_memory.SharedMemory(create=True, size=_HEADER_FIELDS * 8 + n_columns * 2 * slots * 8)
+        np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)[:] = (0, capacity, slots, int(with_times))
+        return cls(shm, writable=False, owner=True)
+
+    @classmethod
+    def attach(cls, name, writable=False):
+        """Maps the block created under name."""
+        return cls(shared_memory.SharedMemory(name=name), writable=writable, owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def total_count(self):
+        """Number of samples appended since creation, as of the last refresh() (or extend() for the writer)."""
+        return self._count
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def extend(self, xs, values, times=None):
+        """Appends a block of samples (writer only) and publishes the new count."""
+        if not self._writable:
+            raise ValueError("buffer is mapped read-only")
+        n = len(xs)
+        if n == 0:
+            return
+        count = self._count
+        if n > self._slots:
+            skipped = n - self._slots
+            xs, values = xs[skipped:], values[skipped:]
+            times = times[skipped:] if times is not None else None
+            count += skipped
+            n = self._slots
+        slots = (count + np.arange(n)) % self._slots
+        self._x[slots] = self._x[slots + self._slots] = xs
+        self._value[slots] = self._value[slots + self._slots] = values
+        if self._time is not None:
+            self._time[slots] = self._time[slots + self._slots] = times
+        self._count = count + n
+        self._header[0] = self._count # Published last: readers never count unwritten samples
+
+    def refresh(self):
+        """Takes the writer's current sample count. Returns the number of samples added since the previous refresh."""
+        count = int(self._header[0])
+        new, self._count = count - self._count, count
+        return new
+
+    def _slice(self, n):
+        start = (self._count - n) % self._slots
+        return slice(start, start + n)
+
+    def view(self):
+        """Returns (x, values) as contiguous views ordered from oldest to newest."""
+        window = self._slice(len(self))
+        return self._x[window], self._value[window]
+
+    def tail(self, n):
+        """Returns (x, values, times or None) views of the newest n samples (fewer if not retained)."""
+        window = self._slice(min(n, len(self)))
+        return self._x[window], self._value[window], self._time[window] if self._time is not None else None
+
+    def latest(self):
+        """Returns the newest (x, value) sample, or None if the buffer is empty."""
+        if self._count == 0:
+            return None
+        i = (self._count - 1) % self._slots
+        return self._x[i], self._value[i]
+
+    def close(self):
+        """Unmaps the block; the creating buffer also removes it."""
+        self._header = self._x = self._value = self._time = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass # Views are still in use (e.g. by a plot); the mapping goes away with them
+        if self._owner:
+            self._shm.unlink()